@@ -1,74 +1,67 @@
+import os
+
 import openai
-import time
 from dotenv import load_dotenv
 import gradio as gr
 
+from semar.assistants import RunError, ThreadRegistry, get_or_create_assistant, run_turn
+
 load_dotenv()
 
 # gets API Key from environment variable OPENAI_API_KEY
 client = openai.OpenAI()
 
-assistant = client.beta.assistants.create(
-    name="Math Tutor",
-    instructions="You are a personal math tutor. Write and run code to answer math questions. If user ask you question outside of math, you should ask the user to ask a math question.",
-    tools=[{"type": "code_interpreter"}],
-    model="gpt-4o",
-)
-
-thread = client.beta.threads.create()
-
+ASSISTANT = {
+    "name": "Math Tutor",
+    "instructions": "You are a personal math tutor. Write and run code to answer math questions. If user ask you question outside of math, you should ask the user to ask a math question.",
+    "tools": [{"type": "code_interpreter"}],
+    "model": "gpt-4o",
+}
 
+# Created once and reused on later launches (id kept in assistant_ids.json)
+assistant_id = get_or_create_assistant(client, ASSISTANT)
 
-def main(query):
-    # Simulate the message creation process
-    message = client.beta.threads.messages.create(
-        thread_id=thread.id,
-        role="user",
-        content=query,
-    )
+# One thread per browser session; idle threads are deleted from the API
+threads = ThreadRegistry(
+    client,
+    max_threads=int(os.getenv("SEMAR_MAX_THREADS", 1000)),
+    idle_timeout=int(os.getenv("SEMAR_THREAD_IDLE_SECONDS", 3600))
+)
+threads.start_cleanup(interval=300)
 
-    # Simulate the run creation process
-    run = client.beta.threads.runs.create(   
-        thread_id=thread.id,
-        assistant_id=assistant.id,
-        instructions="Please address the user as User"
-    )
-    
-    while True:
-        # Wait for 5 seconds
-        time.sleep(5)
+# Overall limit for one answer, the run is cancelled after it
+RUN_TIMEOUT = 120
 
-        # Simulate retrieving the run status
-        run_status = client.beta.threads.runs.retrieve(
-            thread_id=thread.id,
-            run_id=run.id
-        )
 
-        # Check if the run is completed
-        if run_status.status == "completed":
-            # Simulate retrieving messages
-            messages = client.beta.threads.messages.list(
-                thread_id=thread.id
+def main(query, request: gr.Request):
+    # Add the query to the session's thread and run the assistant; the run's
+    # stream events end the wait as soon as it finishes (adaptive polling when
+    # streaming is unavailable)
+    try:
+        with threads.thread_for(request.session_hash) as thread_id:
+            messages = run_turn(
+                client, thread_id, assistant_id, query,
+                instructions="Please address the user as User",
+                timeout=RUN_TIMEOUT
             )
+    except RunError as exc:
+        # failed, cancelled, expired, requires_action or timed out
+        return f"Sorry, the answer could not be generated ({exc.status}). Please try again.", None
 
-            response = {"text": "", "image": None}
+    response = {"text": "", "image": None}
 
-            # Process each message
-            for message in messages.data:
-                if message.role == "assistant":  # Accessing as an attribute
-                    for content_block in message.content:
-                        if content_block.type == "text":
-                            response["text"] += content_block.text.value + "\n\n"
-                        elif content_block.type == "image_file":
-                            # Assuming you have a way to access the image via its file ID
-                            image_url = client.beta.files.get_url(content_block.image_file.file_id)
-                            response["image"] = image_url
-            
-            # Return a tuple of text and image
-            return response["text"], response["image"]
+    # Process each message
+    for message in messages:
+        for content_block in message.content:
+            if content_block.type == "text":
+                response["text"] += content_block.text.value + "\n\n"
+            elif content_block.type == "image_file":
+                # Assuming you have a way to access the image via its file ID
+                image_url = client.beta.files.get_url(content_block.image_file.file_id)
+                response["image"] = image_url
 
-        else:
-            continue
+    # Return a tuple of text and image
+    return response["text"], response["image"]
 
 # Gradio Interface to handle both text and image
 iface = gr.Interface(
@@ -77,5 +70,5 @@ iface = gr.Interface(
     outputs=["text", "image"], 
     title="Math Tutor",
 )
-iface.launch()
+iface.queue(default_concurrency_limit=int(os.getenv("GRADIO_CONCURRENCY_LIMIT", "16"))).launch()
                     
\ No newline at end of file
@@ -0,0 +1,151 @@
+# Class-wide burst: a lab of students presses "send" together while one chatty
+# student has already fired a handful of questions. The fake model sits behind a
+# provider limit (beyond `capacity` concurrent requests it answers 429) and each
+# turn retries 429s with jittered backoff, like the resilient caller.
+#   no admission   every turn goes to the provider at once
+#   FIFO cap       AdmissionController with one queue for everybody
+#   fair cap       AdmissionController with a queue per student (round-robin)
+#                  and at most --per-student slots per student
+# Reports failed turns (regular students and the chatty one), 429s, latency of the regular students' turns, queue
+# depth and wait, and how many queue position updates were shown.
+# Run from src/:  python -m benchmarks.bench_admission --students 60
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.loadtest import percentile
+from semar.admission import AdmissionController, AdmissionRejected
+from semar.resilience import backoff_delay
+
+
+class RateLimited(Exception):
+    pass
+
+
+class Provider:
+    """The fake model behind a limit on concurrent requests."""
+
+    def __init__(self, llm, capacity, reject_latency):
+        self.llm = llm
+        self.capacity = capacity
+        self.reject_latency = reject_latency
+        self.active = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def call(self, prompt):
+        with self._lock:
+            admitted = self.active < self.capacity
+            if admitted:
+                self.active += 1
+            else:
+                self.rate_limited += 1
+        if not admitted:
+            time.sleep(self.reject_latency)
+            raise RateLimited()
+        try:
+            return self.llm.invoke(prompt)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def call_with_retries(provider, prompt, retries, backoff_base):
+    for attempt in range(retries + 1):
+        try:
+            return provider.call(prompt)
+        except RateLimited:
+            if attempt == retries:
+                raise
+            time.sleep(backoff_delay(attempt, base=backoff_base, cap=backoff_base * 40))
+
+
+def run_mode(mode, args):
+    llm = FakeChatModel(time_scale=args.time_scale)
+    provider = Provider(llm, args.capacity, reject_latency=0.2 * args.time_scale)
+    controller = None
+    if mode != "no admission":
+        controller = AdmissionController(
+            max_concurrent=args.capacity, max_queue=args.max_queue,
+            timeout=120 * args.time_scale, poll_interval=0.05,
+            max_per_student=args.per_student if mode == "fair cap" else None
+        )
+    # (student, arrival offset); the chatty student's questions are already in
+    turns = [("chatty", 0.0)] * args.chatty_turns
+    turns += [(f"S{n:03d}", random.uniform(0.01, 0.5) * args.time_scale) for n in range(args.students)]
+    results = []
+    position_updates = [0]
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def turn(student, offset):
+        time.sleep(offset)
+        begin = time.perf_counter()
+        key = "everyone" if mode == "FIFO cap" else student
+        outcome = "ok"
+        try:
+            if controller is not None:
+                def on_wait(position):
+                    with lock:
+                        position_updates[0] += 1
+                with controller.admit(key, on_wait):
+                    call_with_retries(provider, "Bagaimana menghubungkan DHT22?", args.retries, args.time_scale)
+            else:
+                call_with_retries(provider, "Bagaimana menghubungkan DHT22?", args.retries, args.time_scale)
+        except RateLimited:
+            outcome = "429"
+        except AdmissionRejected as exc:
+            outcome = exc.reason
+        with lock:
+            results.append((student, outcome, time.perf_counter() - begin))
+
+    with ThreadPoolExecutor(max_workers=len(turns)) as pool:
+        for student, offset in turns:
+            pool.submit(turn, student, offset)
+    elapsed = time.perf_counter() - start
+
+    regular = [latency for student, outcome, latency in results if student != "chatty" and outcome == "ok"]
+    snapshot = controller.snapshot() if controller is not None else {}
+    return {
+        'failed': sum(1 for student, outcome, _ in results if student != "chatty" and outcome != "ok"),
+        'chatty_failed': sum(1 for student, outcome, _ in results if student == "chatty" and outcome != "ok"),
+        'rate_limited': provider.rate_limited,
+        'p50': percentile(regular, 50) if regular else float('nan'),
+        'p95': percentile(regular, 95) if regular else float('nan'),
+        'max': max(regular) if regular else float('nan'),
+        'elapsed': elapsed,
+        'max_depth': snapshot.get('max_depth', 0),
+        'wait_p95': snapshot.get('wait_p95_s', 0.0),
+        'position_updates': position_updates[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', type=int, default=60)
+    parser.add_argument('--chatty-turns', type=int, default=10)
+    parser.add_argument('--capacity', type=int, default=8, help="concurrent requests before the provider answers 429")
+    parser.add_argument('--per-student', type=int, default=2, help="slots one student may hold (fair cap)")
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--max-queue', type=int, default=200)
+    parser.add_argument('--time-scale', type=float, default=0.1, help="scales every latency and backoff")
+    args = parser.parse_args()
+
+    print(f"{args.students} students + {args.chatty_turns} turns of one chatty student, "
+          f"provider capacity {args.capacity}, time scale {args.time_scale}")
+    print(f"{'mode':>13} {'failed':>7} {'chatty':>7} {'429s':>6} {'p50':>7} {'p95':>7} {'max':>7} {'total':>7} "
+          f"{'depth':>6} {'wait p95':>9} {'pos. updates':>13}")
+    for mode in ("no admission", "FIFO cap", "fair cap"):
+        random.seed(7)
+        r = run_mode(mode, args)
+        print(f"{mode:>13} {r['failed']:7d} {r['chatty_failed']:7d} {r['rate_limited']:6d} {r['p50']:6.2f}s {r['p95']:6.2f}s {r['max']:6.2f}s "
+              f"{r['elapsed']:6.2f}s {r['max_depth']:6d} {r['wait_p95']:8.2f}s {r['position_updates']:13d}")
+    print("(failed: regular students' turns, chatty: the chatty student's; latencies are for the "
+          "regular students' answered turns, in scaled seconds)")
+
+
+if __name__ == "__main__":
+    main()
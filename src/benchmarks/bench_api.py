@@ -0,0 +1,129 @@
+# Semar-Bot turns through the API (semar.api, HTTP + Server-Sent Events) against
+# the same ChatService called in-process, for many students at once: time to
+# the first streamed text, full turn latency, throughput, and whether every
+# turn was stored. Uses the local FakeChatModel and mongomock (one uvicorn
+# process here, mongomock cannot be shared between worker processes).
+# Run from src/:  python -m benchmarks.bench_api --students 10,50,200
+import argparse
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import uvicorn
+from bson.objectid import ObjectId
+
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.loadtest import QUERIES, get_collection, percentile
+from semar.api import ChatService, create_app
+from semar.client import SemarClient
+from semar.prompts import get_prompt_registry
+
+
+class FirstChunk:
+    # stream_container that notes when the first text arrived
+    def __init__(self):
+        self.first = None
+
+    def write_stream(self, deltas):
+        parts = []
+        for delta in deltas:
+            if self.first is None:
+                self.first = time.perf_counter()
+            parts.append(delta)
+        return "".join(parts)
+
+
+class Direct:
+    # The service without HTTP, same calls as SemarClient
+    def __init__(self, service):
+        self.service = service
+
+    def start_session(self, student_id, student_name, resume=None):
+        return self.service.start_session(student_id, student_name, resume=resume)
+
+    def stream_turn(self, session_id, query):
+        stream = FirstChunk()
+        self.service.run_turn(ObjectId(session_id), query, stream)
+        yield stream.first
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def simulate_student(api, student, turns, think_time, ttfts, latencies):
+    session = api.start_session(f"API{student:04d}-{random.random():.6f}", "Bench", resume=False)
+    for turn in range(turns):
+        time.sleep(random.uniform(0, think_time))
+        start = time.perf_counter()
+        first = None
+        for delta in api.stream_turn(session['session_id'], QUERIES[turn % len(QUERIES)]):
+            if first is None:
+                # Direct yields the time of the first chunk once the turn is done
+                first = delta if isinstance(api, Direct) else time.perf_counter()
+        ttfts.append(first - start)
+        latencies.append(time.perf_counter() - start)
+    return session['session_id']
+
+
+def run_level(api, collection, students, args):
+    ttfts, latencies = [], []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=students) as pool:
+        futures = [
+            pool.submit(simulate_student, api, student, args.turns, args.think_time, ttfts, latencies)
+            for student in range(students)
+        ]
+        session_ids = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+    # Greeting + a question and an answer per turn
+    stored = sum(
+        1 for session_id in session_ids
+        for document in collection.aggregate([
+            {'$match': {'_id': ObjectId(session_id)}},
+            {'$project': {'count': {'$size': '$chat_history'}}},
+        ])
+        if document['count'] == 1 + 2 * args.turns
+    )
+    return {
+        'ttft_p50': percentile(ttfts, 50), 'ttft_p95': percentile(ttfts, 95),
+        'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+        'throughput': len(latencies) / elapsed, 'stored': stored,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', default="10,50,200")
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--think-time', type=float, default=1.0)
+    parser.add_argument('--time-scale', type=float, default=0.2, help="scales the fake model's latency")
+    parser.add_argument('--db-latency', type=float, default=0.002)
+    args = parser.parse_args()
+
+    collection, backend = get_collection(args.db_latency)
+    llm = FakeChatModel(time_scale=args.time_scale, output_tokens_mean=120)
+    service = ChatService(collection, get_prompt_registry(), llm=llm)
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(service, turn_threads=256), port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    client = SemarClient(f"http://127.0.0.1:{port}", max_connections=256)
+
+    print(f"MongoDB: {backend}, {args.turns} turns per student")
+    print(f"{'students':>8} {'mode':>10} {'ttft p50':>9} {'ttft p95':>9} {'p50':>7} {'p95':>7} {'turns/s':>8} {'stored':>7}")
+    for students in [int(n) for n in args.students.split(",")]:
+        for mode, api in (("in-process", Direct(service)), ("HTTP+SSE", client)):
+            r = run_level(api, collection, students, args)
+            print(f"{students:>8} {mode:>10} {r['ttft_p50']:8.3f}s {r['ttft_p95']:8.3f}s {r['p50']:6.2f}s "
+                  f"{r['p95']:6.2f}s {r['throughput']:8.1f} {r['stored']:>4}/{students}")
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
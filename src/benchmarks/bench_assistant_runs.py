@@ -0,0 +1,67 @@
+# Time from query to answer and API requests per turn for the Assistants samples:
+# the old fixed 5 s polling, adaptive polling and run streaming, against the local
+# fake Assistants server. Also checks that failed, expired, requires_action and
+# overlong runs end instead of spinning.
+# Run from src/:  python -m benchmarks.bench_assistant_runs
+import time
+
+import openai
+
+from benchmarks.fake_assistants import FakeAssistantsServer
+from semar.assistants import RunError, run_turn
+
+
+def fixed_polling(client, thread_id, assistant_id, query, timeout):
+    # What main() did before (bounded here, the old loop only stopped on "completed")
+    client.beta.threads.messages.create(thread_id=thread_id, role="user", content=query)
+    run = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(5)
+        if client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id).status == "completed":
+            return list(client.beta.threads.messages.list(thread_id=thread_id))
+    raise RunError(run.id, 'spinning', "still polling at the timeout")
+
+
+def measure(server, client, assistant_id, name, turn, timeout):
+    thread = client.beta.threads.create()
+    before = server.stats
+    start = time.perf_counter()
+    try:
+        turn(client, thread.id, assistant_id, "What is the derivative of x^2?", timeout=timeout)
+        outcome = "answer"
+    except RunError as exc:
+        outcome = exc.status
+    elapsed = time.perf_counter() - start
+    after = server.stats
+    requests = sum(after.values()) - sum(before.values())
+    print(f"{name:>16}: {elapsed:6.2f} s  {requests:3d} requests  -> {outcome}")
+
+
+def main():
+    modes = [
+        ("fixed 5 s poll", fixed_polling),
+        ("adaptive poll", lambda *args, **kwargs: run_turn(*args, stream=False, **kwargs)),
+        ("stream", run_turn),
+    ]
+    with FakeAssistantsServer() as server:
+        client = openai.OpenAI(base_url=server.base_url, api_key="sk-bench", max_retries=0)
+        assistant = client.beta.assistants.create(name="Math Tutor", model="gpt-4o")
+        for duration in (1.0, 3.0, 8.0):
+            server.configure(run_duration=duration, final_status="completed")
+            print(f"run takes {duration} s")
+            for name, turn in modes:
+                measure(server, client, assistant.id, name, turn, timeout=30)
+        for status in ("failed", "expired", "requires_action"):
+            server.configure(run_duration=1.0, final_status=status)
+            print(f"run ends as {status}")
+            for name, turn in modes:
+                measure(server, client, assistant.id, name, turn, timeout=12)
+        server.configure(run_duration=60.0, final_status="completed")
+        print("run takes 60 s, timeout 5 s")
+        for name, turn in modes[1:]:
+            measure(server, client, assistant.id, name, turn, timeout=5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Concurrent users of the Assistants samples: one shared thread (the old
+# module-level thread) against a thread per user from ThreadRegistry, on the
+# local fake Assistants server. With one thread, a user's message lands while
+# another user's run is active and turns have to wait for each other (here a
+# shared lock stands in for that wait); with a thread per user they overlap.
+# Also checks assistant reuse across launches and LRU/idle cleanup.
+# Run from src/:  python -m benchmarks.bench_assistant_threads
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+from benchmarks.fake_assistants import FakeAssistantsServer
+from semar.assistants import ThreadRegistry, get_or_create_assistant, run_turn
+
+ASSISTANT = {"name": "Math Tutor", "instructions": "You are a personal math tutor.", "model": "gpt-4o"}
+USERS = 20
+TURNS = 3
+
+
+def shared_thread(client, assistant_id):
+    thread_id = client.beta.threads.create().id
+    lock = threading.Lock()
+
+    def turn(user, query):
+        with lock:
+            return run_turn(client, thread_id, assistant_id, query)
+    return turn
+
+
+def thread_per_user(client, assistant_id, registry):
+    def turn(user, query):
+        with registry.thread_for(user) as thread_id:
+            return run_turn(client, thread_id, assistant_id, query)
+    return turn
+
+
+def measure(name, turn):
+    def user_session(user):
+        latencies = []
+        for i in range(TURNS):
+            start = time.perf_counter()
+            turn(user, f"question {i} from {user}")
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=USERS) as pool:
+        latencies = sorted(sum(pool.map(user_session, [f"user-{n}" for n in range(USERS)]), []))
+    elapsed = time.perf_counter() - start
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:>16}: {elapsed:6.2f} s total  p50 {latencies[len(latencies) // 2]:5.2f} s  p95 {p95:5.2f} s")
+
+
+def main():
+    with FakeAssistantsServer(run_duration=0.5) as server, tempfile.TemporaryDirectory() as tmp:
+        client = openai.OpenAI(base_url=server.base_url, api_key="sk-bench", max_retries=0)
+        path = os.path.join(tmp, "assistant_ids.json")
+        ids = [get_or_create_assistant(client, ASSISTANT, path) for _ in range(3)]
+        print(f"3 launches: {server.stats.get('assistants.create', 0)} assistants created, "
+              f"{server.stats.get('assistants.retrieve', 0)} reused, same id: {len(set(ids)) == 1}")
+        assistant_id = ids[0]
+
+        print(f"{USERS} users x {TURNS} turns, runs take 0.5 s")
+        measure("shared thread", shared_thread(client, assistant_id))
+        registry = ThreadRegistry(client, max_threads=USERS, idle_timeout=0.5)
+        measure("thread per user", thread_per_user(client, assistant_id, registry))
+        kept = len(registry)
+        time.sleep(0.6)
+        print(f"idle cleanup: {registry.cleanup()} of {kept} threads deleted, {len(registry)} left")
+
+        registry = ThreadRegistry(client, max_threads=4, idle_timeout=3600)
+        for n in range(10):
+            with registry.thread_for(f"user-{n}"):
+                pass
+        print(f"LRU with max 4: {len(registry)} kept, {registry.cleanup()} evicted threads deleted; "
+              f"threads created {server.stats.get('threads.create', 0)}, deleted {server.stats.get('threads.delete', 0)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Server CPU and bytes sent per streamed answer in the Gradio front-end: one
+# update per token (accumulated string yielded for every chunk) vs. updates
+# coalesced every 50 ms / 200 characters. The token stream runs on a simulated
+# clock, so only the CPU spent on building and encoding the updates is measured.
+# Bytes are counted for a full-text payload per update and for Gradio's diff
+# payload (only the appended text).
+# Run from src/:  python -m benchmarks.bench_gradio_stream --tokens 1500
+import argparse
+import json
+import time
+
+from semar.streaming import coalesce_text
+
+
+CODE_LINE = "    client.publish(\"semar/suhu\", String(dht.readTemperature()).c_str());  // kirim suhu\n"
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def token_stream(tokens, tokens_per_second, clock):
+    # ~4 characters per token, like the code answers of PART 2
+    text = CODE_LINE * (tokens * 4 // len(CODE_LINE) + 1)
+    for i in range(tokens):
+        clock.now += 1 / tokens_per_second
+        yield text[i * 4:(i + 1) * 4]
+
+
+def per_chunk(deltas):
+    # What generate_response did before
+    partial_message = ""
+    for delta in deltas:
+        partial_message = partial_message + delta
+        yield partial_message
+
+
+def measure(name, updates):
+    previous = ""
+    count = full_bytes = diff_bytes = 0
+    start = time.process_time()
+    for text in updates:
+        count += 1
+        full_bytes += len(json.dumps({'data': [text]}))
+        diff_bytes += len(json.dumps({'data': [[["append", [], text[len(previous):]]]]}))
+        previous = text
+    cpu_ms = (time.process_time() - start) * 1000
+    print(f"{name:>12}: {count:6d} updates  {cpu_ms:8.1f} ms CPU  "
+          f"{full_bytes / 1024:9.1f} KB full  {diff_bytes / 1024:7.1f} KB diff")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens', type=int, default=1500)
+    parser.add_argument('--tokens-per-second', type=float, default=80.0)
+    parser.add_argument('--interval', type=float, default=0.05)
+    parser.add_argument('--max-chars', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"answer of {args.tokens} tokens at {args.tokens_per_second} tokens/s")
+    measure("per chunk", per_chunk(token_stream(args.tokens, args.tokens_per_second, SimulatedClock())))
+    clock = SimulatedClock()
+    measure("coalesced", coalesce_text(token_stream(args.tokens, args.tokens_per_second, clock),
+                                       args.interval, args.max_chars, clock=clock))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Input tokens per turn with the full chat history vs. the compacted history,
+# replayed over recorded sessions.
+# Run from src/:  python -m benchmarks.bench_history_compaction [sessions.jsonl] [--limit N]
+# Without a file, sessions are read from the `sessions` collection at MONGODB_URI.
+import argparse
+import json
+import os
+
+from semar.history import HistoryCompactor, new_history_summary
+from semar.resources import get_token_ledger
+
+
+MODEL = "gpt-4o-mini"
+# Stand-in for the static template, its size is the same with or without compaction
+TEMPLATE_TOKENS = 2000
+
+
+def load_sessions(path, limit):
+    if path:
+        with open(path) as f:
+            sessions = [json.loads(line) for line in f if line.strip()]
+        return sessions[:limit]
+    from pymongo import MongoClient
+    collection = MongoClient(os.getenv("MONGODB_URI"))["semar_bot_db"]["sessions"]
+    query = {'chat_history.4': {'$exists': True}}
+    return list(collection.find(query, {'chat_history': 1}).sort('created_at', -1).limit(limit))
+
+
+def replay(session, compactor, ledger):
+    # Returns (full, compacted) input tokens for every user turn of the session
+    history = session.get('chat_history') or []
+    summary = new_history_summary()
+    full, compacted = [], []
+    for i, message in enumerate(history):
+        if message.get('role') != 'user':
+            continue
+        turn_history = history[:i + 1]
+        full.append(TEMPLATE_TOKENS + sum(ledger.message_tokens(m) for m in turn_history))
+        summary_message, window = compactor.compact(turn_history, summary)
+        sent = ([summary_message] if summary_message else []) + window
+        compacted.append(TEMPLATE_TOKENS + sum(ledger.message_tokens(m) for m in sent))
+    return full, compacted
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?', help="JSONL export of session documents")
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--keep-turns', type=int, default=3)
+    parser.add_argument('--budget', type=int, default=3000)
+    args = parser.parse_args()
+
+    ledger = get_token_ledger(MODEL)
+    compactor = HistoryCompactor(ledger, args.keep_turns, args.budget)
+    total_full = total_compacted = turns = 0
+    longest = []
+    for session in load_sessions(args.path, args.limit):
+        full, compacted = replay(session, compactor, ledger)
+        total_full += sum(full)
+        total_compacted += sum(compacted)
+        turns += len(full)
+        if len(full) > len(longest):
+            longest = list(zip(full, compacted))
+
+    if not turns:
+        print("No recorded turns found")
+        return
+    print(f"{turns} turns, keep_turns={args.keep_turns}, budget={args.budget}")
+    print(f"input tokens full history: {total_full}")
+    print(f"input tokens compacted:    {total_compacted} ({1 - total_compacted / total_full:.1%} less)")
+    print("longest session, per turn (full -> compacted):")
+    for turn, (full, compacted) in enumerate(longest, 1):
+        print(f"{turn:>4}: {full:>7} -> {compacted:>7}")
+
+
+if __name__ == "__main__":
+    main()
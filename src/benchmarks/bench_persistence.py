@@ -0,0 +1,55 @@
+# Bytes sent per turn when saving a session: "rewrite" ($set chat_history) vs "append" ($push $each).
+# Uses mongomock when installed, otherwise the mongod at MONGODB_URI (default localhost).
+# Run from src/:  python -m benchmarks.bench_persistence
+import os
+
+import bson
+
+from semar.persistence import build_turn_update, read_chat_history, save_turn
+
+
+TURNS = 100
+USER_TEXT = "Sensor DHT22 saya pakai pin D4, apakah perlu resistor pull-up?"
+AI_TEXT = "Ya, gunakan resistor 10k ohm antara VCC dan DATA.\n```cpp\n#include <DHT.h>\n```\n" * 10
+
+
+def get_collection():
+    try:
+        import mongomock
+        return mongomock.MongoClient()["semar_bench"]["sessions"], "mongomock"
+    except ImportError:
+        from pymongo import MongoClient
+        uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+        return MongoClient(uri)["semar_bench"]["sessions"], uri
+
+
+def run(collection, mode):
+    session_id = collection.insert_one({'chat_history': []}).inserted_id
+    history = [{'role': 'assistant', 'content': "Halo! Saya Semar-Bot.", 'token_count': 8}]
+    persisted = 0
+    sizes = []
+    for turn in range(TURNS):
+        history.append({'role': 'user', 'content': USER_TEXT, 'token_count': 20})
+        history.append({'role': 'assistant', 'content': AI_TEXT, 'token_count': 300})
+        usage = {'timestamp': "2024-09-01 10:00:00", 'input_tokens': 2000, 'output_tokens': 300, 'total_tokens': 2300}
+        update = build_turn_update(history, persisted, 2000, 300, usage, mode)
+        sizes.append(len(bson.encode({'q': {'_id': session_id}, 'u': update})))
+        persisted = save_turn(collection, session_id, history, persisted, 2000, 300, usage, mode)
+
+    stored = read_chat_history(collection.find_one({'_id': session_id}))
+    assert [m['content'] for m in stored] == [m['content'] for m in history], "stored history differs"
+    return sizes
+
+
+def main():
+    collection, target = get_collection()
+    print(f"{TURNS} turns against {target}")
+    print(f"{'mode':>8} {'turn 1':>10} {'turn 50':>10} {'turn 100':>10} {'session total':>14}  (bytes)")
+    for mode in ("rewrite", "append"):
+        sizes = run(collection, mode)
+        print(f"{mode:>8} {sizes[0]:>10} {sizes[49]:>10} {sizes[99]:>10} {sum(sizes):>14}")
+    collection.drop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Turn latency and failures under 429s and a slow tail, for the plain client,
+# the client's own retries, and the ResilientCaller (backoff from the rate-limit
+# headers, shared token bucket, hedged requests), against the local stub LLM.
+# Run from src/:  python -m benchmarks.bench_resilience --students 20 --error-rate 0.2
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_openai import ChatOpenAI
+
+from benchmarks.loadtest import percentile
+from benchmarks.stub_openai import StubOpenAIServer
+from semar.resilience import ResilientCaller
+
+
+MODEL = "gpt-4o-mini"
+PROMPT = ChatPromptTemplate.from_template("CONTEXT: You are an IoT Setup Assistant.\nUSER QUERY: {query}")
+INPUTS = {'query': "Wifi atau GSM?"}
+
+
+def build_chain(base_url, timeout, max_retries):
+    llm = ChatOpenAI(model_name=MODEL, base_url=base_url, api_key="sk-bench",
+                     request_timeout=timeout, max_retries=max_retries)
+    return PROMPT | llm | StrOutputParser()
+
+
+def run(name, invoke, args):
+    latencies = []
+    failures = 0
+
+    def student(_):
+        nonlocal failures
+        for _ in range(args.turns):
+            start = time.perf_counter()
+            try:
+                invoke(INPUTS)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                failures += 1
+
+    with ThreadPoolExecutor(max_workers=args.students) as pool:
+        list(pool.map(student, range(args.students)))
+    if latencies:
+        print(f"{name:>16}: {len(latencies):>5} ok {failures:>4} failed  p50 {percentile(latencies, 50):6.2f}s  "
+              f"p95 {percentile(latencies, 95):6.2f}s  p99 {percentile(latencies, 99):6.2f}s")
+    else:
+        print(f"{name:>16}: all {failures} turns failed")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', type=int, default=20)
+    parser.add_argument('--turns', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--error-rate', type=float, default=0.2, help="share of requests answered with 429")
+    parser.add_argument('--slow-rate', type=float, default=0.05, help="share of requests in the slow tail")
+    parser.add_argument('--slow-latency', type=float, default=3.0)
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--rpm', type=int, default=0, help="client-side requests per minute, 0 for no limit")
+    args = parser.parse_args()
+
+    with StubOpenAIServer(latency=args.latency, error_rate=args.error_rate, retry_after=0.3,
+                          slow_rate=args.slow_rate, slow_latency=args.slow_latency) as server:
+        print(f"stub: {args.latency}s latency, {args.error_rate:.0%} 429s, "
+              f"{args.slow_rate:.0%} +{args.slow_latency}s; {args.students} students x {args.turns} turns")
+        plain = build_chain(server.base_url, args.timeout, 0)
+        run("no retries", plain.invoke, args)
+        client_retries = build_chain(server.base_url, args.timeout, 3)
+        run("client retries", client_retries.invoke, args)
+        caller = ResilientCaller(timeout=args.timeout, retries=3, requests_per_minute=args.rpm or None,
+                                 hedge=True, max_workers=args.students * 2)
+        run("resilient", lambda inputs: caller.call(plain.invoke, inputs), args)
+        print(f"{'':>16}  {caller.stats}")
+        print(f"{'':>16}  server: {server.stats}")
+
+
+if __name__ == "__main__":
+    main()
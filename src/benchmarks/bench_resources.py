@@ -0,0 +1,58 @@
+# Per-turn overhead of building the prompt, ChatOpenAI client, chain and tiktoken
+# encoder on every call vs. reusing the process-wide resources, against a local stub LLM.
+# Run from src/:  python -m benchmarks.bench_resources
+import time
+
+import tiktoken
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_openai import ChatOpenAI
+
+from benchmarks.stub_openai import StubOpenAIServer
+from semar.resources import clear_resources, get_chat_resources
+
+
+MODEL = "gpt-4o-mini"
+TURNS = 50
+TEMPLATE = "CONTEXT: You are an IoT Setup Assistant.\n" * 150 + "USER QUERY: {query}\nCHAT HISTORY: {chat_history}\n"
+INPUTS = {'query': "Wifi atau GSM?", 'chat_history': []}
+
+
+def per_turn_rebuild(base_url):
+    # What get_response did before: everything is built again on every turn
+    prompt = ChatPromptTemplate.from_template(TEMPLATE)
+    llm = ChatOpenAI(model_name=MODEL, base_url=base_url, api_key="sk-bench")
+    chain = prompt | llm | StrOutputParser()
+    response = chain.invoke(INPUTS)
+    tiktoken.encoding_for_model(MODEL).encode(response)
+    tiktoken.encoding_for_model(MODEL).encode(INPUTS['query'])
+
+
+def cached_resources(base_url):
+    resources = get_chat_resources(MODEL, "bench", TEMPLATE, base_url=base_url, api_key="sk-bench")
+    response = resources.chain.invoke(INPUTS)
+    resources.token_ledger.count(response)
+    resources.token_ledger.count(INPUTS['query'])
+
+
+def measure(name, turn):
+    clear_resources()
+    with StubOpenAIServer() as server:
+        turn(server.base_url)  # warm-up (imports, first connection)
+        start = time.perf_counter()
+        for _ in range(TURNS):
+            turn(server.base_url)
+        elapsed = time.perf_counter() - start
+        stats = server.stats
+    print(f"{name:>18}: {elapsed / TURNS * 1000:7.2f} ms/turn, "
+          f"{stats['connections']} connections for {stats['requests']} requests")
+
+
+def main():
+    print(f"{TURNS} turns against a local stub LLM with zero latency")
+    measure("rebuild per turn", per_turn_rebuild)
+    measure("cached resources", cached_resources)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# Per-turn token counting cost: full prompt re-encode vs. the incremental TokenLedger.
+# Run from src/:  python -m benchmarks.bench_token_ledger
+import time
+
+import tiktoken
+
+from semar.tokens import TokenLedger
+
+
+MODEL = "gpt-4o-mini"
+TURNS = 200
+REPEAT = 5
+
+# Roughly the size of the v1.6 template (~8 KB)
+TEMPLATE = "CONTEXT: You are an IoT Setup Assistant. Please follow the PROJECT REQUIREMENT TEMPLATE.\n" * 90
+USER_TEXT = "Saya ingin membuat pemanas air berbasis IoT dengan ESP32 dan DHT22, pakai Wifi dan MQTT."
+AI_TEXT = (
+    "1. **Idea (Confirmed)** ✅\n2. **Processing Board:** ESP32\n"
+    "```cpp\n#include <DHT.h>\nvoid setup() { Serial.begin(115200); }\nvoid loop() { delay(2000); }\n```\n"
+) * 6
+
+
+def full_reencode(encoding, history, query):
+    # The counting code get_response used before the ledger
+    parts = [TEMPLATE]
+    for msg in history:
+        role = "User" if msg['role'] == 'user' else "Assistant"
+        parts.append(f"{role}: {msg['content']}")
+    parts.append(f"User: {query}")
+    return len(encoding.encode("\n".join(parts)))
+
+
+def run(count_turn):
+    # Returns the time spent counting at each turn of one session
+    history = []
+    timings = []
+    for _ in range(TURNS):
+        history.append({'role': 'user', 'content': USER_TEXT})
+        start = time.perf_counter()
+        count_turn(history, USER_TEXT)
+        timings.append(time.perf_counter() - start)
+        history.append({'role': 'assistant', 'content': AI_TEXT})
+    return timings
+
+
+def main():
+    encoding = tiktoken.encoding_for_model(MODEL)
+    ledger = TokenLedger(MODEL)
+
+    def ledger_turn(history, query):
+        # New messages are encoded once here, as the input handler does
+        return ledger.input_tokens("bench", TEMPLATE, history, ledger.count(query))
+
+    results = {
+        'full re-encode': [run(lambda h, q: full_reencode(encoding, h, q)) for _ in range(REPEAT)],
+        'token ledger': [run(ledger_turn) for _ in range(REPEAT)],
+    }
+
+    print(f"Per-turn counting time (ms), best of {REPEAT}, {TURNS}-turn session")
+    print(f"{'turn':>6} " + " ".join(f"{name:>16}" for name in results))
+    for turn in (1, 10, 50, 100, 150, 200):
+        row = [min(r[turn - 1] for r in runs) * 1000 for runs in results.values()]
+        print(f"{turn:>6} " + " ".join(f"{value:>16.3f}" for value in row))
+    for name, runs in results.items():
+        total = min(sum(r) for r in runs) * 1000
+        print(f"{name}: {total:.1f} ms for the whole session")
+
+
+if __name__ == "__main__":
+    main()
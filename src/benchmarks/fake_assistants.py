@@ -0,0 +1,244 @@
+# Local stand-in for the Assistants API (assistants, threads, messages, runs, run streaming),
+# used to exercise run completion without the real service. A run takes
+# `run_duration` seconds and then ends in `final_status`. With `cut_stream` the
+# run stream is closed after its in_progress event, the run itself goes on.
+# Point openai.OpenAI at it with base_url=server.base_url and any api_key.
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+REPLY = "The derivative of x^2 is 2x."
+
+_ids = itertools.count(1)
+
+
+def new_id(prefix):
+    return f"{prefix}_{next(_ids):06d}"
+
+
+class FakeAssistantsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _count(self, name):
+        with self.server.lock:
+            self.server.stats[name] = self.server.stats.get(name, 0) + 1
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._body()
+        if path.endswith("/assistants"):
+            self._count('assistants.create')
+            return self._send_json({'id': new_id("asst"), 'object': "assistant", 'created_at': int(time.time()),
+                                    'model': body.get('model'), 'name': body.get('name'), 'tools': [],
+                                    'instructions': body.get('instructions')})
+        match = re.search(r"/assistants/([^/]+)$", path)
+        if match:
+            self._count('assistants.update')
+            return self._send_json({'id': match.group(1), 'object': "assistant", 'created_at': int(time.time()),
+                                    'model': body.get('model'), 'name': body.get('name'), 'tools': [],
+                                    'instructions': body.get('instructions')})
+        if path.endswith("/threads"):
+            self._count('threads.create')
+            thread_id = new_id("thread")
+            with self.server.lock:
+                self.server.messages[thread_id] = []
+            return self._send_json({'id': thread_id, 'object': "thread", 'created_at': int(time.time()), 'metadata': {}})
+        match = re.search(r"/threads/([^/]+)/messages$", path)
+        if match:
+            self._count('messages.create')
+            message = self.server.message(match.group(1), "user", body.get('content', ""), None)
+            return self._send_json(message)
+        match = re.search(r"/threads/([^/]+)/runs/([^/]+)/cancel$", path)
+        if match:
+            self._count('runs.cancel')
+            run = self.server.runs[match.group(2)]
+            run['cancelled'] = True
+            return self._send_json(self.server.run_object(run))
+        match = re.search(r"/threads/([^/]+)/runs$", path)
+        if match:
+            self._count('runs.create')
+            run = self.server.create_run(match.group(1), body.get('assistant_id'))
+            if body.get('stream'):
+                return self._stream_run(run)
+            return self._send_json(self.server.run_object(run))
+        self._send_json({'error': {'message': f"unknown path {path}"}}, 404)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        match = re.search(r"/assistants/([^/]+)$", url.path)
+        if match:
+            self._count('assistants.retrieve')
+            return self._send_json({'id': match.group(1), 'object': "assistant", 'created_at': int(time.time()),
+                                    'model': "gpt-4o", 'name': None, 'tools': [], 'instructions': None})
+        match = re.search(r"/threads/([^/]+)/runs/([^/]+)$", url.path)
+        if match:
+            self._count('runs.retrieve')
+            return self._send_json(self.server.run_object(self.server.runs[match.group(2)]))
+        match = re.search(r"/threads/([^/]+)/messages$", url.path)
+        if match:
+            self._count('messages.list')
+            query = parse_qs(url.query)
+            run_id = query.get('run_id', [None])[0]
+            after = query.get('after', [None])[0]
+            with self.server.lock:
+                data = [m for m in self.server.messages[match.group(1)] if run_id is None or m['run_id'] == run_id]
+            if query.get('order', ['desc'])[0] == 'desc':
+                data.reverse()
+            if after is not None:
+                # The SDK pages with after=<last id> until a page comes back empty
+                ids = [m['id'] for m in data]
+                data = data[ids.index(after) + 1:] if after in ids else []
+            return self._send_json({'object': "list", 'data': data, 'has_more': False,
+                                    'first_id': data[0]['id'] if data else None,
+                                    'last_id': data[-1]['id'] if data else None})
+        self._send_json({'error': {'message': f"unknown path {url.path}"}}, 404)
+
+    def do_DELETE(self):
+        match = re.search(r"/threads/([^/]+)$", urlparse(self.path).path)
+        if match:
+            self._count('threads.delete')
+            with self.server.lock:
+                self.server.messages.pop(match.group(1), None)
+            return self._send_json({'id': match.group(1), 'object': "thread.deleted", 'deleted': True})
+        self._send_json({'error': {'message': f"unknown path {self.path}"}}, 404)
+
+    def _stream_run(self, run):
+        self.send_response(200)
+        self.send_header('Content-Type', "text/event-stream")
+        self.send_header('Transfer-Encoding', "chunked")
+        self.end_headers()
+        self._event("thread.run.created", self.server.run_object(run, 'queued'))
+        self._event("thread.run.in_progress", self.server.run_object(run, 'in_progress'))
+        if self.server.cut_stream:
+            # Dropped connection, without the terminating chunk
+            self.close_connection = True
+            return
+        time.sleep(max(run['ends_at'] - time.monotonic(), 0))
+        run_object = self.server.run_object(run)
+        if run_object['status'] == 'completed':
+            message = next(m for m in self.server.messages[run['thread_id']] if m['run_id'] == run['id'])
+            self._event("thread.message.created", dict(message, content=[], status="in_progress"))
+            self._event("thread.message.delta", {
+                'id': message['id'], 'object': "thread.message.delta",
+                'delta': {'content': [{'index': 0, 'type': "text", 'text': {'value': REPLY, 'annotations': []}}]},
+            })
+            self._event("thread.message.completed", message)
+        self._event(f"thread.run.{run_object['status']}", run_object)
+        try:
+            self._write_chunk(b"event: done\ndata: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # run_turn stops reading at the terminal run event
+            self.close_connection = True
+
+    def _event(self, name, data):
+        self._write_chunk(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode())
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeAssistantsServer:
+    """Runs FakeAssistantsHandler on a background thread (use as a context manager)."""
+
+    def __init__(self, run_duration=2.0, final_status="completed", port=0, cut_stream=False):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), FakeAssistantsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.run_duration = run_duration
+        self.httpd.final_status = final_status
+        self.httpd.cut_stream = cut_stream
+        self.httpd.lock = threading.Lock()
+        self.httpd.stats = {}
+        self.httpd.messages = {}
+        self.httpd.runs = {}
+        self.httpd.message = self._message
+        self.httpd.create_run = self._create_run
+        self.httpd.run_object = self._run_object
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def configure(self, run_duration=None, final_status=None, cut_stream=None):
+        if run_duration is not None:
+            self.httpd.run_duration = run_duration
+        if final_status is not None:
+            self.httpd.final_status = final_status
+        if cut_stream is not None:
+            self.httpd.cut_stream = cut_stream
+
+    def _message(self, thread_id, role, text, run_id):
+        message = {
+            'id': new_id("msg"), 'object': "thread.message", 'created_at': int(time.time()),
+            'thread_id': thread_id, 'role': role, 'run_id': run_id, 'assistant_id': None,
+            'status': "completed", 'attachments': [], 'metadata': {},
+            'content': [{'type': "text", 'text': {'value': text, 'annotations': []}}],
+        }
+        with self.httpd.lock:
+            self.httpd.messages[thread_id].append(message)
+        return message
+
+    def _create_run(self, thread_id, assistant_id):
+        run = {
+            'id': new_id("run"), 'thread_id': thread_id, 'assistant_id': assistant_id,
+            'created_at': int(time.time()), 'ends_at': time.monotonic() + self.httpd.run_duration,
+            'final_status': self.httpd.final_status, 'cancelled': False,
+        }
+        self.httpd.runs[run['id']] = run
+        if run['final_status'] == 'completed':
+            # Visible in messages.list once the run is completed
+            run['reply'] = self._message(thread_id, "assistant", REPLY, run['id'])
+        return run
+
+    def _run_object(self, run, status=None):
+        if status is None:
+            if run['cancelled']:
+                status = 'cancelled'
+            elif time.monotonic() >= run['ends_at']:
+                status = run['final_status']
+            else:
+                status = 'in_progress'
+        return {
+            'id': run['id'], 'object': "thread.run", 'created_at': run['created_at'],
+            'thread_id': run['thread_id'], 'assistant_id': run['assistant_id'], 'status': status,
+            'model': "gpt-4o", 'instructions': "", 'tools': [], 'metadata': {},
+            'last_error': {'code': "server_error", 'message': "fake failure"} if status == 'failed' else None,
+            'required_action': {'type': "submit_tool_outputs", 'submit_tool_outputs': {'tool_calls': []}}
+            if status == 'requires_action' else None,
+        }
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def stats(self):
+        with self.httpd.lock:
+            return dict(self.httpd.stats)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,56 @@
+# Local fake chat model with realistic latency for the benchmarks: lognormal
+# time-to-first-token and answer length, fixed token rate. No network.
+import random
+import time
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+WORDS = (
+    "Untuk menghubungkan sensor DHT22 ke ESP32 gunakan pin GPIO4 dengan resistor pull-up 10k "
+    "lalu kirim data melalui MQTT setiap 2 detik ke broker"
+).split()
+
+
+class FakeChatModel(BaseChatModel):
+    first_token_latency: float = 0.8
+    latency_sigma: float = 0.4
+    tokens_per_second: float = 60.0
+    output_tokens_mean: int = 350
+    output_tokens_sigma: float = 0.6
+    time_scale: float = 1.0
+
+    @property
+    def _llm_type(self):
+        return "semar-fake-chat"
+
+    def _sample(self):
+        # (time to first token, number of output tokens)
+        ttft = random.lognormvariate(0, self.latency_sigma) * self.first_token_latency
+        tokens = max(1, int(random.lognormvariate(0, self.output_tokens_sigma) * self.output_tokens_mean))
+        return ttft * self.time_scale, tokens
+
+    def _usage(self, messages, output_tokens):
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        return {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'total_tokens': input_tokens + output_tokens}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        ttft, tokens = self._sample()
+        time.sleep(ttft + tokens / self.tokens_per_second * self.time_scale)
+        text = " ".join(WORDS[i % len(WORDS)] for i in range(tokens))
+        message = AIMessage(content=text, usage_metadata=self._usage(messages, tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        ttft, tokens = self._sample()
+        time.sleep(ttft)
+        delay = self.time_scale / self.tokens_per_second
+        for i in range(tokens):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=("" if i == 0 else " ") + WORDS[i % len(WORDS)]))
+            time.sleep(delay)
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, tokens)))
@@ -0,0 +1,173 @@
+# Headless load test of the Semar-Bot turn loop: history compaction and formatting,
+# the model call, token counting, requirement extraction and the MongoDB update,
+# for many simulated students at once (one thread each, like Streamlit sessions).
+# Uses the local FakeChatModel and mongomock (or the mongod at MONGODB_URI).
+# Run from src/:  python -m benchmarks.loadtest --students 10,100,500
+import argparse
+import os
+import random
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from langchain_core.prompts import MessagesPlaceholder
+
+from benchmarks.fake_llm import FakeChatModel
+from semar.persistence import save_turn
+from semar.requirements import extract_requirements, new_requirements
+from semar.resources import ChatResources
+from semar.turn import generate_response
+
+
+MODEL = "gpt-4o-mini"
+
+# Same shape and roughly the same size as the v1.6 prompt
+TEMPLATE = [
+    ("system", "CONTEXT: You are an IoT Setup Assistant. Follow the PROJECT REQUIREMENT TEMPLATE.\n" * 90),
+    MessagesPlaceholder("chat_history"),
+    ("human", "USER QUERY:\n{query}\n\nCURRENT TIME: {current_time}"),
+]
+
+QUERIES = [
+    "Saya ingin membuat pemanas air berbasis IoT dengan ESP32 dan DHT22",
+    "Pakai Wifi saja",
+    "Protokolnya MQTT",
+    "Suhu maksimal 80 derajat, data dikirim setiap 2 detik",
+    "Ya, semua sudah benar. Lanjut ke PART 1",
+    "Hardware sudah terpasang, lanjut PART 2",
+    "Tolong berikan full code ESP32 dengan MQTT",
+    "Sudah berhasil, project selesai",
+]
+
+
+class LockedCollection:
+    """Serializes calls to mongomock (not thread-safe) and adds a fake round trip."""
+
+    def __init__(self, collection, latency):
+        self.collection = collection
+        self.latency = latency
+        self._lock = threading.Lock()
+
+    def insert_one(self, document):
+        time.sleep(self.latency)
+        with self._lock:
+            return self.collection.insert_one(document)
+
+    def update_one(self, filter, update, upsert=False):
+        time.sleep(self.latency)
+        with self._lock:
+            return self.collection.update_one(filter, update, upsert=upsert)
+
+    def aggregate(self, pipeline):
+        time.sleep(self.latency)
+        with self._lock:
+            return list(self.collection.aggregate(pipeline))
+
+
+def get_collection(latency):
+    try:
+        import mongomock
+        return LockedCollection(mongomock.MongoClient()["semar_loadtest"]["sessions"], latency), "mongomock"
+    except ImportError:
+        from pymongo import MongoClient
+        uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+        return MongoClient(uri)["semar_loadtest"]["sessions"], uri
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def simulate_student(student, resources, collection, args, sessions, latencies):
+    session_id = collection.insert_one({
+        'student_id': f"LOAD{student:04d}", 'created_at': datetime.now().isoformat(),
+        'model': MODEL, 'prompt_version': "loadtest", 'chat_history': []
+    }).inserted_id
+    state = {
+        'chat_history': [{'role': 'assistant', 'content': "Halo! Saya Semar-Bot, asisten Setup IoT mu."}],
+        'persisted_message_count': 0,
+        'requirement_state': new_requirements(),
+    }
+    sessions.append(state)
+    for turn in range(args.turns):
+        time.sleep(random.uniform(0, args.think_time))
+        query = QUERIES[turn % len(QUERIES)]
+        start = time.perf_counter()
+        token_count = resources.token_ledger.count(query)
+        user_message = {'role': 'user', 'content': query, 'token_count': token_count}
+        state['chat_history'].append(user_message)
+        response, input_tokens, output_tokens, _ = generate_response(
+            resources, query, state['chat_history'], datetime.now().isoformat(),
+            query_token_count=token_count, requirement_state=state['requirement_state']
+        )
+        ai_message = {'role': 'assistant', 'content': response, 'token_count': output_tokens}
+        state['chat_history'].append(ai_message)
+        state['requirement_state'] = extract_requirements(state['requirement_state'], [user_message, ai_message])
+        state['persisted_message_count'] = save_turn(
+            collection, session_id, state['chat_history'], state['persisted_message_count'],
+            input_tokens, output_tokens,
+            {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'total_tokens': input_tokens + output_tokens},
+            extra_set={'requirement_state': state['requirement_state']}
+        )
+        latencies.append(time.perf_counter() - start)
+
+
+def run_level(students, resources, collection, args):
+    sessions = []
+    latencies = []
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=students) as pool:
+        futures = [
+            pool.submit(simulate_student, student, resources, collection, args, sessions, latencies)
+            for student in range(students)
+        ]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return {
+        'students': students,
+        'turns': len(latencies),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'throughput': len(latencies) / elapsed,
+        'memory_per_session_kb': memory / students / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', default="10,100,500", help="comma separated concurrency levels")
+    parser.add_argument('--turns', type=int, default=6)
+    parser.add_argument('--think-time', type=float, default=2.0, help="max seconds a student waits between turns")
+    parser.add_argument('--first-token-latency', type=float, default=0.8)
+    parser.add_argument('--tokens-per-second', type=float, default=60.0)
+    parser.add_argument('--output-tokens', type=int, default=350)
+    parser.add_argument('--mongo-latency', type=float, default=0.002)
+    args = parser.parse_args()
+
+    llm = FakeChatModel(
+        first_token_latency=args.first_token_latency,
+        tokens_per_second=args.tokens_per_second,
+        output_tokens_mean=args.output_tokens,
+    )
+    resources = ChatResources(MODEL, "loadtest", TEMPLATE, llm=llm)
+    collection, target = get_collection(args.mongo_latency)
+    print(f"fake LLM: ttft~{args.first_token_latency}s, {args.tokens_per_second} tok/s, "
+          f"~{args.output_tokens} tokens/answer; mongo: {target}")
+    print(f"{'students':>8} {'turns':>6} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'turns/s':>8} {'KB/session':>11}")
+    for students in (int(n) for n in args.students.split(",")):
+        r = run_level(students, resources, collection, args)
+        print(f"{r['students']:>8} {r['turns']:>6} {r['p50']:>7.2f} {r['p95']:>7.2f} {r['p99']:>7.2f} "
+              f"{r['throughput']:>8.1f} {r['memory_per_session_kb']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
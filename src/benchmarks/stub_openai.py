@@ -0,0 +1,133 @@
+# Local stand-in for the OpenAI chat completions endpoint, used by the benchmarks.
+# Point ChatOpenAI / OpenAI at it with base_url=server.base_url and any api_key.
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_REPLY = "1. **Idea (Confirmed)** ✅ Pemanas air berbasis IoT dengan ESP32 dan DHT22."
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so clients that reuse their connection pool can show it
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.stats['connections'] += 1
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        with self.server.stats_lock:
+            self.server.stats['requests'] += 1
+        # Injected faults: throttled requests and a slow tail
+        if random.random() < self.server.error_rate:
+            with self.server.stats_lock:
+                self.server.stats['rate_limited'] += 1
+            self._send_json(429, {'error': {
+                'message': "Rate limit reached for requests", 'type': "requests", 'code': "rate_limit_exceeded",
+            }}, {'retry-after-ms': str(int(self.server.retry_after * 1000)),
+                 'x-ratelimit-reset-requests': f"{self.server.retry_after}s"})
+            return
+        if random.random() < self.server.slow_rate:
+            time.sleep(self.server.slow_latency)
+        time.sleep(self.server.latency)
+
+        reply = self.server.reply
+        model = body.get('model', "gpt-4o-mini")
+        if body.get('stream'):
+            self._stream(model, reply)
+        else:
+            self._send_json(200, {
+                'id': "chatcmpl-stub",
+                'object': "chat.completion",
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': "assistant", 'content': reply},
+                    'finish_reason': "stop",
+                }],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            })
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, model, reply):
+        self.send_response(200)
+        self.send_header('Content-Type', "text/event-stream")
+        self.send_header('Transfer-Encoding', "chunked")
+        self.end_headers()
+        words = reply.split(" ")
+        for i, word in enumerate(words):
+            content = word if i == 0 else " " + word
+            chunk = {
+                'id': "chatcmpl-stub",
+                'object': "chat.completion.chunk",
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': content}, 'finish_reason': None}],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            time.sleep(self.server.chunk_delay)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class StubOpenAIServer:
+    """Runs StubOpenAIHandler on a background thread (use as a context manager).
+
+    `error_rate` of the requests get a 429 asking to retry after `retry_after`
+    seconds, `slow_rate` of them take `slow_latency` seconds longer.
+    """
+
+    def __init__(self, latency=0.0, chunk_delay=0.0, reply=DEFAULT_REPLY, port=0,
+                 error_rate=0.0, retry_after=0.5, slow_rate=0.0, slow_latency=5.0):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), StubOpenAIHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.chunk_delay = chunk_delay
+        self.httpd.reply = reply
+        self.httpd.error_rate = error_rate
+        self.httpd.retry_after = retry_after
+        self.httpd.slow_rate = slow_rate
+        self.httpd.slow_latency = slow_latency
+        self.httpd.stats = {'connections': 0, 'requests': 0, 'rate_limited': 0}
+        self.httpd.stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def stats(self):
+        return dict(self.httpd.stats)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -3,6 +3,8 @@ from dotenv import load_dotenv
 import gradio as gr
 import os
 
+from semar.streaming import coalesce_text
+
 
 load_dotenv()
 
@@ -11,6 +13,21 @@ client = OpenAI(
     api_key=os.getenv("OPENAI_API_KEY")
 )
 
+# Streamed answers are pushed to the browser at most every 50 ms (or per 200 new
+# characters) instead of once per token; Gradio sends each update as a diff
+# against the previous one, so fewer updates also means fewer diffs to compute
+STREAM_INTERVAL = 0.05
+STREAM_MAX_CHARS = 200
+# Requests answered at once, the others wait in Gradio's queue
+CONCURRENCY_LIMIT = int(os.getenv("GRADIO_CONCURRENCY_LIMIT", "16"))
+MAX_QUEUE_SIZE = int(os.getenv("GRADIO_MAX_QUEUE_SIZE", "100"))
+
+
+def stream_deltas(response):
+    for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content is not None:
+            yield chunk.choices[0].delta.content
+
 
 def generate_response(message, history):
     formatted_history = []
@@ -19,22 +36,19 @@ def generate_response(message, history):
         formatted_history.append({"role": "assistant", "content":assistant})
 
     formatted_history.append({"role": "user", "content": message})
-    
+
     response = client.chat.completions.create(model='gpt-3.5-turbo',
     messages= formatted_history,
     stream=True)
 
-    partial_message = ""
-    for chunk in response:
-        if chunk.choices[0].delta.content is not None:
-              partial_message = partial_message + chunk.choices[0].delta.content
-              yield partial_message
+    yield from coalesce_text(stream_deltas(response), STREAM_INTERVAL, STREAM_MAX_CHARS)
 
-gr.ChatInterface(generate_response,
+demo = gr.ChatInterface(generate_response,
     chatbot=gr.Chatbot(height=600),
     textbox=gr.Textbox(placeholder="You can ask me anything", container=False, scale=7),
     title="OpenAI Chat Bot",
     retry_btn=None,
     undo_btn="Delete Previous",
-    clear_btn="Clear").launch()
-gr.ChatInterface(generate_response).launch()
\ No newline at end of file
+    clear_btn="Clear",
+    concurrency_limit=CONCURRENCY_LIMIT)
+demo.queue(default_concurrency_limit=CONCURRENCY_LIMIT, max_size=MAX_QUEUE_SIZE).launch()
@@ -0,0 +1,154 @@
+import os
+import textwrap
+import streamlit as st
+from dotenv import load_dotenv
+from semar.client import TurnError, get_semar_client
+
+
+# Thin Streamlit front end of the Semar-Bot API (python -m semar.api): the turn,
+# the model calls and MongoDB all run in the backend, this script only renders.
+
+# Load environment variables
+load_dotenv()
+
+# Base URL of the backend, one HTTP connection pool per process
+SEMAR_API_URL = os.getenv("SEMAR_API_URL", "http://127.0.0.1:8000")
+api = get_semar_client(SEMAR_API_URL)
+
+# Older messages are loaded and shown on request
+history_page_size = 20
+
+# Set up the page
+st.set_page_config(page_title="Semar-Bot", page_icon=":robot:")
+st.title("Semar-Bot")
+
+# Step 1: Student ID and Name Input
+if 'student_info' not in st.session_state:
+    st.session_state['student_info'] = {}
+
+if not st.session_state['student_info']:
+    with st.form('student_form'):
+        st.write("Masukkan NIM anda dan Nama anda:")
+        student_id = st.text_input('NIM')
+        student_name = st.text_input('Nama')
+        submitted = st.form_submit_button('Start Chat')
+
+        if submitted:
+            if student_id.strip() != "" and student_name.strip() != "":
+                st.session_state['student_info'] = {
+                    'student_id': student_id.strip(),
+                    'student_name': student_name.strip()
+                }
+                st.success('Terima kasih! Informasi anda disimpan!\nKlik start sekali lagi sampai loading di pojok kanan bergerak 🏃🚴...')
+            else:
+                st.error('Informasi NIM & Nama harus diisi.')
+    st.stop()  # Stop execution until the student info is provided
+
+
+def start_session(resume=None):
+    return api.start_session(
+        st.session_state['student_info']['student_id'],
+        st.session_state['student_info']['student_name'],
+        prompt_version=st.query_params.get('prompt_version'),
+        resume=resume
+    )
+
+
+# Step 2: Start or Resume the Session in the Backend
+if 'session_id' not in st.session_state:
+    if 'session_start' not in st.session_state:
+        st.session_state['session_start'] = start_session()
+    session = st.session_state['session_start']
+
+    if 'open_session' in session:
+        open_session = session['open_session']
+        st.info(f"Anda memiliki sesi yang belum selesai ({open_session['message_count']} pesan, "
+                f"dimulai {open_session['created_at']}).")
+        resume_column, new_column = st.columns(2)
+        if resume_column.button("Lanjutkan sesi sebelumnya"):
+            session = start_session(resume=True)
+        elif new_column.button("Mulai sesi baru"):
+            session = start_session(resume=False)
+        else:
+            st.stop()  # Stop execution until the student chooses
+
+    # Step 3: Initialize Chat History (the last page, from the backend)
+    st.session_state['session_id'] = session['session_id']
+    st.session_state['chat_history'] = session['messages']
+    st.session_state['history_offset'] = session['history_offset']
+
+
+# Step 5: Display the Conversation
+def render_message(message, message_id):
+    # Markdown is prepared once per message id (its position in the stored
+    # chat_history), later reruns reuse it
+    rendered = st.session_state.setdefault('rendered_markdown', {})
+    if message_id not in rendered:
+        rendered[message_id] = textwrap.dedent(message['content']).strip()
+    with st.chat_message("Human" if message['role'] == 'user' else "AI"):
+        st.markdown(rendered[message_id])
+
+
+if 'render_count' not in st.session_state:
+    st.session_state['render_count'] = history_page_size
+
+hidden = len(st.session_state['chat_history']) - st.session_state['render_count']
+if hidden > 0 or st.session_state['history_offset'] > 0:
+    if st.button("Tampilkan pesan sebelumnya"):
+        st.session_state['render_count'] += history_page_size
+        missing = st.session_state['render_count'] - len(st.session_state['chat_history'])
+        if missing > 0 and st.session_state['history_offset'] > 0:
+            start = max(st.session_state['history_offset'] - missing, 0)
+            earlier = api.history(st.session_state['session_id'], start, st.session_state['history_offset'] - start)
+            st.session_state['chat_history'] = earlier + st.session_state['chat_history']
+            st.session_state['history_offset'] = start
+
+# Conversation
+offset = st.session_state['history_offset']
+first = max(len(st.session_state['chat_history']) - st.session_state['render_count'], 0)
+for index in range(first, len(st.session_state['chat_history'])):
+    render_message(st.session_state['chat_history'][index], offset + index)
+
+# Step 6: Send the Query, Render the Streamed Answer
+user_query = st.chat_input("Pesan Anda:")
+
+if user_query is not None and user_query.strip() != "":
+    with st.chat_message("Human"):
+        st.markdown(user_query)
+
+    # The backend stores both messages before its final event
+    result = {}
+    with st.chat_message("AI"):
+        # Shown while the backend queues the turn during a burst
+        queue_notice = st.empty()
+
+        def show_position(position):
+            queue_notice.info(f"Banyak pertanyaan sedang diproses, pesan Anda ada di antrian ke-{position}...")
+
+        def deltas():
+            first = True
+            for delta in api.stream_turn(st.session_state['session_id'], user_query, result, show_position):
+                if first:
+                    queue_notice.empty()
+                    first = False
+                yield delta
+
+        try:
+            st.write_stream(deltas())
+        except TurnError as exc:
+            queue_notice.empty()
+            if exc.status == 503:
+                st.warning("Maaf, server sedang sibuk melayani banyak mahasiswa. Silakan kirim ulang pertanyaan Anda sebentar lagi.")
+            elif exc.status == 404:
+                # The session is gone (swept while idle), the next query starts a new one
+                for name in ('session_id', 'session_start'):
+                    st.session_state.pop(name, None)
+                st.warning("Sesi Anda sudah berakhir dan pesan Anda tidak disimpan. Silakan kirim ulang pertanyaan Anda.")
+            elif exc.status == 409:
+                st.warning("Sesi ini juga dipakai di tab lain dan pesan Anda tidak disimpan. Muat ulang halaman lalu kirim ulang pertanyaan Anda.")
+            else:
+                st.error(f"Maaf, jawaban tidak dapat dibuat ({exc}). Silakan coba lagi.")
+
+    if result:
+        st.session_state['chat_history'].append({'role': 'user', 'content': user_query})
+        st.session_state['chat_history'].append(result['message'])
@@ -1,15 +1,29 @@
 import os
+import textwrap
+import uuid
 import streamlit as st
-import tiktoken
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import StrOutputParser
 from dotenv import load_dotenv
-from pymongo import MongoClient
 from bson.objectid import ObjectId
 from datetime import datetime
 from pytz import timezone
+from semar.cache import get_response_cache
+from semar.semantic_cache import get_semantic_cache
+from semar.history import new_history_summary
+from semar.metrics import get_metrics_exporter, turn_metrics
+from semar.mongo import get_sessions_collection, pool_metrics
+from semar.requirements import detect_setup_phase, extract_requirements, new_requirements
+from semar.persistence import build_messages_update, build_turn_update, load_history_page, load_recent_history, read_chat_history, write_filter
+from semar.sessions import find_open_session, start_session_sweeper, touch_session
+from semar.state import get_state_store
+from semar.router import ModelRouter
+from semar.resilience import RETRYABLE_ERRORS, get_resilient_caller
+from semar.admission import AdmissionRejected, get_admission_controller
+from semar.experiments import get_active_experiment
+from semar.prompts import get_prompt_registry
+from semar.resources import get_chat_resources, get_token_ledger
+from semar.turn import StreamInterrupted, generate_response
+from semar.timing import PhaseTimer
+from semar.writer import get_background_writer
 
 
 # Load environment variables
@@ -19,12 +33,111 @@ load_dotenv()
 MONGODB_URI = os.getenv("MONGODB_URI")
 
 # MongoDB Setup
-client = MongoClient(MONGODB_URI)
-db = client["semar_bot_db"]
-sessions_collection = db["sessions"]
-
-prompt_version = "v1.6"
+# The client and its connection pool are shared across reruns, indexes are ensured once per process
+sessions_collection = get_sessions_collection(MONGODB_URI, "semar_bot_db")
+# Turn updates are written on a background thread so they never delay the UI
+session_writer = get_background_writer(sessions_collection)
+
+# Used when prompts/selection.json sets no default, sessions can also ask for a
+# version with ?prompt_version=v1.5 in the URL
+default_prompt_version = "v1.6.1"
 current_model = "gpt-4o-mini"
+# Pick the model per turn from the setup phase and the query, with a fallback
+# model on timeout or rate limit (current_model is used when disabled)
+use_model_router = True
+model_router = ModelRouter(
+    phase_models={
+        'requirements': "gpt-4o-mini",
+        'hardware_setup': "gpt-4o-mini",
+        'connectivity_setup': "gpt-4o",
+        'confirmation': "gpt-4o-mini",
+        'finished': "gpt-4o-mini",
+    },
+    code_model="gpt-4o",
+    default_model=current_model,
+    fallback_models={"gpt-4o": "gpt-4o-mini", "gpt-4o-mini": "gpt-4o"},
+    timeout=30,
+    max_retries=0,  # retries are done by the resilient caller below
+)
+# Per-call timeout, jittered backoff on 429s (from the rate-limit headers) and a
+# token bucket shared by every session of this process
+use_resilient_calls = True
+llm_caller = get_resilient_caller(
+    timeout=60,
+    retries=3,
+    requests_per_minute=int(os.getenv("SEMAR_LLM_RPM", "0")) or None,
+    hedge=False,  # hedging doubles the cost of slow turns, enable when latency matters more
+)
+# At most this many turns of this process call the model at once, the others
+# wait in a queue per student (round-robin, so a chatty student cannot starve
+# the others) and are told their position; the cap is per replica
+use_admission_control = True
+admission = get_admission_controller(
+    max_concurrent=int(os.getenv("SEMAR_MAX_CONCURRENT_TURNS", "8")),
+    max_queue=int(os.getenv("SEMAR_MAX_QUEUED_TURNS", "200")),
+    timeout=120,
+    max_per_student=2,
+)
+busy_message = "Maaf, server sedang sibuk melayani banyak mahasiswa. Silakan kirim ulang pertanyaan Anda sebentar lagi."
+# Shown under the part already streamed when the answer breaks off
+interrupted_message = "Maaf, jawaban terputus sebelum selesai dan tidak disimpan. Silakan kirim ulang pertanyaan Anda."
+# Shown when another tab or replica stored a turn of the session first
+conflict_message = "Sesi ini juga dipakai di tab lain, pesan terakhir Anda tidak disimpan. Riwayat percakapan dimuat ulang, silakan kirim ulang pertanyaan Anda."
+# Render the AI answer token by token instead of waiting for the full completion
+stream_responses = True
+# "append" pushes only new messages each turn, "rewrite" $sets the whole chat_history
+persistence_mode = "append"
+# Keep the last turns verbatim and fold older ones into a requirement summary
+compact_history = True
+history_keep_turns = 3
+history_token_budget = 3000
+# Send the persisted requirement state in place of the history before the window
+use_requirement_state = True
+# Write turn updates through the background writer instead of blocking the script
+background_writes = True
+# Answer identical early-conversation turns from a cache (opt-in)
+use_response_cache = False
+response_cache_max_turns = 2
+response_cache_ttl = 6 * 3600
+response_cache_size = 1000
+response_cache_persist = False
+# Answer paraphrased questions from earlier answers in the same requirement context (opt-in)
+use_semantic_cache = False
+semantic_cache_max_turns = 4
+semantic_cache_embedder = "hashing"  # "hashing" (local) or "openai"
+semantic_cache_index = "numpy"  # "numpy" (brute force) or "faiss" (HNSW)
+semantic_cache_threshold = None  # calibrated per embedder (EMBEDDER_THRESHOLDS)
+semantic_cache_audit_rate = 0.05
+# Resume loads only the last messages, older ones are loaded and shown on request
+history_page_size = 20
+# Where the per-browser state lives: "mongo" (any replica can serve any student)
+# or "memory" (single process); at most state_cache_size states are kept in memory
+state_store_backend = os.getenv("SEMAR_STATE_STORE", "mongo")
+state_cache_size = int(os.getenv("SEMAR_STATE_CACHE_SIZE", "500"))
+
+# Only the first turns of a conversation are cached, the key covers all of them
+response_cache = get_response_cache(
+    response_cache_size, response_cache_ttl, response_cache_max_turns,
+    sessions_collection.database["response_cache"] if response_cache_persist else None
+)
+semantic_cache = get_semantic_cache(
+    semantic_cache_embedder, semantic_cache_index, semantic_cache_threshold,
+    audit_rate=semantic_cache_audit_rate,
+    log_writer=get_background_writer(sessions_collection.database["semantic_cache_log"])
+)
+
+# Optional Prometheus / OpenTelemetry export of the turn metrics (SEMAR_METRICS_EXPORTER)
+metrics_exporter = get_metrics_exporter()
+if metrics_exporter is not None and metrics_exporter.record_write not in session_writer.listeners:
+    session_writer.listeners.append(metrics_exporter.record_write)
+if metrics_exporter is not None and metrics_exporter.record_admission not in admission.listeners:
+    admission.listeners.append(metrics_exporter.record_admission)
+
+# Prompt versions are loaded from prompts/ once per process and validated; new
+# versions and prompts/selection.json (default version, A/B weights) are picked
+# up without a restart. The v1.6.1 file keeps the instructions in a static
+# system message so the provider can cache the prefix.
+prompt_registry = get_prompt_registry(models=(current_model, "gpt-4o"))
 
 # Get Current Time Functions
 def get_current_time():
@@ -35,11 +148,64 @@ def get_current_time():
 st.set_page_config(page_title="Semar-Bot", page_icon=":robot:")
 st.title("Semar-Bot")
 
+# Session state of this browser, from the state store instead of st.session_state.
+# The key is kept in the URL (?s=...), so a reconnect to another replica, or after
+# a restart, finds the same state.
+state_store = get_state_store(
+    state_store_backend, sessions_collection.database["session_state"], state_cache_size
+)
+# Duplicate near-empty sessions (refreshes, dropped websockets) are removed in
+# the background, unless a browser state still points to them
+start_session_sweeper(sessions_collection, in_use=state_store.session_ids)
+if 'state_key' not in st.session_state:
+    url_key = st.query_params.get('s')
+    st.session_state['state_key'] = url_key or uuid.uuid4().hex
+    # A key from the URL may come from a shared link, its state is only used
+    # once the student enters the NIM it belongs to
+    st.session_state['state_verified'] = url_key is None
+    st.query_params['s'] = st.session_state['state_key']
+state = state_store.get(st.session_state['state_key'])
+
+if not st.session_state['state_verified']:
+    if not state.get('student_info'):
+        # Nobody's conversation yet
+        st.session_state['state_verified'] = True
+    else:
+        with st.form('verify_form'):
+            st.write("Masukkan NIM anda untuk melanjutkan sesi ini:")
+            student_id = st.text_input('NIM')
+            submitted = st.form_submit_button('Lanjutkan')
+        if not submitted:
+            st.stop()  # Stop execution until the NIM is entered
+        if student_id.strip() != state['student_info']['student_id']:
+            # Someone else's link: start over with a state of this browser's own
+            st.session_state['state_key'] = uuid.uuid4().hex
+            st.query_params['s'] = st.session_state['state_key']
+        st.session_state['state_verified'] = True
+        st.rerun()
+
+
+def save_state():
+    # Writes the persisted fields that changed during this run
+    state_store.save(st.session_state['state_key'], state)
+
+
+# Connection pool and background writer metrics for sizing the deployment
+if os.getenv("SEMAR_SHOW_METRICS"):
+    st.sidebar.json(pool_metrics.snapshot())
+    st.sidebar.json(dict(session_writer.stats, pending=session_writer.pending()))
+    st.sidebar.json(response_cache.stats())
+    st.sidebar.json(semantic_cache.stats())
+    st.sidebar.json(dict(llm_caller.stats))
+    st.sidebar.json(admission.snapshot())
+    st.sidebar.json({"prompt_versions": sorted(prompt_registry.versions), "prompt_errors": prompt_registry.errors})
+    st.sidebar.json(dict(state_store.stats, cached_states=len(state_store)))
+
 # Step 1: Student ID and Name Input
-if 'student_info' not in st.session_state:
-    st.session_state['student_info'] = {}
+if 'student_info' not in state:
+    state['student_info'] = {}
 
-if not st.session_state['student_info']:
+if not state['student_info']:
     with st.form('student_form'):
         st.write("Masukkan NIM anda dan Nama anda:")
         student_id = st.text_input('NIM')
@@ -48,40 +214,121 @@ if not st.session_state['student_info']:
 
         if submitted:
             if student_id.strip() != "" and student_name.strip() != "":
-                st.session_state['student_info'] = {
+                state['student_info'] = {
                     'student_id': student_id.strip(),
                     'student_name': student_name.strip()
                 }
                 st.success('Terima kasih! Informasi anda disimpan!\nKlik start sekali lagi sampai loading di pojok kanan bergerak 🏃🚴...')
             else:
                 st.error('Informasi NIM & Nama harus diisi.')
+    save_state()
     st.stop()  # Stop execution until the student info is provided
 
-# Step 2: Create a New Session in MongoDB
-if 'session_id' not in st.session_state:
+# Prompt version (and model) of this session, kept for the whole session. When
+# an experiment is active in experiments.json the student's arm decides both,
+# unless a version is asked for in the URL.
+if 'prompt_version' not in state:
+    experiment = get_active_experiment()
+    arm = None
+    if experiment is not None and 'prompt_version' not in st.query_params:
+        arm = experiment.assign(state['student_info']['student_id'])
+        if arm['prompt_version'] not in prompt_registry.versions:
+            arm = None  # invalid prompt file, the registry logged why
+    if arm is not None:
+        state['experiment'] = {'name': experiment.name, 'arm': arm['name'], 'model': arm['model']}
+        state['prompt_version'] = arm['prompt_version']
+    else:
+        state['experiment'] = None
+        state['prompt_version'] = prompt_registry.select(
+            state['student_info']['student_id'],
+            requested=st.query_params.get('prompt_version'),
+            fallback=default_prompt_version
+        )
+prompt_version = state['prompt_version']
+if state['experiment'] is not None:
+    # The arm's model answers every turn, the router would mix models within the arm
+    current_model = state['experiment']['model']
+    use_model_router = False
+
+# Step 2: Resume the Open Session or Create a New Session in MongoDB
+if 'session_id' not in state:
+    # Most recent unfinished session of this student for the current prompt version
+    if 'open_session' not in state:
+        state['open_session'] = find_open_session(
+            sessions_collection, state['student_info']['student_id'], prompt_version
+        )
+    open_session = state['open_session']
+
+    if open_session is not None and open_session['message_count'] == 0:
+        # An empty session left by a refresh is reused instead of inserting
+        # another one; touching it keeps the sweeper from deleting it, a new
+        # session is created below if it was deleted already
+        if touch_session(sessions_collection, open_session['_id'], get_current_time()):
+            state['session_id'] = str(open_session['_id'])
+    elif open_session is not None:
+        st.info(f"Anda memiliki sesi yang belum selesai ({open_session['message_count']} pesan, "
+                f"dimulai {open_session['created_at']}).")
+        resume_column, new_column = st.columns(2)
+        if resume_column.button("Lanjutkan sesi sebelumnya"):
+            # Step 3 restores its history and requirement state
+            if touch_session(sessions_collection, open_session['_id'], get_current_time()):
+                state['session_id'] = str(open_session['_id'])
+        elif not new_column.button("Mulai sesi baru"):
+            save_state()
+            st.stop()  # Stop execution until the student chooses
+
+if 'session_id' not in state:
     # Create a new session document in MongoDB
     session_data = {
-        'student_id': st.session_state['student_info']['student_id'],
+        'student_id': state['student_info']['student_id'],
         'created_at': get_current_time(),
+        'last_activity': get_current_time(),
         'model': current_model,
         'prompt_version': prompt_version,
+        'experiment': {k: v for k, v in state['experiment'].items() if k != 'model'}
+        if state['experiment'] else None,
+        'status': 'open',
         'chat_history': []
     }
     session = sessions_collection.insert_one(session_data)
-    st.session_state['session_id'] = str(session.inserted_id)
+    state['session_id'] = str(session.inserted_id)
+
+# A turn write that matched nothing lost the race with a turn stored by another
+# replica (the chat_history $size guard): the history is loaded again below
+last_write = state.get('last_write')
+if last_write is not None and last_write.matched_count is not None:
+    del state['last_write']
+    if last_write.matched_count == 0:
+        st.warning(conflict_message)
+        state.pop('chat_history', None)
 
 # Step 3: Initialize Chat History
-if 'chat_history' not in st.session_state:
+if 'chat_history' not in state:
     # Fetch the session from MongoDB
-    session = sessions_collection.find_one({'_id': ObjectId(st.session_state['session_id'])})
-    if session and 'chat_history' in session and len(session['chat_history']) > 0:
-        st.session_state['chat_history'] = session['chat_history']
+    if persistence_mode == "append":
+        # Only the last page of messages, the requirement state covers the older turns
+        session = load_recent_history(sessions_collection, ObjectId(state['session_id']), history_page_size)
     else:
-        st.session_state['chat_history'] = [
+        # Rewrite mode $sets the whole chat_history, so all of it has to be loaded
+        session = sessions_collection.find_one({'_id': ObjectId(state['session_id'])})
+    stored_history = read_chat_history(session)
+    # Position of the first loaded message in the stored chat_history
+    state['history_offset'] = (session or {}).get('message_count', len(stored_history)) - len(stored_history)
+    # Messages already in MongoDB, only the ones after this index are pushed
+    state['persisted_message_count'] = len(stored_history)
+    # Requirement state extracted from earlier turns, kept on the session document
+    state['requirement_state'] = (session or {}).get('requirement_state') or new_requirements()
+    # Running summary of the turns that fell out of the history window, also on
+    # the session document (folded_count counts the whole stored chat_history)
+    state['history_summary'] = (session or {}).get('history_summary') or new_history_summary()
+    if len(stored_history) > 0:
+        state['chat_history'] = stored_history
+    else:
+        state['chat_history'] = [
             {
                 'role': 'assistant',
                 'content': f"""
-                        Halo! {st.session_state['student_info']['student_name']}! Saya Semar-Bot, asisten Setup IoT mu. Mari mulai dengan setup proyek IoT Anda.
+                        Halo! {state['student_info']['student_name']}! Saya Semar-Bot, asisten Setup IoT mu. Mari mulai dengan setup proyek IoT Anda.
                         Apa jenis proyek IoT yang sedang Anda kerjakan hari ini? Anda bisa mulai dengan menyatakan ide Anda untuk proyek tersebut.
                         sebagai contoh, "Saya ingin membuat pemanas air berbasis IoT, dengan ESP32 sebagai board mikro, dan DHT22 sebagai sensor suhu."
                     _Loaded prompt version: {prompt_version}_
@@ -89,219 +336,73 @@ if 'chat_history' not in st.session_state:
             }
         ]
 # Step 4: Define the get_response Function
-def get_response(query, chat_history):
-
-    template = """
-        CONTEXT:
-        You are an IoT Setup Assistant. Your sole focus is assisting with IoT projects. Please skip any topics unrelated to IoT.
-        It is critical if the user user speak in Bahasa Indonesia, change all respond in Bahasa Indonesia.
-        If the user speaks in English, please respond in English.
-
-        TASK:
-        Your task is to help the user create a complete IoT Project Setup first by gathering the PROJECT REQUIREMENTS, and then helping with the PROJECT SETUP.  
-        You will gather the required specifications and ensure that all necessary details are provided before proceeding.
-        You must track the conversation using the CHAT HISTORY to determine what specifications have already been provided, and which are still pending.
-        Always refer to the chat history before asking questions, to avoid asking for information that has already been confirmed.
-
-        For REQUIRED specifications, you will continue asking the user until the information is given.
-        if the REQUIRED specification is given, search from your knowledge base to suggest appropriate hardware, sensors, and network components.
-        if the user seems unsure, use the DEFAULT values provided in the template.
-        For OPTIONAL specifications, proceed immediately if provided, or use defaults where applicable.
-
-        Start by asking for the required specifications, while leveraging the CHAT HISTORY to maintain continuity.
-        Improvise the TEMPLATE that you show to user if necessary changes are needed.
-
-        ---
-        
-        PROJECT REQUIREMENTS:
-        Please follow this template of text to show the status of requirement gathering.
-        Extra rules for each requirement are stated in <EXTRA RULES> section, this <EXTRA RULES> part should not be shown to user.
-        Show the template sequently from PART 1, PART 2, and then PART 3.
-
-        If a specification is confirmed, display it like this:
-        1. **Idea (Confirmed)** ✅  
-        (Confirmed from Chat History)
-
-        If still waiting or unclear, display it like this:
-        1. **Idea (Waiting for Confirmation)** ⌛  
-        (Still waiting for user input)
-
-        Use the CHAT HISTORY to accurately track the status of each specification.
-        
-        PROJECT REQUIREMENT TEMPLATE PART 1:
-        
-        1. **Idea (Required):**  
-        Please state your idea for the IoT project.
-        For example, "I want to make an IoT-based water heater."
-        - If already stated, confirm from the chat history.
-
-        PROJECT REQUIREMENT TEMPLATE PART 2:
-        2. **Hardware Setup:**
-
-        - **Processing Board:**  
-            Choose between Arduino or Raspberry Pi.
-            <EXTRA RULES>
-            DEFAULT is Arduino. If user want didn't state or want an advice, suggest Arduino. If already stated, confirm from the chat history.
-
-        - **Sensor Connectivity (Required, default: GPiO):**  
-            Choose between UART, GPiO, or i2C. Please also suggest specific sensor models or brands based on the project idea.
-            <EXTRA RULES> : DEFAULT is GPiO. 
-            Search your knowledge for the sensors that stated by the users, if user misspell or not clear, suggest the correct sensor.
-            After you found the correct sensor, find the correct connectivity type by the sensor. If the sensor can only be connected using specific connectivity, suggest it.
-            If user want didn't state or want an advice, suggest GPiO. If already stated, confirm from the chat history.
-            If user already stated the sensor, search assistant knowlede to suggest the correct connection.
-
-        - **Network Connectivity (GSM/WIFI) (Required, default: Wifi):**  
-            Choose between GSM or Wifi. Please suggest specific network modules or components based on the project idea.
-            <EXTRA RULES> : DEFAULT is Wifi. If user want didn't state or want an advice, suggest the best option from GSM or Wifi based on the Idea. 
-            If already stated, confirm from the chat history.
-    
-
-        - **Communication Protocol (Required, default: HTTP):**  
-            Choose between MQTT, Websocket, or HTTP. Recommend specific libraries or components that are suitable for the chosen communication protocol.
-            - If already stated, confirm from the chat history.
-            <EXTRA RULES> : DEFAULT is HTTP. If user want didn't state or want an advice, suggest the best option from MQTT, Websocket, or HTTP based on the Idea.
-            
-        PROJECT REQUIREMENT TEMPLATE PART 3:
-        <EXTRA RULES> :
-        Assistant can skip this part if the user didn't provide any information about this part, or if user state that they don't have any constraints or limitations.
-
-        3. **Environment Constraints:**
-        - **Limitation (Optional):**  
-            Specify any limitations, such as "Maximum heat will be 100 degrees C."
-            <EXTRA RULES> If already stated, confirm from the chat history.
-
-        - **Constraint (Optional):**  
-            Specify any constraints, such as "Data must be sent every 2 seconds."
-            - If already stated, confirm from the chat history.
-
-        - **Object Distance (Optional):**  
-            Specify any object distance, such as "No distance between water and heat sensor."
-            - If already stated, confirm from the chat history.
-
-
-        PROJECT REQUIREMENT TEMPLATE PART 4:
-        In this part assistant will reconfirm all the specification is correct and prepare to generate the IoT Project Setup.
-        the assistant will assess the feasibility of the hardware, network, and communication setup based on the user's IoT idea.
-        if assistant think the current hardware, network or communication setup is not suitable, assistant should suggest the best option based on the user's IoT idea.
-        Assistant can revise the PROJECT REQUIREMENTS based on user agreement of the feasible suggestion.
-        the Setup will follow the sequence of the PROJECT SETUP starting from PART 1, PART 2, and then PART 3.
-        If the project requirements are not yet complete, the assistant will continue to ask for the missing information.
-
-        Dont proceed to the project part if the user complete information about this part, or if user state that they don't have any constraints or limitations.
-        ---
-
-        PROJECT SETUP 
-        PART 1 - HARDWARE SETUP:
-        In this part assistant will give the hardware setup based on the PROJECT REQUIREMENTS that already gathered before.
-        The hardware setup should be explained in detail, including how to connect the board, pins, library setup for required hardware, and the coding for the hardware.
-        Assistant should make sure the hardware setup is correct based on the user's IoT idea and the specifications collected.
-        Assistant should provide necessary assistance to the user from the hardware setup to the connectivity setup.
-        to keep the session focus this part should only explain the hardware setup, not wifi or communication setup.
-        - **Proactively suggest hardware** if missing components are identified during setup, such as resistors or LED.
-
-        After the user confirm the hardware setup is successfully setup, assistant can proceed to the PART 2 - CONNECTIVITY SETUP.
-        
-        PART 2 - CONNECTIVITY AND COMMUNICATION SETUP:
-        In this part assistant will give the connectivity and communication setup based on the PROJECT REQUIREMENTS that already gathered before.
-        The connectivity setup should be explained in detail, including how to connect the network module, communication protocol, and the coding for the code.
-        Assistant should make sure the connectivity setup is correct based on the user's IoT idea and the specifications collected.
-        Assistant should provide necessary assistance to the user from the connectivity setup to the communication setup.
-        Assistant can ask if user want full code of the combined hardware code and connectivity or not.
-        After the user confirm the connectivity setup is successfully setup, assistant can proceed to the PART 3 - CONFIRMATION PROJECT FINISH.
-
-        PART 3 - CONFIRMATION PROJECT FINISH:
-        In this part assistant make sure the project is successfully setup and ready to use.
-        After user confirm the project is successfully setup, assistant should generate the FINAL RECORD based on the final specifications, final setup result and chat history on the FINAL RECORD FORMAT SAMPLE.
-
-        FINAL RECORD FORMAT SAMPLE:
-        HARDWARE:
-        - Finished at : {current_time}
-        - Board : ESP32
-        - Sensor : DHT22, DS18B20, LM393
-        - Network : Wifi
-        - Communication : MQTT
-        - Specification Changelog :
-        - User stated the project idea is to make an IoT-based water heater.
-        - User stated the processing board is Arduino.
-        - User change the available pin from D1 to D2.
-        - User change the sensor from DHT11 to DHT22.
-
-        ---
-
-        USER QUERY:  
-        {query}
-
-        CHAT HISTORY:  
-        {chat_history}
-
-        ---
-
-        """
-    # Get the current system time
-    current_time =  get_current_time()
-
-    # Create the prompt
-    prompt = ChatPromptTemplate.from_template(template)
-
-    llm = ChatOpenAI(model_name=current_model)  # Adjust the model name as needed
-
-    chain = prompt | llm | StrOutputParser()
-
-    # Convert chat history to the format expected by the chain
-    formatted_chat_history = []
-    for msg in chat_history:
-        if msg['role'] == 'user':
-            formatted_chat_history.append(HumanMessage(content=msg['content']))
+def get_response(query, chat_history, query_token_count=None, stream_container=None, history_summary=None, requirement_state=None, timer=None, choice=None):
+    def generate(model):
+        # Prompt, LLM client and chain are built once per process and reused
+        if use_model_router:
+            llm_kwargs = model_router.llm_kwargs()
+        elif use_resilient_calls:
+            llm_kwargs = llm_caller.llm_kwargs()
         else:
-            formatted_chat_history.append(AIMessage(content=msg['content']))
-
-    # Generate the response
-    response = chain.invoke({
-        "chat_history": formatted_chat_history,
-        "query": query,
-        "current_time": current_time  # Pass the current time to the prompt
-    })
-
-     # Token Counting
-    encoding = tiktoken.encoding_for_model(current_model)  # Use the appropriate model name
-
-    # Prepare the full prompt text
-    # Include the formatted chat history and the query
-    full_prompt_messages = []
-
-    # Add the system prompt (if any)
-    full_prompt_messages.append(template)
-
-    # Add the chat history messages
-    for msg in formatted_chat_history:
-        role = "User" if isinstance(msg, HumanMessage) else "Assistant"
-        full_prompt_messages.append(f"{role}: {msg.content}")
-
-    # Add the user's query
-    full_prompt_messages.append(f"User: {query}")
-
-    # Combine all messages into a single string
-    full_prompt_text = "\n".join(full_prompt_messages)
-
-    # Count tokens in the input (prompt + chat history + query)
-    input_token_count = len(encoding.encode(full_prompt_text))
-
-    # Count tokens in the assistant's response
-    output_token_count = len(encoding.encode(response))
-
-    # Return response and token counts
-    return response, input_token_count, output_token_count
+            llm_kwargs = {}
+        resources = get_chat_resources(model, prompt_version, prompt_registry.get(prompt_version).template, **llm_kwargs)
+        return generate_response(
+            resources, query, chat_history, get_current_time(),
+            query_token_count=query_token_count,
+            stream_container=stream_container,
+            history_summary=history_summary,
+            requirement_state=requirement_state,
+            keep_turns=history_keep_turns,
+            token_budget=history_token_budget,
+            timer=timer,
+            caller=llm_caller if use_resilient_calls else None,
+            history_offset=state['history_offset']
+        )
+
+    if choice is None:
+        return generate(current_model)
+    # The router retries with its fallback model and records that in choice
+    return model_router.generate(choice, generate)
 
 # Step 5: Display the Conversation
+def render_message(message, message_id):
+    # Markdown is prepared once per message id (its position in the stored
+    # chat_history), later reruns reuse it
+    rendered = state.setdefault('rendered_markdown', {})
+    if message_id not in rendered:
+        rendered[message_id] = textwrap.dedent(message['content']).strip()
+    with st.chat_message("Human" if message['role'] == 'user' else "AI"):
+        st.markdown(rendered[message_id])
+
+
+# Only the last messages are rendered on each rerun, older ones behind "load earlier"
+if 'render_count' not in state:
+    state['render_count'] = history_page_size
+
+hidden = len(state['chat_history']) - state['render_count']
+if hidden > 0 or state['history_offset'] > 0:
+    if st.button("Tampilkan pesan sebelumnya"):
+        state['render_count'] += history_page_size
+        missing = state['render_count'] - len(state['chat_history'])
+        if missing > 0 and state['history_offset'] > 0:
+            with state_store.lock(st.session_state['state_key']):
+                # Fetch the previous page from MongoDB, these messages are already stored
+                start = max(state['history_offset'] - missing, 0)
+                earlier = load_history_page(
+                    sessions_collection, ObjectId(state['session_id']),
+                    start, state['history_offset'] - start
+                )
+                state['chat_history'] = earlier + state['chat_history']
+                state['persisted_message_count'] += len(earlier)
+                state['history_offset'] = start
+
 # Conversation
-for message in st.session_state['chat_history']:
-    if message['role'] == 'user':
-        with st.chat_message("Human"):
-            st.markdown(message['content'])
-    else:
-        with st.chat_message("AI"):
-            st.markdown(message['content'])
+offset = state['history_offset']
+first = max(len(state['chat_history']) - state['render_count'], 0)
+for index in range(first, len(state['chat_history'])):
+    render_message(state['chat_history'][index], offset + index)
+
+save_state()
 
 # Step 6: Handle User Input and Save to MongoDB
 # User input
@@ -309,55 +410,228 @@ for message in st.session_state['chat_history']:
 user_query = st.chat_input("Pesan Anda:")
 
 if user_query is not None and user_query.strip() != "":
-    # Token count for user message
-    encoding = tiktoken.encoding_for_model(current_model)
-    user_token_count = len(encoding.encode(user_query))
-
-    # Append user message to chat history
-    user_message = {
-        'role': 'user',
-        'content': user_query,
-        'token_count': user_token_count
-    }
-    st.session_state['chat_history'].append(user_message)
-
-    with st.chat_message("Human"):
-        st.markdown(user_query)
-
-    # Get AI response and token counts
-    ai_response, input_token_count, output_token_count = get_response(user_query, st.session_state['chat_history'])
-
-    # Token count for AI message
-    ai_token_count = output_token_count
+    # One turn per state at a time: two tabs with the same key would append
+    # to the same chat_history together
+    with state_store.lock(st.session_state['state_key']):
+        # Time spent in each phase of the turn, stored with the token usage
+        timer = PhaseTimer()
+
+        # Token count for user message
+        with timer.phase('tokenize'):
+            user_token_count = get_token_ledger(current_model).count(user_query)
+
+        user_message = {
+            'role': 'user',
+            'content': user_query,
+            'token_count': user_token_count,
+            # Also stored with the turn's token usage, which replay joins on
+            'message_id': uuid.uuid4().hex
+        }
+        session_filter = {'_id': ObjectId(state['session_id'])}
 
-    # Append AI message to chat history
-    ai_message = {
-        'role': 'assistant',
-        'content': ai_response,
-        'timestamp': get_current_time(),
-        'token_count': ai_token_count
-    }
-    st.session_state['chat_history'].append(ai_message)
-
-    with st.chat_message("AI"):
-        st.markdown(ai_response)
-
-    # Update chat history and token counts in MongoDB
-    sessions_collection.update_one(
-        {'_id': ObjectId(st.session_state['session_id'])},
-        {
-            '$set': {'chat_history': st.session_state['chat_history']},
-            '$inc': {
-                'total_input_tokens': input_token_count,
-                'total_output_tokens': output_token_count
-            },
-            '$push': {
-                'token_usage': {
+        with st.chat_message("Human"):
+            st.markdown(user_query)
+
+        history_summary = state['history_summary'] if compact_history else None
+        requirement_state = state['requirement_state'] if use_requirement_state else None
+
+        # Identical early turns are answered from the response cache
+        cache_key = None
+        cached = None
+        # Messages before history_offset were not loaded, about half of them are user turns
+        user_turns = sum(1 for message in state['chat_history'] if message['role'] == 'user') + 1
+        user_turns += state['history_offset'] // 2
+        if use_response_cache and user_turns <= response_cache_max_turns:
+            cache_key = response_cache.key(prompt_version, current_model, user_query, state['chat_history'])
+            cached = response_cache.get(cache_key)
+
+        # Paraphrases are answered from the semantic cache, a share of its hits is
+        # audited by asking the model anyway and comparing the answers
+        semantic_hit = None
+        use_semantic = use_semantic_cache and user_turns <= semantic_cache_max_turns
+        if cached is None and use_semantic:
+            semantic_hit = semantic_cache.lookup(prompt_version, current_model, user_query, state['requirement_state'])
+            if semantic_hit is not None and not semantic_hit['audit']:
+                cached = semantic_hit
+
+        # Model of this turn, from the setup phase so far and the query
+        choice = None
+        if use_model_router and cached is None:
+            choice = model_router.route(detect_setup_phase(state['chat_history']), user_query)
+
+        # Turns that call the model wait for a slot; during a burst they queue per
+        # student, are served round-robin and show their position meanwhile
+        admitted = False
+        if use_admission_control and cached is None:
+            queue_notice = st.empty()
+
+            def show_position(position):
+                queue_notice.info(f"Banyak pertanyaan sedang diproses, pesan Anda ada di antrian ke-{position}...")
+
+            try:
+                with timer.phase('queue'):
+                    admission.acquire(state['student_info']['student_id'], on_wait=show_position)
+                admitted = True
+            except AdmissionRejected:
+                pass
+            queue_notice.empty()
+            if not admitted:
+                # Neither sent to the model nor stored, the student asks again once the burst is over
+                with st.chat_message("AI"):
+                    st.warning(busy_message)
+                save_state()
+                st.stop()
+
+        # Get AI response and token counts
+        try:
+            # Append user message to chat history
+            state['chat_history'].append(user_message)
+
+            # Queue the user message now, it is stored while the LLM is generating
+            message_write = None
+            if background_writes and persistence_mode == "append":
+                message_write = session_writer.submit(
+                    write_filter(
+                        session_filter['_id'], state['chat_history'], state['persisted_message_count'],
+                        stored_count=state['history_offset'] + state['persisted_message_count']
+                    ),
+                    build_messages_update(state['chat_history'], state['persisted_message_count'])
+                )
+                state['persisted_message_count'] = len(state['chat_history'])
+
+            if cached is not None:
+                # Nothing is sent to the model, so the turn costs no tokens
+                ai_response, input_token_count, output_token_count, usage = cached['response'], 0, 0, {}
+                with st.chat_message("AI"), timer.phase('render'):
+                    st.markdown(ai_response)
+            elif stream_responses:
+                # Rendering happens while streaming, so it is part of the llm phase
+                with st.chat_message("AI"), timer.phase('llm'):
+                    ai_response, input_token_count, output_token_count, usage = get_response(
+                        user_query, state['chat_history'], user_token_count,
+                        stream_container=st, history_summary=history_summary, requirement_state=requirement_state,
+                        timer=timer, choice=choice
+                    )
+            else:
+                with timer.phase('llm'):
+                    ai_response, input_token_count, output_token_count, usage = get_response(
+                        user_query, state['chat_history'], user_token_count,
+                        history_summary=history_summary, requirement_state=requirement_state, timer=timer,
+                        choice=choice
+                    )
+                with st.chat_message("AI"), timer.phase('render'):
+                    st.markdown(ai_response)
+        except (StreamInterrupted, *RETRYABLE_ERRORS) as exc:
+            # No answer (timeouts, rate limits with no fallback, a stream that
+            # broke off): the user message is taken back, in memory and after its
+            # queued write in MongoDB, so the history keeps alternating and the
+            # student sends the question again
+            state['chat_history'].pop()
+            if message_write is not None:
+                session_writer.submit(
+                    session_filter, {'$pull': {'chat_history': {'message_id': user_message['message_id']}}}
+                )
+                state['persisted_message_count'] -= 1
+            with st.chat_message("AI"):
+                st.warning(interrupted_message if isinstance(exc, StreamInterrupted) else busy_message)
+            save_state()
+            st.stop()
+        finally:
+            if admitted:
+                admission.release(state['student_info']['student_id'])
+
+        # Token count for AI message
+        if cached is not None:
+            ai_token_count = cached['token_count']
+        else:
+            ai_token_count = output_token_count
+            if cache_key is not None:
+                response_cache.put(cache_key, ai_response, ai_token_count)
+            if semantic_hit is not None:
+                semantic_cache.record_audit(prompt_version, current_model, user_query, semantic_hit, ai_response)
+            elif use_semantic:
+                semantic_cache.store(
+                    prompt_version, current_model, user_query, state['requirement_state'],
+                    ai_response, ai_token_count
+                )
+
+        # Append AI message to chat history
+        ai_message = {
+            'role': 'assistant',
+            'content': ai_response,
+            'timestamp': get_current_time(),
+            'token_count': ai_token_count
+        }
+        state['chat_history'].append(ai_message)
+
+        # Update the requirement state with this turn (rules-based, no LLM call)
+        with timer.phase('extract'):
+            state['requirement_state'] = extract_requirements(
+                state['requirement_state'], [user_message, ai_message]
+            )
+
+        # The user message write overlapped the LLM call, it is normally done by now
+        if message_write is not None and message_write.done.is_set() and message_write.elapsed_ms is not None:
+            timer.record('mongo_write', message_write.elapsed_ms / 1000)
+
+        # Latency, cost and setup phase of this turn, stored with the token usage
+        setup_phase = detect_setup_phase(state['chat_history'])
+        metrics = turn_metrics(
+            choice['model'] if choice else current_model, prompt_version, setup_phase,
+            input_token_count, output_token_count, usage, timer.as_ms()
+        )
+        if metrics_exporter is not None:
+            metrics_exporter.record_turn(dict(
+                metrics, input_tokens=input_token_count, output_tokens=output_token_count,
+                cached_input_tokens=usage.get('cached_input_tokens', 0)
+            ))
+
+        # Update chat history and token counts in MongoDB
+        # In append mode only the messages not stored yet are pushed. The
+        # update only matches while the session holds exactly the messages this
+        # state stored, a turn stored meanwhile by another replica wins
+        if message_write is not None and message_write.matched_count == 0:
+            # The user message already lost, so does the turn
+            st.warning(conflict_message)
+            state.pop('chat_history')
+        else:
+            update = build_turn_update(
+                state['chat_history'],
+                state['persisted_message_count'],
+                input_token_count,
+                output_token_count,
+                {
                     'timestamp': get_current_time(),
+                    # The user message this turn answered
+                    'message_id': user_message['message_id'],
                     'input_tokens': input_token_count,
                     'output_tokens': output_token_count,
-                    'total_tokens': input_token_count + output_token_count
+                    'total_tokens': input_token_count + output_token_count,
+                    'cache_hit': cached is not None,
+                    # As reported by the API, cached_input_tokens were served from the prompt cache
+                    'api_input_tokens': usage.get('input_tokens'),
+                    'api_output_tokens': usage.get('output_tokens'),
+                    'cached_input_tokens': usage.get('cached_input_tokens', 0),
+                    **metrics,
+                    # Router choice: requested model, reason and whether the fallback answered
+                    'routing': choice
+                },
+                mode=persistence_mode,
+                extra_set={
+                    'requirement_state': state['requirement_state'],
+                    'history_summary': state['history_summary'],
+                    # Active sessions are never swept as near-empty duplicates
+                    'last_activity': get_current_time(),
+                    # Finished sessions are no longer offered for resume; only set
+                    # once the FINAL RECORD is written, never back to open
+                    **({'status': 'finished'} if setup_phase == 'finished' else {}),
                 }
-            }
-        }
-    )
\ No newline at end of file
+            )
+            stored = write_filter(
+                session_filter['_id'], state['chat_history'], state['persisted_message_count'],
+                stored_count=state['history_offset'] + state['persisted_message_count']
+            )
+            # Checked by the next run (the background write is applied later)
+            state['last_write'] = (session_writer if background_writes else sessions_collection).update_one(stored, update)
+            state['persisted_message_count'] = len(state['chat_history'])
+        save_state()
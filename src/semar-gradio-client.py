@@ -0,0 +1,52 @@
+from dotenv import load_dotenv
+import gradio as gr
+import os
+
+from semar.client import TurnError, get_semar_client
+from semar.streaming import coalesce_text
+
+
+# Thin Gradio front end of the Semar-Bot API (python -m semar.api); a new
+# backend session is started per browser session and student.
+
+load_dotenv()
+
+SEMAR_API_URL = os.getenv("SEMAR_API_URL", "http://127.0.0.1:8000")
+api = get_semar_client(SEMAR_API_URL)
+
+# Same update throttling as chat-gradio.py
+STREAM_INTERVAL = 0.05
+STREAM_MAX_CHARS = 200
+CONCURRENCY_LIMIT = int(os.getenv("GRADIO_CONCURRENCY_LIMIT", "16"))
+MAX_QUEUE_SIZE = int(os.getenv("GRADIO_MAX_QUEUE_SIZE", "100"))
+
+# (session hash, NIM) -> backend session id
+sessions = {}
+
+
+def generate_response(message, history, student_id, student_name, request: gr.Request):
+    if not student_id.strip() or not student_name.strip():
+        yield "Informasi NIM & Nama harus diisi."
+        return
+    key = (request.session_hash, student_id.strip())
+    if key not in sessions:
+        sessions[key] = api.start_session(student_id.strip(), student_name.strip(), resume=False)['session_id']
+    try:
+        deltas = api.stream_turn(
+            sessions[key], message,
+            on_queued=lambda position: gr.Info(f"Pesan Anda ada di antrian ke-{position}")
+        )
+        yield from coalesce_text(deltas, STREAM_INTERVAL, STREAM_MAX_CHARS)
+    except TurnError as exc:
+        yield f"Maaf, jawaban tidak dapat dibuat ({exc}). Silakan coba lagi."
+
+demo = gr.ChatInterface(generate_response,
+    chatbot=gr.Chatbot(height=600),
+    textbox=gr.Textbox(placeholder="Pesan Anda", container=False, scale=7),
+    additional_inputs=[gr.Textbox(label="NIM"), gr.Textbox(label="Nama")],
+    title="Semar-Bot",
+    retry_btn=None,
+    undo_btn=None,
+    clear_btn=None,
+    concurrency_limit=CONCURRENCY_LIMIT)
+demo.queue(default_concurrency_limit=CONCURRENCY_LIMIT, max_size=MAX_QUEUE_SIZE).launch()
@@ -0,0 +1,2 @@
+# Helper modules for the Semar-Bot Streamlit app (src/semar-chatbot-oneshot.py).
+# `streamlit run` puts src/ on sys.path, so the app imports these as `semar.<module>`.
@@ -0,0 +1,221 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+
+_lock = threading.Lock()
+_controllers = {}
+
+
+class AdmissionRejected(Exception):
+    """The turn was not admitted: the queue is full or the wait timed out."""
+
+    def __init__(self, reason, waited=0.0):
+        super().__init__(f"Turn not admitted ({reason})")
+        self.reason = reason
+        self.waited = waited
+
+
+class _Ticket:
+    # Compared by identity, two queued turns of a student are different tickets
+    __slots__ = ('student', 'granted')
+
+    def __init__(self, student):
+        self.student = student
+        self.granted = False
+
+
+class AdmissionController:
+    """Cap on the turns calling the model at once, with a fair queue in front.
+
+    At most `max_concurrent` turns hold a slot. The others wait in one queue
+    per student and free slots go to the students round-robin, so a student
+    with many queued turns gets one slot per round instead of starving the
+    others. With `max_per_student`, a student holds at most that many slots
+    even when others are free, so a burst from one student arriving first
+    cannot take them all. At most `max_queue` turns wait; beyond that, or
+    after `timeout` seconds of waiting, AdmissionRejected is raised. While a
+    turn waits, `on_wait(position)` is called whenever its (estimated) queue
+    position changes.
+
+    The cap is per process: with several replicas or workers the model sees
+    up to replicas x max_concurrent turns.
+    """
+
+    def __init__(self, max_concurrent=8, max_queue=200, timeout=120.0, poll_interval=0.5, max_per_student=None):
+        self.max_concurrent = max_concurrent
+        self.max_per_student = max_per_student
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._active = 0
+        self._active_by_student = {}
+        # student -> queued tickets, the first student is served next
+        self._queues = OrderedDict()
+        self._depth = 0
+        self._waits = deque(maxlen=1000)
+        # Called with (event, wait_seconds, queue_depth), e.g. a metrics exporter
+        self.listeners = []
+        self.stats = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timeouts': 0, 'max_depth': 0, 'max_wait_s': 0.0}
+
+    def _may_start(self, student):
+        return self.max_per_student is None or self._active_by_student.get(student, 0) < self.max_per_student
+
+    def _start(self, student):
+        self._active += 1
+        self._active_by_student[student] = self._active_by_student.get(student, 0) + 1
+
+    def _dispatch(self):
+        # Hands free slots to the next students in turn (holding the lock)
+        while self._active < self.max_concurrent:
+            student = next((student for student in self._queues if self._may_start(student)), None)
+            if student is None:
+                break
+            tickets = self._queues[student]
+            tickets.popleft().granted = True
+            self._depth -= 1
+            self._start(student)
+            if tickets:
+                self._queues.move_to_end(student)
+            else:
+                del self._queues[student]
+        self._cond.notify_all()
+
+    def _position(self, ticket):
+        # 1 + the queued turns served before this one, round by round
+        order = list(self._queues)
+        rank = order.index(ticket.student)
+        index = self._queues[ticket.student].index(ticket)
+        ahead = index
+        for position, student in enumerate(order):
+            if student != ticket.student:
+                ahead += min(len(self._queues[student]), index + (1 if position < rank else 0))
+        return ahead + 1
+
+    def _remove(self, ticket):
+        tickets = self._queues.get(ticket.student)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            self._depth -= 1
+            if not tickets:
+                del self._queues[ticket.student]
+
+    def _notify(self, event, waited):
+        for listener in self.listeners:
+            listener(event, waited, self._depth)
+
+    def acquire(self, student, on_wait=None):
+        """Wait for a slot for one turn of `student`, returns the seconds waited.
+
+        Every acquire() must be followed by a release(student).
+        """
+        start = time.monotonic()
+        with self._cond:
+            if self._active < self.max_concurrent and not self._queues and self._may_start(student):
+                self._start(student)
+                self.stats['admitted'] += 1
+                ticket = None
+            elif self._depth >= self.max_queue:
+                self.stats['rejected'] += 1
+                ticket = False
+            else:
+                ticket = _Ticket(student)
+                self._queues.setdefault(student, deque()).append(ticket)
+                self._depth += 1
+                self.stats['queued'] += 1
+                self.stats['max_depth'] = max(self.stats['max_depth'], self._depth)
+                # Free slots held back for students at their limit may go to this one
+                self._dispatch()
+        if ticket is None:
+            self._waits.append(0.0)
+            self._notify('admitted', 0.0)
+            return 0.0
+        if ticket is False:
+            self._notify('rejected', 0.0)
+            raise AdmissionRejected("queue full")
+
+        deadline = start + self.timeout
+        shown = None
+        try:
+            while True:
+                with self._cond:
+                    if not ticket.granted:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._remove(ticket)
+                            self.stats['timeouts'] += 1
+                            timed_out = True
+                        else:
+                            timed_out = False
+                            position = self._position(ticket)
+                if ticket.granted:
+                    break
+                if timed_out:
+                    self._notify('timeout', self.timeout)
+                    raise AdmissionRejected("timeout", self.timeout)
+                if on_wait is not None and position != shown:
+                    # Outside the lock, the callback may update a UI
+                    on_wait(position)
+                    shown = position
+                with self._cond:
+                    if not ticket.granted:
+                        self._cond.wait(min(self.poll_interval, remaining))
+        except BaseException:
+            # Interrupted while queued (e.g. a Streamlit rerun raised from
+            # on_wait): give the slot back if it was granted meanwhile,
+            # otherwise leave the queue, so no slot is held by nobody
+            with self._cond:
+                if ticket.granted:
+                    self._release(student)
+                else:
+                    self._remove(ticket)
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self.stats['admitted'] += 1
+            self.stats['max_wait_s'] = max(self.stats['max_wait_s'], waited)
+            self._waits.append(waited)
+        self._notify('admitted', waited)
+        return waited
+
+    def _release(self, student):
+        # Holding the lock
+        self._active -= 1
+        self._active_by_student[student] -= 1
+        if not self._active_by_student[student]:
+            del self._active_by_student[student]
+        self._dispatch()
+
+    def release(self, student):
+        with self._cond:
+            self._release(student)
+
+    @contextmanager
+    def admit(self, student, on_wait=None):
+        waited = self.acquire(student, on_wait)
+        try:
+            yield waited
+        finally:
+            self.release(student)
+
+    def snapshot(self):
+        with self._cond:
+            waits = sorted(self._waits)
+            snapshot = dict(self.stats, active=self._active, queue_depth=self._depth,
+                            students_waiting=len(self._queues))
+        if waits:
+            snapshot['wait_p50_s'] = waits[len(waits) // 2]
+            snapshot['wait_p95_s'] = waits[min(len(waits) - 1, int(round(0.95 * (len(waits) - 1))))]
+        return snapshot
+
+
+def get_admission_controller(name="llm", **options):
+    # One controller per process and name, shared by every session; the
+    # options only apply the first time
+    with _lock:
+        if name not in _controllers:
+            _controllers[name] = AdmissionController(**options)
+        return _controllers[name]
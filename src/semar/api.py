@@ -0,0 +1,532 @@
+"""Headless Semar-Bot backend: the chat turn and its persistence as an HTTP API.
+
+    POST /sessions                      start or resume a session
+    GET  /sessions/{id}/messages        a page of stored messages
+    POST /sessions/{id}/turns           answer a query, streamed as Server-Sent Events
+                                        ('queued' position, 'delta' text, 'done' or 'error')
+    GET  /stats                         connection pool, LLM caller and admission stats
+
+Every turn loads the recent history and requirement state of its session from
+MongoDB and stores the turn before the final event, so any worker process can
+answer any turn. Run with several workers (MONGODB_URI and OPENAI_API_KEY from
+the environment):
+
+    python -m semar.api --workers 4 --port 8000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from pytz import timezone
+
+from semar.admission import AdmissionRejected, get_admission_controller
+from semar.experiments import get_active_experiment
+from semar.metrics import get_metrics_exporter, turn_metrics
+from semar.mongo import get_sessions_collection, pool_metrics
+from semar.persistence import build_turn_update, load_history_page, load_recent_history, read_chat_history, write_filter
+from semar.prompts import get_prompt_registry
+from semar.requirements import detect_setup_phase, extract_requirements, new_requirements
+from semar.resilience import get_resilient_caller
+from semar.resources import get_chat_resources, get_token_ledger
+from semar.router import ModelRouter
+from semar.sessions import find_open_session, start_session_sweeper, touch_session
+from semar.timing import PhaseTimer
+from semar.turn import generate_response
+
+
+logger = logging.getLogger(__name__)
+
+GREETING = """
+Halo! {student_name}! Saya Semar-Bot, asisten Setup IoT mu. Mari mulai dengan setup proyek IoT Anda.
+Apa jenis proyek IoT yang sedang Anda kerjakan hari ini? Anda bisa mulai dengan menyatakan ide Anda untuk proyek tersebut.
+sebagai contoh, "Saya ingin membuat pemanas air berbasis IoT, dengan ESP32 sebagai board mikro, dan DHT22 sebagai sensor suhu."
+_Loaded prompt version: {prompt_version}_
+"""
+
+
+def get_current_time():
+    return datetime.now(tz=timezone('Asia/Tokyo')).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class SessionNotFound(KeyError):
+    pass
+
+
+class SessionConflict(Exception):
+    """Another turn of the session was stored after this one loaded it."""
+
+
+class QueueStream:
+    """stream_container for generate_response that hands each text delta to an
+    asyncio queue, so the event loop can send it while the turn runs on a
+    worker thread."""
+
+    def __init__(self, loop, queue):
+        self.loop = loop
+        self.queue = queue
+
+    def write_stream(self, deltas):
+        parts = []
+        for delta in deltas:
+            parts.append(delta)
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, ('delta', {'text': delta}))
+        return "".join(parts)
+
+    def queued(self, position):
+        # Queue position while the turn waits for an LLM slot
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, ('queued', {'position': position}))
+
+
+class ChatService:
+    """Session start and chat turn of Semar-Bot, without any UI code.
+
+    Same flow as semar-chatbot-oneshot.py (prompt version and experiment arm
+    per student, open session resume, model routing, requirement state,
+    append-mode persistence, admission control); the response and semantic
+    caches are not used. All methods block, the API runs them on worker
+    threads.
+
+    Turns of one session run one at a time in the process. The turn is only
+    stored if the session still has the messages it was loaded with, so a
+    turn racing one on another replica raises SessionConflict instead of
+    interleaving the messages.
+    """
+
+    def __init__(self, collection, prompt_registry, model="gpt-4o-mini", default_prompt_version="v1.6.1",
+                 router=None, caller=None, llm=None, history_limit=20, keep_turns=3, token_budget=3000,
+                 metrics_exporter=None, admission=None):
+        self.collection = collection
+        self.prompt_registry = prompt_registry
+        self.model = model
+        self.default_prompt_version = default_prompt_version
+        self.router = router
+        self.caller = caller
+        # Any chat model in place of ChatOpenAI (the benchmarks use a local fake)
+        self.llm = llm
+        self.history_limit = history_limit
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.metrics_exporter = metrics_exporter
+        # AdmissionController in front of the model call, AdmissionRejected
+        # propagates when the turn gets no slot (nothing is stored then)
+        self.admission = admission
+        # session id -> lock held for the whole turn, dropped when unused
+        self._session_locks = weakref.WeakValueDictionary()
+        self._session_locks_lock = threading.Lock()
+
+    def greeting(self, student_name, prompt_version):
+        return {'role': 'assistant', 'content': GREETING.format(student_name=student_name, prompt_version=prompt_version)}
+
+    def _load(self, session_id):
+        session = load_recent_history(self.collection, session_id, self.history_limit)
+        if session is None:
+            raise SessionNotFound(str(session_id))
+        return session
+
+    def _view(self, session_id, session):
+        # What a client needs to show the session
+        messages = read_chat_history(session)
+        offset = session.get('message_count', len(messages)) - len(messages)
+        if not messages:
+            messages = [self.greeting(session.get('student_name', ""), session['prompt_version'])]
+        return {
+            'session_id': str(session_id),
+            'prompt_version': session['prompt_version'],
+            'model': session.get('model'),
+            'experiment': session.get('experiment'),
+            'history_offset': offset,
+            'messages': messages,
+        }
+
+    def start_session(self, student_id, student_name, prompt_version=None, resume=None):
+        """Session of the student, by the rules of Step 1 and 2 of the app.
+
+        When an unfinished session with answered turns exists and `resume` is
+        None, nothing is created and 'open_session' describes it; call again
+        with resume=True or False.
+        """
+        experiment = get_active_experiment()
+        arm = None
+        if experiment is not None and prompt_version is None:
+            arm = experiment.assign(student_id)
+            if arm['prompt_version'] not in self.prompt_registry.versions:
+                arm = None  # invalid prompt file, the registry logged why
+        if arm is not None:
+            version, model = arm['prompt_version'], arm['model']
+            experiment_info = {'name': experiment.name, 'arm': arm['name']}
+        else:
+            version = self.prompt_registry.select(student_id, requested=prompt_version, fallback=self.default_prompt_version)
+            model, experiment_info = self.model, None
+
+        open_session = find_open_session(self.collection, student_id, version)
+        reuse = open_session is not None and (open_session['message_count'] == 0 or resume)
+        if reuse and touch_session(self.collection, open_session['_id'], get_current_time()):
+            # Touched so the sweeper does not delete it while it is in use
+            session_id = open_session['_id']
+        elif not reuse and open_session is not None and resume is None:
+            return {
+                'prompt_version': version,
+                'open_session': {
+                    'session_id': str(open_session['_id']),
+                    'message_count': open_session['message_count'],
+                    'created_at': open_session['created_at'],
+                },
+            }
+        else:
+            session_id = self.collection.insert_one({
+                'student_id': student_id,
+                'student_name': student_name,
+                'created_at': get_current_time(),
+                'last_activity': get_current_time(),
+                'model': model,
+                'prompt_version': version,
+                'experiment': experiment_info,
+                'status': 'open',
+                'chat_history': [],
+            }).inserted_id
+        session = self._load(session_id)
+        session.setdefault('student_name', student_name)
+        return self._view(session_id, session)
+
+    def history(self, session_id, start, limit):
+        return load_history_page(self.collection, session_id, start, limit)
+
+    def _session_lock(self, session_id):
+        with self._session_locks_lock:
+            lock = self._session_locks.get(session_id)
+            if lock is None:
+                lock = threading.Lock()
+                self._session_locks[session_id] = lock
+            return lock
+
+    def run_turn(self, session_id, query, stream_container=None):
+        """Answer `query` in the session and store the turn (Step 6 of the app).
+
+        Returns the stored answer with its token counts, metrics and routing.
+        """
+        with self._session_lock(session_id):
+            return self._run_turn(session_id, query, stream_container)
+
+    def _run_turn(self, session_id, query, stream_container):
+        timer = PhaseTimer()
+        with timer.phase('load'):
+            session = self._load(session_id)
+        prompt_version = session['prompt_version']
+        model = session.get('model') or self.model
+        chat_history = read_chat_history(session)
+        offset = session.get('message_count', len(chat_history)) - len(chat_history)
+        persisted_count = len(chat_history)
+        if not chat_history:
+            # Stored with the first turn, as the app does
+            chat_history = [self.greeting(session.get('student_name', ""), prompt_version)]
+            persisted_count = 0
+        requirement_state = session.get('requirement_state') or new_requirements()
+
+        with timer.phase('tokenize'):
+            user_token_count = get_token_ledger(model).count(query)
+        user_message = {
+            'role': 'user', 'content': query, 'token_count': user_token_count, 'message_id': uuid.uuid4().hex
+        }
+        chat_history.append(user_message)
+
+        # The arm's model answers every turn of an experiment session
+        choice = None
+        if self.router is not None and not session.get('experiment'):
+            choice = self.router.route(detect_setup_phase(chat_history), query)
+
+        def generate(model):
+            if choice is not None:
+                llm_kwargs = self.router.llm_kwargs()
+            elif self.caller is not None:
+                llm_kwargs = self.caller.llm_kwargs()
+            else:
+                llm_kwargs = {}
+            resources = get_chat_resources(
+                model, prompt_version, self.prompt_registry.get(prompt_version).template, self.llm, **llm_kwargs
+            )
+            return generate_response(
+                resources, query, chat_history, get_current_time(),
+                query_token_count=user_token_count,
+                stream_container=stream_container,
+                requirement_state=requirement_state,
+                keep_turns=self.keep_turns,
+                token_budget=self.token_budget,
+                timer=timer,
+                caller=self.caller
+            )
+
+        student = session.get('student_id')
+        if self.admission is not None:
+            with timer.phase('queue'):
+                self.admission.acquire(student, getattr(stream_container, 'queued', None))
+        try:
+            with timer.phase('llm'):
+                if choice is None:
+                    ai_response, input_token_count, output_token_count, usage = generate(model)
+                else:
+                    ai_response, input_token_count, output_token_count, usage = self.router.generate(choice, generate)
+        finally:
+            if self.admission is not None:
+                self.admission.release(student)
+
+        ai_message = {
+            'role': 'assistant',
+            'content': ai_response,
+            'timestamp': get_current_time(),
+            'token_count': output_token_count
+        }
+        chat_history.append(ai_message)
+        with timer.phase('extract'):
+            requirement_state = extract_requirements(requirement_state, [user_message, ai_message])
+
+        setup_phase = detect_setup_phase(chat_history)
+        metrics = turn_metrics(
+            choice['model'] if choice else model, prompt_version, setup_phase,
+            input_token_count, output_token_count, usage, timer.as_ms()
+        )
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.record_turn(dict(
+                metrics, input_tokens=input_token_count, output_tokens=output_token_count,
+                cached_input_tokens=usage.get('cached_input_tokens', 0)
+            ))
+
+        # Stored before the answer is confirmed, so the next turn (on any
+        # worker) loads it
+        # Finished once the FINAL RECORD is written, later turns keep it finished
+        status = 'finished' if setup_phase == 'finished' or session.get('status') == 'finished' else 'open'
+        update = build_turn_update(
+            chat_history, persisted_count, input_token_count, output_token_count,
+            {
+                'timestamp': get_current_time(),
+                'message_id': user_message['message_id'],
+                'input_tokens': input_token_count,
+                'output_tokens': output_token_count,
+                'total_tokens': input_token_count + output_token_count,
+                'cache_hit': False,
+                'api_input_tokens': usage.get('input_tokens'),
+                'api_output_tokens': usage.get('output_tokens'),
+                'cached_input_tokens': usage.get('cached_input_tokens', 0),
+                **metrics,
+                'routing': choice
+            },
+            mode="append",
+            extra_set={'requirement_state': requirement_state, 'last_activity': get_current_time(),
+                       **({'status': 'finished'} if setup_phase == 'finished' else {})}
+        )
+        stored = write_filter(session_id, chat_history, persisted_count, stored_count=offset + persisted_count)
+        if self.collection.update_one(stored, update).matched_count == 0:
+            raise SessionConflict(str(session_id))
+        return {
+            'message': ai_message,
+            # Position of the answer in the stored chat_history
+            'message_index': offset + len(chat_history) - 1,
+            'input_tokens': input_token_count,
+            'output_tokens': output_token_count,
+            'metrics': metrics,
+            'routing': choice,
+            'status': status,
+        }
+
+
+def service_from_env():
+    # Same settings as semar-chatbot-oneshot.py
+    load_dotenv()
+    collection = get_sessions_collection(os.getenv("MONGODB_URI"), "semar_bot_db")
+    start_session_sweeper(collection)
+    model = os.getenv("SEMAR_MODEL", "gpt-4o-mini")
+    router = None
+    if os.getenv("SEMAR_MODEL_ROUTER", "1") == "1":
+        router = ModelRouter(
+            phase_models={
+                'requirements': "gpt-4o-mini",
+                'hardware_setup': "gpt-4o-mini",
+                'connectivity_setup': "gpt-4o",
+                'confirmation': "gpt-4o-mini",
+                'finished': "gpt-4o-mini",
+            },
+            code_model="gpt-4o",
+            default_model=model,
+            fallback_models={"gpt-4o": "gpt-4o-mini", "gpt-4o-mini": "gpt-4o"},
+            timeout=30,
+            max_retries=0,
+        )
+    caller = get_resilient_caller(
+        timeout=60,
+        retries=3,
+        requests_per_minute=int(os.getenv("SEMAR_LLM_RPM", "0")) or None,
+        hedge=False,
+    )
+    # Per worker process, the model sees up to workers x max_concurrent turns
+    admission = get_admission_controller(
+        max_concurrent=int(os.getenv("SEMAR_MAX_CONCURRENT_TURNS", "8")),
+        max_queue=int(os.getenv("SEMAR_MAX_QUEUED_TURNS", "200")),
+        timeout=120,
+        max_per_student=2,
+    )
+    metrics_exporter = get_metrics_exporter()
+    if metrics_exporter is not None and metrics_exporter.record_admission not in admission.listeners:
+        admission.listeners.append(metrics_exporter.record_admission)
+    return ChatService(
+        collection,
+        get_prompt_registry(models=(model, "gpt-4o")),
+        model=model,
+        default_prompt_version=os.getenv("SEMAR_PROMPT_VERSION", "v1.6.1"),
+        router=router,
+        caller=caller,
+        metrics_exporter=metrics_exporter,
+        admission=admission
+    )
+
+
+class SessionRequest(BaseModel):
+    student_id: str
+    student_name: str
+    prompt_version: Optional[str] = None
+    resume: Optional[bool] = None
+
+
+class TurnRequest(BaseModel):
+    query: str
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _object_id(session_id):
+    try:
+        return ObjectId(session_id)
+    except InvalidId:
+        raise HTTPException(404, f"Unknown session {session_id}")
+
+
+def create_app(service=None, turn_threads=None):
+    """The FastAPI app; without a service it is built from the environment
+    (uvicorn semar.api:create_app --factory)."""
+    if service is None:
+        service = service_from_env()
+    # Turns block on the LLM and MongoDB, they run on these threads while the
+    # event loop keeps streaming the other turns
+    executor = ThreadPoolExecutor(
+        max_workers=turn_threads or int(os.getenv("SEMAR_API_TURN_THREADS", "64")),
+        thread_name_prefix="semar-turn"
+    )
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        # Turns still running are finished and stored before the worker exits
+        executor.shutdown(wait=True)
+
+    app = FastAPI(title="Semar-Bot API", lifespan=lifespan)
+    app.state.service = service
+
+    @app.post("/sessions")
+    async def start_session(request: SessionRequest):
+        if not request.student_id.strip() or not request.student_name.strip():
+            raise HTTPException(422, "student_id and student_name are required")
+        try:
+            return await run_in_threadpool(
+                service.start_session, request.student_id.strip(), request.student_name.strip(),
+                request.prompt_version, request.resume
+            )
+        except KeyError as exc:
+            # The default prompt version is not loaded
+            raise HTTPException(400, str(exc))
+
+    @app.get("/sessions/{session_id}/messages")
+    async def messages(session_id: str, start: int = 0, limit: int = Query(20, ge=1, le=200)):
+        return {'messages': await run_in_threadpool(service.history, _object_id(session_id), max(start, 0), limit)}
+
+    @app.post("/sessions/{session_id}/turns")
+    async def turn(session_id: str, request: TurnRequest):
+        object_id = _object_id(session_id)
+        if not request.query.strip():
+            raise HTTPException(422, "query is empty")
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def work():
+            try:
+                item = ('done', service.run_turn(object_id, request.query, QueueStream(loop, queue)))
+            except SessionNotFound:
+                item = ('error', {'status': 404, 'message': f"Unknown session {session_id}"})
+            except SessionConflict:
+                # Another turn of the session was stored first, this answer was not
+                item = ('error', {'status': 409, 'message': f"Session {session_id} changed during the turn, reload it"})
+            except AdmissionRejected as exc:
+                # Too busy, nothing was stored and the client can send the query again
+                item = ('error', {'status': 503, 'message': str(exc), 'reason': exc.reason})
+            except Exception as exc:
+                logger.exception("Turn failed in session %s", session_id)
+                item = ('error', {'status': 500, 'message': f"{type(exc).__name__}: {exc}"})
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        # The turn runs (and is stored) even when the client goes away
+        loop.run_in_executor(executor, work)
+
+        async def events():
+            pending = None
+            while True:
+                event, data = pending or await queue.get()
+                pending = None
+                if event == 'delta':
+                    # Deltas that arrived while the last event was being sent go out as one
+                    parts = [data['text']]
+                    while not queue.empty():
+                        pending = queue.get_nowait()
+                        if pending[0] != 'delta':
+                            break
+                        parts.append(pending[1]['text'])
+                        pending = None
+                    data = {'text': "".join(parts)}
+                yield sse_event(event, data)
+                if event in ('done', 'error'):
+                    break
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={'Cache-Control': "no-cache", 'X-Accel-Buffering': "no"})
+
+    @app.get("/stats")
+    async def stats():
+        return {
+            'pool': pool_metrics.snapshot(),
+            'llm_caller': dict(service.caller.stats) if service.caller is not None else None,
+            'admission': service.admission.snapshot() if service.admission is not None else None,
+            'turn_threads': executor._max_workers,
+        }
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the Semar-Bot API.")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=int(os.getenv("SEMAR_API_WORKERS", "1")),
+                        help="worker processes, each with its own MongoDB pool and LLM clients")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    uvicorn.run("semar.api:create_app", factory=True, host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
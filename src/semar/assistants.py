@@ -0,0 +1,241 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import httpx
+import openai
+
+
+logger = logging.getLogger(__name__)
+
+# Run states after which the run does nothing more on its own
+TERMINAL_STATES = ('completed', 'failed', 'cancelled', 'expired', 'incomplete', 'requires_action')
+
+# Stream events that end a run, mapped to its final state
+TERMINAL_EVENTS = {f"thread.run.{state}": state for state in TERMINAL_STATES}
+
+
+class RunError(Exception):
+    """A run that ended in another state than completed (or timed out)."""
+
+    def __init__(self, run_id, status, detail=None):
+        super().__init__(f"Run {run_id} ended as {status}" + (f": {detail}" if detail else ""))
+        self.run_id = run_id
+        self.status = status
+        self.detail = detail
+
+
+def _check_run(run):
+    if run.status == 'completed':
+        return run
+    detail = getattr(run, 'last_error', None) or getattr(run, 'incomplete_details', None)
+    if run.status == 'requires_action':
+        # The samples register no function tools, so nothing can answer the action
+        detail = "the run asked for tool outputs"
+    raise RunError(run.id, run.status, detail)
+
+
+def _cancel(client, thread_id, run_id):
+    try:
+        client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except openai.APIError as exc:
+        logger.warning("Could not cancel run %s: %s", run_id, exc)
+
+
+def wait_for_run(client, thread_id, run_id, timeout=120.0, initial_delay=0.2, max_delay=2.0, factor=1.5):
+    """Poll a run until it reaches a terminal state.
+
+    The delay starts short (most answers take a few seconds) and grows up to
+    `max_delay`. After `timeout` seconds the run is cancelled and RunError
+    raised with status 'timeout'.
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+        if run.status in TERMINAL_STATES:
+            return _check_run(run)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            _cancel(client, thread_id, run_id)
+            raise RunError(run_id, 'timeout', f"not finished after {timeout}s")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * factor, max_delay)
+
+
+def stream_run(client, thread_id, assistant_id, instructions=None, timeout=120.0):
+    # Runs the assistant with streaming events, returns (run, messages of the run)
+    deadline = time.monotonic() + timeout
+    messages = []
+    run = None
+    try:
+        with client.beta.threads.runs.stream(
+            thread_id=thread_id, assistant_id=assistant_id, instructions=instructions, timeout=timeout
+        ) as stream:
+            for event in stream:
+                if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step"):
+                    run = event.data
+                elif event.event == "thread.message.completed":
+                    messages.append(event.data)
+                if event.event in TERMINAL_EVENTS:
+                    break
+                if time.monotonic() > deadline:
+                    if run is not None:
+                        _cancel(client, thread_id, run.id)
+                    raise RunError(run.id if run else None, 'timeout', f"not finished after {timeout}s")
+    except (openai.APIConnectionError, httpx.TransportError):
+        # httpx errors come from reading the stream, after the request itself succeeded
+        if run is None:
+            raise
+        logger.warning("Run %s stream was interrupted, polling it instead", run.id)
+    if run is None:
+        raise RunError(None, 'failed', "the stream ended before the run started")
+    if run.status not in TERMINAL_STATES:
+        # The stream was cut off, the run itself may still finish
+        return wait_for_run(client, thread_id, run.id, max(deadline - time.monotonic(), 0)), None
+    return _check_run(run), messages
+
+
+def run_turn(client, thread_id, assistant_id, query, instructions=None, timeout=120.0, stream=True):
+    """Add the user's query to the thread, run the assistant and return the
+    assistant messages of that run.
+
+    Streaming events end the wait as soon as the run finishes; when streaming
+    is off or not available, the run is polled with adaptive backoff.
+    """
+    client.beta.threads.messages.create(thread_id=thread_id, role="user", content=query)
+    messages = None
+    if stream:
+        try:
+            run, messages = stream_run(client, thread_id, assistant_id, instructions, timeout)
+        except (openai.APIConnectionError, openai.APIStatusError) as exc:
+            # No run was started, start one without streaming
+            logger.warning("Run stream failed (%s), polling instead", exc)
+            stream = False
+    if not stream:
+        run = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id, instructions=instructions)
+        run = wait_for_run(client, thread_id, run.id, timeout)
+    if messages is None:
+        # Only the messages of this run, not the earlier answers in the thread
+        messages = list(client.beta.threads.messages.list(thread_id=thread_id, run_id=run.id, order='asc'))
+    return [message for message in messages if message.role == "assistant"]
+
+
+# Assistant ids are kept here between launches, per assistant name
+ASSISTANT_ID_FILE = os.getenv("SEMAR_ASSISTANT_ID_FILE", "assistant_ids.json")
+
+
+def _spec_digest(spec):
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def get_or_create_assistant(client, spec, path=ASSISTANT_ID_FILE):
+    """Id of the assistant described by `spec` (the assistants.create arguments).
+
+    The id is stored in `path` and reused on the next launch; the assistant is
+    updated when the spec changed and created again only if it was deleted.
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        stored = {}
+    entry = stored.get(spec['name'])
+    digest = _spec_digest(spec)
+    if entry:
+        try:
+            if entry['digest'] != digest:
+                client.beta.assistants.update(entry['id'], **spec)
+            else:
+                client.beta.assistants.retrieve(entry['id'])
+            assistant_id = entry['id']
+        except openai.NotFoundError:
+            assistant_id = None
+    else:
+        assistant_id = None
+    if assistant_id is None:
+        assistant_id = client.beta.assistants.create(**spec).id
+    if not entry or entry != {'id': assistant_id, 'digest': digest}:
+        stored[spec['name']] = {'id': assistant_id, 'digest': digest}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(stored, f, indent=2)
+    return assistant_id
+
+
+class ThreadRegistry:
+    """One Assistants thread per user (e.g. a Gradio session hash).
+
+    Users get their own thread, so they neither see each other's messages nor
+    wait for each other's runs; the turns of one user are serialized because a
+    thread accepts no new message while a run is active. At most `max_threads`
+    are kept, the least recently used is evicted first, and threads idle for
+    `idle_timeout` seconds are dropped. Dropped threads are deleted from the
+    API by cleanup(), which start_cleanup() runs periodically.
+    """
+
+    def __init__(self, client, max_threads=1000, idle_timeout=3600):
+        self.client = client
+        self.max_threads = max_threads
+        self.idle_timeout = idle_timeout
+        self._threads = OrderedDict()
+        self._dropped = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._threads)
+
+    @contextmanager
+    def thread_for(self, user):
+        # Yields the user's thread id, holding the user's lock for the turn
+        with self._lock:
+            entry = self._threads.get(user)
+            if entry is None:
+                entry = {'id': None, 'lock': threading.Lock(), 'last_used': time.monotonic()}
+                self._threads[user] = entry
+            self._threads.move_to_end(user)
+            while len(self._threads) > self.max_threads:
+                self._dropped.append(self._threads.popitem(last=False)[1])
+        with entry['lock']:
+            if entry['id'] is None:
+                entry['id'] = self.client.beta.threads.create().id
+            entry['last_used'] = time.monotonic()
+            try:
+                yield entry['id']
+            finally:
+                entry['last_used'] = time.monotonic()
+
+    def cleanup(self):
+        # Drops idle threads and deletes every dropped thread, returns how many
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            for user, entry in list(self._threads.items()):
+                if entry['last_used'] < cutoff and not entry['lock'].locked():
+                    del self._threads[user]
+                    self._dropped.append(entry)
+            # Threads evicted in the middle of a turn are deleted on a later pass
+            dropped = [entry['id'] for entry in self._dropped if entry['id'] and not entry['lock'].locked()]
+            self._dropped = [entry for entry in self._dropped if entry['lock'].locked()]
+        for thread_id in dropped:
+            try:
+                self.client.beta.threads.delete(thread_id)
+            except openai.APIError as exc:
+                logger.warning("Could not delete thread %s: %s", thread_id, exc)
+        return len(dropped)
+
+    def start_cleanup(self, interval=300):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.cleanup()
+                except Exception:
+                    logger.exception("Thread cleanup failed")
+
+        thread = threading.Thread(target=run, name="semar-thread-cleanup", daemon=True)
+        thread.start()
+        return thread
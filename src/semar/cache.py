@@ -0,0 +1,117 @@
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+from datetime import datetime, timedelta, timezone
+
+from cachetools import TTLCache
+
+
+# Exact-match response cache for repeated early-conversation turns (the same
+# opener sent by a whole class, FAQ questions). Opt-in from the app.
+
+_lock = threading.Lock()
+_caches = {}
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def short_history(chat_history, turns):
+    # The last `turns` user/assistant pairs before the query. The greeting is
+    # skipped: it contains the student's name and would make every key unique.
+    messages = list(chat_history)
+    while messages and messages[0]['role'] != 'user':
+        messages.pop(0)
+    return messages[-turns * 2:] if turns else []
+
+
+class MongoCacheStore:
+    """Persists cache entries in MongoDB so they survive restarts and are shared by replicas."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        # MongoDB removes expired entries by itself
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    def get(self, key):
+        now = datetime.now(timezone.utc)
+        document = self.collection.find_one({'_id': key, 'expires_at': {'$gt': now}})
+        if document is None:
+            return None
+        return {'response': document['response'], 'token_count': document['token_count']}
+
+    def put(self, key, entry, ttl):
+        self.collection.update_one(
+            {'_id': key},
+            {'$set': dict(entry, expires_at=datetime.now(timezone.utc) + timedelta(seconds=ttl))},
+            upsert=True
+        )
+
+
+class ResponseCache:
+    """TTL + LRU cache of AI answers keyed by (prompt_version, model, query, short history)."""
+
+    def __init__(self, max_entries=1000, ttl=3600, history_turns=1, store=None):
+        self.ttl = ttl
+        self.history_turns = history_turns
+        self.store = store
+        self._entries = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def key(self, prompt_version, model, query, chat_history):
+        history = [
+            [message['role'], normalize_text(message['content'])]
+            for message in short_history(chat_history, self.history_turns)
+        ]
+        raw = json.dumps([prompt_version, model, normalize_text(query), history], ensure_ascii=False)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+        entry = self.store.get(key) if self.store is not None else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.store_hits += 1
+            self._entries[key] = entry
+        return entry
+
+    def put(self, key, response, token_count):
+        entry = {'response': response, 'token_count': token_count}
+        with self._lock:
+            self._entries[key] = entry
+        if self.store is not None:
+            self.store.put(key, entry, self.ttl)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.store_hits + self.misses
+            return {
+                'hits': self.hits,
+                'store_hits': self.store_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.store_hits) / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+            }
+
+
+def get_response_cache(max_entries=1000, ttl=3600, history_turns=1, collection=None):
+    # One cache per process, shared by every Streamlit session
+    with _lock:
+        if 'response' not in _caches:
+            store = MongoCacheStore(collection) if collection is not None else None
+            _caches['response'] = ResponseCache(max_entries, ttl, history_turns, store)
+        return _caches['response']
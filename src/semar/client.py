@@ -0,0 +1,83 @@
+import json
+import threading
+
+import httpx
+
+
+# Client of the Semar-Bot API (semar.api) for the thin Streamlit and Gradio
+# front ends. One client (and connection pool) per process and base URL.
+_lock = threading.Lock()
+_clients = {}
+
+
+class TurnError(Exception):
+    """The backend could not answer the turn (its 'error' event)."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def read_events(lines):
+    # (event, data) pairs of a Server-Sent Events stream
+    event, data = "message", []
+    for line in lines:
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+
+class SemarClient:
+    def __init__(self, base_url, timeout=180.0, max_connections=200):
+        # The read timeout covers the wait for the first streamed token; each
+        # streaming turn holds a connection, so the pool bounds concurrent turns
+        self.http = httpx.Client(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+
+    def start_session(self, student_id, student_name, prompt_version=None, resume=None):
+        response = self.http.post("/sessions", json={
+            'student_id': student_id, 'student_name': student_name,
+            'prompt_version': prompt_version, 'resume': resume,
+        })
+        response.raise_for_status()
+        return response.json()
+
+    def history(self, session_id, start, limit):
+        response = self.http.get(f"/sessions/{session_id}/messages", params={'start': start, 'limit': limit})
+        response.raise_for_status()
+        return response.json()['messages']
+
+    def stream_turn(self, session_id, query, result=None, on_queued=None):
+        """Text deltas of the answer as they arrive; the final event (stored
+        message, token counts, metrics) is put in `result`. While the turn
+        waits for a model slot, `on_queued(position)` gets its queue position."""
+        with self.http.stream("POST", f"/sessions/{session_id}/turns", json={'query': query}) as response:
+            response.raise_for_status()
+            for event, data in read_events(response.iter_lines()):
+                if event == 'delta':
+                    yield data['text']
+                elif event == 'queued':
+                    if on_queued is not None:
+                        on_queued(data['position'])
+                elif event == 'done':
+                    if result is not None:
+                        result.update(data)
+                    return
+                elif event == 'error':
+                    raise TurnError(data.get('status'), data.get('message'))
+        raise TurnError(None, "the stream ended before the answer was stored")
+
+
+def get_semar_client(base_url, **options):
+    with _lock:
+        if base_url not in _clients:
+            _clients[base_url] = SemarClient(base_url, **options)
+        return _clients[base_url]
@@ -0,0 +1,186 @@
+# A/B experiments over prompt versions and models. Students are assigned to an
+# arm by a hash of their NIM, the arm is stored on the session document, and the
+# rollup below compares the arms straight from the sessions collection.
+#
+# Run from src/:  python -m semar.experiments --experiment prompt-model-1 [--save]
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+
+logger = logging.getLogger(__name__)
+
+EXPERIMENTS_FILE = os.getenv(
+    "SEMAR_EXPERIMENTS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "experiments.json")
+)
+
+
+class Experiment:
+    """Named experiment with weighted arms, each a (prompt_version, model) pair."""
+
+    def __init__(self, name, arms):
+        if not arms:
+            raise ValueError(f"Experiment {name} has no arms")
+        self.name = name
+        self.arms = [
+            dict(arm, name=arm.get('name') or f"{arm['prompt_version']}/{arm['model']}", weight=arm.get('weight', 1))
+            for arm in arms
+        ]
+
+    def assign(self, student_id):
+        # Same student, same arm: the hash is salted with the experiment name so
+        # the split is independent between experiments
+        point = int(hashlib.sha256(f"{self.name}:{student_id}".encode()).hexdigest(), 16) % 10000 / 10000
+        total = sum(arm['weight'] for arm in self.arms)
+        cumulative = 0.0
+        for arm in self.arms:
+            cumulative += arm['weight'] / total
+            if point < cumulative:
+                return arm
+        return self.arms[-1]
+
+
+_lock = threading.Lock()
+_loaded = {}
+
+
+def get_active_experiment(path=EXPERIMENTS_FILE):
+    # The file is read again only when it changes, None when no experiment is active
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _lock:
+        if _loaded.get('key') != (path, mtime):
+            experiment = None
+            try:
+                with open(path, encoding='utf-8') as f:
+                    config = json.load(f)
+                active = config.get('active')
+                if active:
+                    experiment = Experiment(active, config['experiments'][active]['arms'])
+            except (ValueError, KeyError) as exc:
+                logger.error("%s is invalid, no experiment is active: %s", path, exc)
+            _loaded.update(key=(path, mtime), experiment=experiment)
+        return _loaded['experiment']
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] if ordered else None
+
+
+def arm_summary_pipeline(experiment):
+    # Per arm: sessions, finished sessions, turns to finish, tokens and cost.
+    # Turns answered from the cache did not reach the model and are not
+    # counted (turns rejected by admission control are not stored at all)
+    return [
+        {'$match': {'experiment.name': experiment}},
+        {'$project': {
+            'arm': '$experiment.arm',
+            'finished': {'$eq': ['$status', 'finished']},
+            'turns': {'$size': {'$filter': {
+                'input': {'$ifNull': ['$token_usage', []]},
+                'cond': {'$ne': [{'$ifNull': ['$$this.cache_hit', False]}, True]},
+            }}},
+            'tokens': {'$add': [{'$ifNull': ['$total_input_tokens', 0]}, {'$ifNull': ['$total_output_tokens', 0]}]},
+            'cost': {'$sum': {'$ifNull': ['$token_usage.estimated_cost_usd', []]}},
+        }},
+        {'$group': {
+            '_id': '$arm',
+            'sessions': {'$sum': 1},
+            'finished': {'$sum': {'$cond': ['$finished', 1, 0]}},
+            # $avg skips the nulls of unfinished sessions
+            'turns_to_finish': {'$avg': {'$cond': ['$finished', '$turns', None]}},
+            'tokens_to_finish': {'$avg': {'$cond': ['$finished', '$tokens', None]}},
+            'tokens_per_session': {'$avg': '$tokens'},
+            'total_tokens': {'$sum': '$tokens'},
+            'cost_usd': {'$sum': '$cost'},
+        }},
+        {'$sort': {'_id': 1}},
+    ]
+
+
+def arm_latency_pipeline(experiment):
+    # LLM time and time to first token of every turn, per arm (percentiles are taken in Python,
+    # $percentile needs MongoDB 7)
+    return [
+        {'$match': {'experiment.name': experiment}},
+        {'$unwind': '$token_usage'},
+        {'$match': {'token_usage.cache_hit': {'$ne': True}}},
+        {'$group': {
+            '_id': '$experiment.arm',
+            'llm_ms': {'$push': '$token_usage.phase_timings_ms.llm'},
+            'ttft_ms': {'$push': '$token_usage.phase_timings_ms.ttft'},
+        }},
+    ]
+
+
+def arm_rollup(collection, experiment):
+    arms = {row['_id']: row for row in collection.aggregate(arm_summary_pipeline(experiment))}
+    for row in collection.aggregate(arm_latency_pipeline(experiment)):
+        arm = arms.setdefault(row['_id'], {'_id': row['_id']})
+        for key in ('llm_ms', 'ttft_ms'):
+            values = [v for v in row[key] if v is not None]
+            arm[f"p50_{key}"] = percentile(values, 50)
+            arm[f"p95_{key}"] = percentile(values, 95)
+    rollup = []
+    for name, arm in sorted(arms.items(), key=lambda item: str(item[0])):
+        arm = dict(arm, arm=name, experiment=experiment)
+        arm.pop('_id')
+        sessions = arm.get('sessions') or 0
+        arm['finish_rate'] = arm.get('finished', 0) / sessions if sessions else None
+        rollup.append(arm)
+    return rollup
+
+
+def save_rollup(collection, rollup):
+    # Precomputed rollups for dashboards, one document per (experiment, arm)
+    computed_at = datetime.now().isoformat()
+    for arm in rollup:
+        collection.update_one(
+            {'experiment': arm['experiment'], 'arm': arm['arm']},
+            {'$set': dict(arm, computed_at=computed_at)},
+            upsert=True
+        )
+
+
+def main():
+    from semar.mongo import get_mongo_client
+
+    parser = argparse.ArgumentParser(description="Compare the arms of a Semar-Bot experiment")
+    parser.add_argument('--experiment', help="experiment name, the active one by default")
+    parser.add_argument('--save', action='store_true', help="store the rollup in experiment_rollups")
+    args = parser.parse_args()
+
+    load_dotenv()
+    experiment = args.experiment
+    if not experiment:
+        active = get_active_experiment()
+        if active is None:
+            parser.error("no active experiment in experiments.json, pass --experiment")
+        experiment = active.name
+    db = get_mongo_client(os.getenv("MONGODB_URI"))["semar_bot_db"]
+    rollup = arm_rollup(db["sessions"], experiment)
+
+    columns = ('sessions', 'finished', 'turns_to_finish', 'tokens_to_finish', 'p95_llm_ms', 'p95_ttft_ms', 'cost_usd')
+    print(f"{'arm':>20} " + " ".join(f"{c:>16}" for c in columns))
+    for arm in rollup:
+        cells = []
+        for column in columns:
+            value = arm.get(column)
+            cells.append(f"{value:>16.4g}" if isinstance(value, (int, float)) else f"{'-':>16}")
+        print(f"{str(arm['arm']):>20} " + " ".join(cells))
+    if args.save:
+        save_rollup(db["experiment_rollups"], rollup)
+
+
+if __name__ == "__main__":
+    main()
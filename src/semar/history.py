@@ -0,0 +1,85 @@
+from semar.requirements import format_requirements, update_requirements
+
+
+# Chat history compaction: the last turns are sent verbatim, older turns are
+# folded into a running structured summary of the confirmed requirements.
+
+SUMMARY_HEADER = (
+    "SUMMARY OF EARLIER CONVERSATION (older turns were folded into this summary; "
+    "only values marked confirmed were confirmed in the chat history, ask the student "
+    "to confirm the others):"
+)
+
+STATE_HEADER = (
+    "REQUIREMENT STATE (tracked from the whole conversation, only the latest turns "
+    "of the chat history are shown; only values marked confirmed were confirmed in the "
+    "chat history, ask the student to confirm the others):"
+)
+
+
+def new_history_summary():
+    # folded_count: messages of the stored chat_history folded so far
+    return {'folded_count': 0, 'requirements': None, 'content': "", 'token_count': 0}
+
+
+class HistoryCompactor:
+    """Keeps the last `keep_turns` user turns within `token_budget` tokens.
+
+    The summary dict is updated in place and only ever folds the messages that
+    left the window since the previous call, it is never rebuilt from scratch.
+    It counts positions in the whole stored chat_history, so it can be stored
+    on the session document; `offset` is the position of the first message of
+    the chat_history given (a resumed session only loads the last page).
+    """
+
+    def __init__(self, token_ledger, keep_turns=3, token_budget=3000, summarizer=update_requirements):
+        self.token_ledger = token_ledger
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.summarizer = summarizer
+
+    def window_start(self, chat_history, folded_count):
+        # Start of the last keep_turns user turns
+        start = len(chat_history)
+        turns = 0
+        while start > 0 and turns < self.keep_turns:
+            start -= 1
+            if chat_history[start]['role'] == 'user':
+                turns += 1
+        # Shrink further while the window is over budget, always keeping the query
+        tokens = sum(self.token_ledger.message_tokens(m) for m in chat_history[start:])
+        while tokens > self.token_budget and start < len(chat_history) - 1:
+            tokens -= self.token_ledger.message_tokens(chat_history[start])
+            start += 1
+        # Folded messages never come back into the window
+        return max(start, folded_count)
+
+    def compact(self, chat_history, summary, offset=0):
+        # Returns the summary message (or None) and the verbatim window.
+        # Messages before `offset` that were never folded are not loaded, they
+        # are skipped (the requirement state of the session covers them)
+        folded = max(summary['folded_count'] - offset, 0)
+        start = self.window_start(chat_history, folded)
+        if start > folded:
+            requirements = summary['requirements']
+            for message in chat_history[folded:start]:
+                requirements = self.summarizer(requirements, message)
+            summary['requirements'] = requirements
+            summary['folded_count'] = offset + start
+            summary['content'] = f"{SUMMARY_HEADER}\n{format_requirements(requirements)}"
+            summary['token_count'] = self.token_ledger.count(summary['content'])
+
+        if summary['folded_count'] == 0:
+            return None, chat_history
+        summary_message = {'role': 'system', 'content': summary['content'], 'token_count': summary['token_count']}
+        return summary_message, chat_history[start:]
+
+    def compact_with_state(self, chat_history, requirements):
+        # The persisted requirement state already covers every turn, so the
+        # messages before the window are dropped instead of folded
+        start = self.window_start(chat_history, 0)
+        if start == 0:
+            return None, chat_history
+        content = f"{STATE_HEADER}\n{format_requirements(requirements)}"
+        summary_message = {'role': 'system', 'content': content}
+        return summary_message, chat_history[start:]
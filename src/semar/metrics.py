@@ -0,0 +1,153 @@
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# USD per 1M tokens: (input, cached input, output)
+MODEL_PRICES = {
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'gpt-4o': (2.50, 1.25, 10.00),
+    'gpt-4-turbo': (10.00, 10.00, 30.00),
+    'gpt-4': (30.00, 30.00, 60.00),
+    'gpt-3.5-turbo': (0.50, 0.50, 1.50),
+}
+
+
+def estimate_cost(model, input_tokens, output_tokens, cached_input_tokens=0):
+    # Dated model names (gpt-4o-mini-2024-07-18) use the price of their base model
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        base = max((name for name in MODEL_PRICES if model.startswith(name)), key=len, default=None)
+        prices = MODEL_PRICES.get(base)
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    uncached = max(input_tokens - cached_input_tokens, 0)
+    cost = uncached * input_price + cached_input_tokens * cached_price + output_tokens * output_price
+    return round(cost / 1_000_000, 6)
+
+
+class PrometheusExporter:
+    """Exposes turn metrics on /metrics (needs prometheus_client)."""
+
+    def __init__(self, port=9464):
+        from prometheus_client import Counter, Gauge, Histogram, start_http_server
+        labels = ['model', 'prompt_version', 'setup_phase']
+        buckets = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 40, 80)
+        self.ttft = Histogram('semar_ttft_seconds', "Time to first token", labels, buckets=buckets)
+        self.llm = Histogram('semar_llm_seconds', "Total LLM time per turn", labels, buckets=buckets)
+        self.tokens = Counter('semar_tokens_total', "Tokens used", labels + ['kind'])
+        self.cost = Counter('semar_cost_usd_total', "Estimated cost in USD", labels)
+        self.mongo = Histogram('semar_mongo_write_seconds', "MongoDB write time", ['collection'],
+                               buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1))
+        self.admission_wait = Histogram('semar_admission_wait_seconds', "Wait for an LLM slot", buckets=buckets)
+        self.admission = Counter('semar_admission_total', "Admission decisions", ['event'])
+        self.queue_depth = Gauge('semar_admission_queue_depth', "Turns waiting for an LLM slot")
+        start_http_server(port)
+
+    def record_turn(self, metrics):
+        labels = (metrics['model'], metrics['prompt_version'], metrics['setup_phase'])
+        timings = metrics['phase_timings_ms']
+        if 'ttft' in timings:
+            self.ttft.labels(*labels).observe(timings['ttft'] / 1000)
+        if 'llm' in timings:
+            self.llm.labels(*labels).observe(timings['llm'] / 1000)
+        self.tokens.labels(*labels, 'input').inc(metrics['input_tokens'])
+        self.tokens.labels(*labels, 'output').inc(metrics['output_tokens'])
+        self.tokens.labels(*labels, 'cached_input').inc(metrics.get('cached_input_tokens') or 0)
+        if metrics.get('estimated_cost_usd'):
+            self.cost.labels(*labels).inc(metrics['estimated_cost_usd'])
+
+    def record_write(self, collection, elapsed_ms):
+        self.mongo.labels(collection).observe(elapsed_ms / 1000)
+
+    def record_admission(self, event, wait_seconds, queue_depth):
+        self.admission.labels(event).inc()
+        if event == 'admitted':
+            self.admission_wait.observe(wait_seconds)
+        self.queue_depth.set(queue_depth)
+
+
+class OpenTelemetryExporter:
+    """Records turn metrics through the OpenTelemetry metrics API (needs opentelemetry-api).
+
+    The meter provider and its exporter are configured by the deployment,
+    e.g. with opentelemetry-instrument.
+    """
+
+    def __init__(self):
+        from opentelemetry import metrics
+        meter = metrics.get_meter("semar")
+        self.ttft = meter.create_histogram("semar.ttft", unit="ms", description="Time to first token")
+        self.llm = meter.create_histogram("semar.llm", unit="ms", description="Total LLM time per turn")
+        self.tokens = meter.create_counter("semar.tokens", description="Tokens used")
+        self.cost = meter.create_counter("semar.cost", unit="USD", description="Estimated cost")
+        self.mongo = meter.create_histogram("semar.mongo_write", unit="ms", description="MongoDB write time")
+        self.admission_wait = meter.create_histogram("semar.admission_wait", unit="ms", description="Wait for an LLM slot")
+        self.admission = meter.create_counter("semar.admission", description="Admission decisions")
+        self.queue_depth = meter.create_histogram("semar.admission_queue_depth", description="Turns waiting for an LLM slot")
+
+    def record_turn(self, metrics):
+        attributes = {
+            'model': metrics['model'],
+            'prompt_version': metrics['prompt_version'],
+            'setup_phase': metrics['setup_phase'],
+        }
+        timings = metrics['phase_timings_ms']
+        if 'ttft' in timings:
+            self.ttft.record(timings['ttft'], attributes)
+        if 'llm' in timings:
+            self.llm.record(timings['llm'], attributes)
+        self.tokens.add(metrics['input_tokens'], dict(attributes, kind='input'))
+        self.tokens.add(metrics['output_tokens'], dict(attributes, kind='output'))
+        if metrics.get('estimated_cost_usd'):
+            self.cost.add(metrics['estimated_cost_usd'], attributes)
+
+    def record_write(self, collection, elapsed_ms):
+        self.mongo.record(elapsed_ms, {'collection': collection})
+
+    def record_admission(self, event, wait_seconds, queue_depth):
+        self.admission.add(1, {'event': event})
+        if event == 'admitted':
+            self.admission_wait.record(wait_seconds * 1000)
+        self.queue_depth.record(queue_depth)
+
+
+EXPORTERS = {
+    'prometheus': PrometheusExporter,
+    'otel': OpenTelemetryExporter,
+}
+
+_lock = threading.Lock()
+_exporters = {}
+
+
+def get_metrics_exporter(name=None):
+    # Chosen with SEMAR_METRICS_EXPORTER ("prometheus" or "otel"), None when unset
+    name = name or os.getenv("SEMAR_METRICS_EXPORTER")
+    if not name:
+        return None
+    with _lock:
+        if name not in _exporters:
+            try:
+                _exporters[name] = EXPORTERS[name]()
+            except ImportError:
+                logger.warning("Metrics exporter %s is not installed, metrics are only stored in MongoDB", name)
+                _exporters[name] = None
+        return _exporters[name]
+
+
+def turn_metrics(model, prompt_version, setup_phase, input_tokens, output_tokens, usage, phase_timings_ms):
+    # Fields stored with each token_usage entry. The API counts are exact, the
+    # ledger counts are used for the cost when the API reported nothing.
+    billed_input = usage.get('input_tokens') or input_tokens
+    billed_output = usage.get('output_tokens') or output_tokens
+    return {
+        'model': model,
+        'prompt_version': prompt_version,
+        'setup_phase': setup_phase,
+        'estimated_cost_usd': estimate_cost(model, billed_input, billed_output, usage.get('cached_input_tokens') or 0),
+        'phase_timings_ms': phase_timings_ms,
+    }
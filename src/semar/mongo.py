@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+
+from pymongo import ASCENDING, DESCENDING, MongoClient, monitoring
+
+
+# One MongoClient (and connection pool) per process, shared by every Streamlit
+# session and rerun instead of a new client each time the script runs.
+_lock = threading.Lock()
+_clients = {}
+_indexed_collections = set()
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool listener keeping checked-out and checkout wait time stats."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.connections_created = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checked_out': self.checked_out,
+                'max_checked_out': self.max_checked_out,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'avg_wait_ms': self.total_wait / self.checkouts * 1000 if self.checkouts else 0.0,
+                'max_wait_ms': self.max_wait * 1000,
+                'connections_created': self.connections_created,
+            }
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait = time.perf_counter() - getattr(self._local, 'started', time.perf_counter())
+        with self._lock:
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+pool_metrics = PoolMetrics()
+
+
+def client_options():
+    # Pool size and timeouts, tunable per deployment from the environment
+    return {
+        'maxPoolSize': int(os.getenv("MONGODB_MAX_POOL_SIZE", "100")),
+        'minPoolSize': int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+        'maxIdleTimeMS': int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000")),
+        'waitQueueTimeoutMS': int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+        'connectTimeoutMS': int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000")),
+        'serverSelectionTimeoutMS': int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    }
+
+
+def get_mongo_client(uri):
+    with _lock:
+        if uri not in _clients:
+            _clients[uri] = MongoClient(uri, event_listeners=[pool_metrics], **client_options())
+        return _clients[uri]
+
+
+def ensure_session_indexes(collection):
+    # Run once per process; create_index is a no-op when the index exists
+    key = (collection.database.name, collection.name)
+    if key in _indexed_collections:
+        return
+    # Grading looks sessions up by student and time, resume by student and prompt version
+    collection.create_index([('student_id', ASCENDING), ('prompt_version', ASCENDING), ('created_at', DESCENDING)])
+    collection.create_index([('created_at', DESCENDING)])
+    collection.create_index([('prompt_version', ASCENDING)])
+    # Experiment rollups select the sessions of one experiment
+    collection.create_index([('experiment.name', ASCENDING)], sparse=True)
+    with _lock:
+        _indexed_collections.add(key)
+
+
+def get_sessions_collection(uri, db_name="semar_bot_db"):
+    collection = get_mongo_client(uri)[db_name]["sessions"]
+    ensure_session_indexes(collection)
+    return collection
@@ -0,0 +1,119 @@
+# Session persistence helpers for the `sessions` collection.
+#
+# "append" mode $push-es only the messages that are not stored yet, in the same
+# update as the token counters, so each write stays the size of one turn.
+# "rewrite" mode is the original behaviour ($set of the whole chat_history).
+#
+# Every new message gets a message_id and the update only matches while the
+# last new message is not stored yet, so a write that is retried or replayed
+# after it was applied changes nothing (no duplicated messages or counters).
+import uuid
+
+PERSISTENCE_MODES = ("append", "rewrite")
+
+
+def _new_messages(chat_history, persisted_count):
+    messages = chat_history[persisted_count:]
+    for message in messages:
+        message.setdefault('message_id', uuid.uuid4().hex)
+    return messages
+
+
+def write_filter(session_id, chat_history, persisted_count, stored_count=None):
+    # Filter of the update storing chat_history[persisted_count:]; with
+    # stored_count it only matches while the session still has that many
+    # messages, ending with the last one of chat_history already stored,
+    # i.e. no other turn was stored since it was loaded
+    filter = {'_id': session_id}
+    messages = _new_messages(chat_history, persisted_count)
+    if messages:
+        filter['chat_history.message_id'] = {'$ne': messages[-1]['message_id']}
+    if stored_count is not None:
+        filter['chat_history'] = {'$size': stored_count}
+        last = chat_history[persisted_count - 1] if persisted_count else {}
+        if stored_count and 'message_id' in last:
+            filter[f'chat_history.{stored_count - 1}.message_id'] = last['message_id']
+    return filter
+
+
+def build_turn_update(chat_history, persisted_count, input_tokens, output_tokens, token_usage, mode="append", extra_set=None):
+    if mode not in PERSISTENCE_MODES:
+        raise ValueError(f"Unknown persistence mode: {mode}")
+
+    update = {
+        '$inc': {
+            'total_input_tokens': input_tokens,
+            'total_output_tokens': output_tokens
+        },
+        '$push': {
+            'token_usage': token_usage
+        }
+    }
+    if mode == "append":
+        update['$push']['chat_history'] = {'$each': _new_messages(chat_history, persisted_count)}
+    else:
+        _new_messages(chat_history, persisted_count)
+        update['$set'] = {'chat_history': chat_history}
+    if extra_set:
+        # Other session fields (e.g. requirement_state) go in the same update
+        update.setdefault('$set', {}).update(extra_set)
+    return update
+
+
+def build_messages_update(chat_history, persisted_count):
+    # Push of the messages not stored yet, without touching the counters
+    return {'$push': {'chat_history': {'$each': _new_messages(chat_history, persisted_count)}}}
+
+
+def save_turn(collection, session_id, chat_history, persisted_count, input_tokens, output_tokens, token_usage, mode="append", extra_set=None):
+    # Returns the new persisted message count
+    update = build_turn_update(chat_history, persisted_count, input_tokens, output_tokens, token_usage, mode, extra_set)
+    collection.update_one(write_filter(session_id, chat_history, persisted_count), update)
+    return len(chat_history)
+
+
+def read_chat_history(session):
+    # Works for documents written by either mode, and for old documents that
+    # have no chat_history yet or messages without a token_count
+    if not session:
+        return []
+    history = session.get('chat_history') or []
+    if not isinstance(history, list):
+        return []
+    return [
+        message for message in history
+        if isinstance(message, dict) and 'role' in message and 'content' in message
+    ]
+
+
+def load_recent_history(collection, session_id, limit):
+    # Last `limit` messages, the total message count, the requirement state and
+    # the session settings, without sending the whole chat_history (and
+    # token_usage) over the wire
+    pipeline = [
+        {'$match': {'_id': session_id}},
+        {'$project': {
+            'chat_history': {'$slice': [{'$ifNull': ['$chat_history', []]}, -limit]},
+            'message_count': {'$size': {'$ifNull': ['$chat_history', []]}},
+            'requirement_state': 1,
+            'history_summary': 1,
+            'student_id': 1,
+            'student_name': 1,
+            'model': 1,
+            'prompt_version': 1,
+            'experiment': 1,
+            'status': 1,
+        }},
+    ]
+    documents = list(collection.aggregate(pipeline))
+    return documents[0] if documents else None
+
+
+def load_history_page(collection, session_id, start, limit):
+    # Messages start .. start + limit of the stored chat_history
+    pipeline = [
+        {'$match': {'_id': session_id}},
+        {'$project': {'chat_history': {'$slice': [{'$ifNull': ['$chat_history', []]}, start, limit]}}},
+    ]
+    documents = list(collection.aggregate(pipeline))
+    return read_chat_history(documents[0] if documents else None)
@@ -0,0 +1,188 @@
+import ast
+import hashlib
+import json
+import logging
+import os
+import textwrap
+import threading
+import time
+
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+from semar.resources import get_token_ledger
+
+
+logger = logging.getLogger(__name__)
+
+# Versioned prompt files, <version>.txt (v1.4.txt, v1.6.1.txt, ...)
+PROMPT_DIR = os.getenv(
+    "SEMAR_PROMPT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "prompts")
+)
+# Which version new sessions get: {"default": "v1.6.1", "weights": {"v1.6.1": 1, "v1.5": 1}}
+SELECTION_FILE = "selection.json"
+
+# Variables every prompt must use, get_response always passes exactly these
+REQUIRED_VARIABLES = {'query', 'chat_history', 'current_time'}
+
+
+def _read_assignments(path):
+    # Prompt files hold string assignments (`template = """..."""`, or `system`
+    # and `human`), read as literals instead of executing the file
+    with open(path, encoding='utf-8') as f:
+        source = textwrap.dedent(f.read())
+    values = {}
+    for node in ast.parse(source, filename=path).body:
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    values[target.id] = ast.literal_eval(node.value)
+    return values
+
+
+def load_template_file(path):
+    # Template of one prompt file, for get_chat_resources: a `template` string is
+    # the single human message layout (v1.4-v1.6), `system` plus `human` the
+    # message layout with the history in between
+    values = _read_assignments(path)
+    if 'template' in values:
+        return values['template']
+    if 'system' in values and 'human' in values:
+        return [
+            ("system", values['system']),
+            MessagesPlaceholder("chat_history"),
+            ("human", values['human']),
+        ]
+    raise ValueError(f"{path} has no template (or system and human) assignment")
+
+
+class PromptVersion:
+    """One validated prompt file."""
+
+    def __init__(self, version, path):
+        self.version = version
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.template = load_template_file(path)
+        with open(path, 'rb') as f:
+            self.digest = hashlib.sha256(f.read()).hexdigest()[:12]
+        if isinstance(self.template, str):
+            self.prompt = ChatPromptTemplate.from_template(self.template)
+            self.prompt_text = self.template
+        else:
+            self.prompt = ChatPromptTemplate.from_messages(self.template)
+            self.prompt_text = self.template[0][1]
+        variables = set(self.prompt.input_variables)
+        missing = REQUIRED_VARIABLES - variables
+        unknown = variables - REQUIRED_VARIABLES
+        if missing or unknown:
+            raise ValueError(f"{path}: missing variables {sorted(missing)}, unknown variables {sorted(unknown)}")
+
+    def token_count(self, model):
+        # Cached by the model's TokenLedger, counted once per version
+        return get_token_ledger(model).template_tokens(self.version, self.prompt_text)
+
+
+class PromptRegistry:
+    """Prompt versions loaded from PROMPT_DIR once, then refreshed at most every
+    `reload_interval` seconds so new versions and a new selection are picked up
+    without a restart.
+
+    A version is immutable once loaded: session documents record only the
+    version name, so an edited file is ignored (with a warning) until it gets
+    a new version name.
+    """
+
+    def __init__(self, prompt_dir=PROMPT_DIR, models=("gpt-4o-mini",), reload_interval=30):
+        self.prompt_dir = prompt_dir
+        self.models = models
+        self.reload_interval = reload_interval
+        self.versions = {}
+        self.errors = {}
+        self.selection = {'default': None, 'weights': {}}
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            self._checked = now
+            for name in sorted(os.listdir(self.prompt_dir)):
+                version, ext = os.path.splitext(name)
+                if ext != '.txt':
+                    continue
+                path = os.path.join(self.prompt_dir, name)
+                loaded = self.versions.get(version)
+                if loaded is not None:
+                    if os.path.getmtime(path) != loaded.mtime and version not in self.errors:
+                        logger.warning("Prompt %s changed on disk, save it under a new version to use it", version)
+                        self.errors[version] = "changed after loading"
+                    continue
+                try:
+                    prompt = PromptVersion(version, path)
+                    for model in self.models:
+                        prompt.token_count(model)
+                except (SyntaxError, ValueError, KeyError) as exc:
+                    if self.errors.get(version) != str(exc):
+                        logger.error("Prompt %s is invalid: %s", version, exc)
+                    self.errors[version] = str(exc)
+                    continue
+                self.versions[version] = prompt
+                self.errors.pop(version, None)
+            self._load_selection()
+
+    def _load_selection(self):
+        path = os.path.join(self.prompt_dir, SELECTION_FILE)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, encoding='utf-8') as f:
+                selection = json.load(f)
+        except ValueError as exc:
+            logger.error("%s is invalid, keeping the previous selection: %s", path, exc)
+            return
+        weights = {v: w for v, w in (selection.get('weights') or {}).items() if v in self.versions and w > 0}
+        self.selection = {'default': selection.get('default'), 'weights': weights}
+
+    def get(self, version):
+        self.refresh()
+        if version not in self.versions:
+            raise KeyError(f"Unknown prompt version {version} ({self.errors.get(version, 'no such file')})")
+        return self.versions[version]
+
+    def select(self, student_id, requested=None, fallback=None):
+        """Prompt version for a new session.
+
+        An explicitly requested (loaded) version wins, then the weighted split
+        of selection.json, deterministic per student, then its default.
+        """
+        self.refresh()
+        if requested in self.versions:
+            return requested
+        weights = self.selection['weights']
+        if weights:
+            point = int(hashlib.sha256(f"prompt:{student_id}".encode()).hexdigest(), 16) % 10000 / 10000
+            total = sum(weights.values())
+            cumulative = 0.0
+            for version in sorted(weights):
+                cumulative += weights[version] / total
+                if point < cumulative:
+                    return version
+        default = self.selection['default'] or fallback
+        if default not in self.versions:
+            raise KeyError(f"Default prompt version {default} is not loaded")
+        return default
+
+
+_lock = threading.Lock()
+_registries = {}
+
+
+def get_prompt_registry(prompt_dir=PROMPT_DIR, **options):
+    # One registry per prompt directory and process
+    with _lock:
+        if prompt_dir not in _registries:
+            _registries[prompt_dir] = PromptRegistry(prompt_dir, **options)
+        return _registries[prompt_dir]
@@ -0,0 +1,386 @@
+# Offline replay of stored sessions against another prompt version or model.
+# Every user turn of the selected sessions is answered again with the history the
+# student had at that point, and the result is compared with the original turn
+# (tokens, latency, answer length, estimated cost).
+#
+# Run from src/:
+#   python -m semar.replay --prompt-version v1.5 --output replay.jsonl
+#   python -m semar.replay --prompt-file draft.txt --prompt-version v1.7-draft ...  (a file outside prompts/)
+#   python -m semar.replay ... --batch-file batch.jsonl --submit      (OpenAI Batch API, half price)
+#   python -m semar.replay ... --fetch-batch batch_abc --batch-results results.jsonl --output replay.jsonl
+#
+# Results are appended to the JSONL output as they finish; turns already in it
+# are skipped, so an interrupted run continues where it stopped.
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from semar.metrics import estimate_cost
+from semar.mongo import get_sessions_collection
+from semar.persistence import read_chat_history
+from semar.prompts import get_prompt_registry, load_template_file
+from semar.requirements import extract_requirements, new_requirements
+from semar.resilience import ResilientCaller
+from semar.resources import get_chat_resources
+from semar.timing import PhaseTimer
+from semar.turn import build_chain_inputs, generate_response
+
+
+# Roles of the chat completions API for LangChain message types
+API_ROLES = {'human': 'user', 'ai': 'assistant', 'system': 'system'}
+
+# Requests per Batch API input file
+MAX_BATCH_REQUESTS = 50000
+
+
+def load_sessions(collection, source_version=None, student_id=None, limit=0):
+    query = {}
+    if source_version:
+        query['prompt_version'] = source_version
+    if student_id:
+        query['student_id'] = student_id
+    # Ids first, then one session at a time: a long replay would let a cursor time out
+    ids = [doc['_id'] for doc in collection.find(query, {'_id': 1}).sort('created_at', 1).limit(limit)]
+    projection = {'chat_history': 1, 'token_usage': 1, 'prompt_version': 1, 'model': 1, 'created_at': 1}
+    for session_id in ids:
+        session = collection.find_one({'_id': session_id}, projection)
+        if session is not None:
+            yield session
+
+
+def session_turns(session):
+    # One task per user message: the history up to and including it, and the original answer
+    history = read_chat_history(session)
+    token_usage = session.get('token_usage') or []
+    # Entries carry the message_id of the user message they answered; a turn
+    # that failed leaves a user message without one. Older entries have no id
+    # and are taken in order by the user messages that are not matched by id
+    usage_by_id = {usage['message_id']: usage for usage in token_usage if usage.get('message_id')}
+    unmatched = iter([usage for usage in token_usage if not usage.get('message_id')])
+    turn = 0
+    for index, message in enumerate(history):
+        if message['role'] != 'user':
+            continue
+        answer = history[index + 1] if index + 1 < len(history) and history[index + 1]['role'] == 'assistant' else None
+        usage = usage_by_id.get(message.get('message_id')) or next(unmatched, {})
+        model = usage.get('model') or session.get('model')
+        yield {
+            'id': f"{session['_id']}:{turn}",
+            'session_id': str(session['_id']),
+            'turn': turn,
+            'query': message['content'],
+            'history': history[:index + 1],
+            'current_time': usage.get('timestamp') or session.get('created_at') or "",
+            'original': {
+                'prompt_version': session.get('prompt_version'),
+                'model': model,
+                'input_tokens': usage.get('api_input_tokens') or usage.get('input_tokens'),
+                'output_tokens': usage.get('api_output_tokens') or usage.get('output_tokens'),
+                'latency_ms': (usage.get('phase_timings_ms') or {}).get('llm'),
+                'response_chars': len(answer['content']) if answer else None,
+                'estimated_cost_usd': usage.get('estimated_cost_usd'),
+            },
+        }
+        turn += 1
+
+
+def requirement_state_before(task):
+    # The app sends the requirement state extracted from the earlier turns
+    return extract_requirements(new_requirements(), task['history'][:-1])
+
+
+def compare(result, original):
+    return {
+        key: result[key] - original[key]
+        for key in ('input_tokens', 'output_tokens', 'latency_ms', 'response_chars', 'estimated_cost_usd')
+        if result.get(key) is not None and original.get(key) is not None
+    }
+
+
+def make_result(task, prompt_version, model, response, input_tokens, output_tokens, usage,
+                latency_ms=None, price_factor=1.0):
+    billed_input = usage.get('input_tokens') or input_tokens
+    billed_output = usage.get('output_tokens') or output_tokens
+    cost = estimate_cost(model, billed_input, billed_output, usage.get('cached_input_tokens') or 0)
+    result = {
+        'id': task['id'],
+        'session_id': task['session_id'],
+        'turn': task['turn'],
+        'prompt_version': prompt_version,
+        'model': model,
+        'query': task['query'],
+        'response': response,
+        'input_tokens': billed_input,
+        'output_tokens': billed_output,
+        'cached_input_tokens': usage.get('cached_input_tokens', 0),
+        'latency_ms': latency_ms,
+        'response_chars': len(response),
+        'estimated_cost_usd': round(cost * price_factor, 6) if cost is not None else None,
+        'original': task['original'],
+    }
+    result['delta'] = compare(result, task['original'])
+    return result
+
+
+class ResultWriter:
+    """Appends JSON lines from several threads, flushed after each line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def done_ids(path, key='id'):
+    # Ids already written by an earlier (interrupted) run
+    if not path or not os.path.exists(path):
+        return set()
+    ids = set()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                ids.add(json.loads(line)[key])
+            except (ValueError, KeyError):
+                continue  # a line cut off by the interruption
+    return ids
+
+
+def pending_tasks(sessions, skip):
+    for session in sessions:
+        for task in session_turns(session):
+            if task['id'] not in skip:
+                yield task
+
+
+def replay_turn(resources, caller, task, args):
+    timer = PhaseTimer()
+    with timer.phase('llm'):
+        response, input_tokens, output_tokens, usage = generate_response(
+            resources, task['query'], task['history'], task['current_time'],
+            query_token_count=task['history'][-1].get('token_count'),
+            requirement_state=requirement_state_before(task),
+            keep_turns=args.keep_turns, token_budget=args.token_budget,
+            caller=caller
+        )
+    return make_result(
+        task, args.prompt_version, args.model, response, input_tokens, output_tokens, usage,
+        latency_ms=timer.as_ms()['llm']
+    )
+
+
+def run_replay(resources, tasks, args):
+    caller = ResilientCaller(timeout=args.timeout, retries=3, requests_per_minute=args.rpm or None,
+                             max_workers=args.concurrency)
+    writer = ResultWriter(args.output)
+    # At most 2x concurrency tasks are queued, sessions are read one at a time
+    slots = threading.BoundedSemaphore(args.concurrency * 2)
+    count = 0
+
+    def run(task):
+        try:
+            writer.write(replay_turn(resources, caller, task, args))
+        except Exception as exc:
+            print(f"{task['id']}: {type(exc).__name__}: {exc}")
+        finally:
+            slots.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for task in tasks:
+                slots.acquire()
+                pool.submit(run, task)
+                count += 1
+    finally:
+        writer.close()
+    print(f"replayed {count} turns, retries: {caller.stats['retries']}")
+
+
+def batch_request(resources, task, args):
+    # One line of a Batch API input file, with the same messages the app would send
+    chain_inputs, _ = build_chain_inputs(
+        resources, task['query'], task['history'], task['current_time'],
+        requirement_state=requirement_state_before(task),
+        keep_turns=args.keep_turns, token_budget=args.token_budget
+    )
+    messages = resources.prompt.format_messages(**chain_inputs)
+    return {
+        'custom_id': task['id'],
+        'method': 'POST',
+        'url': '/v1/chat/completions',
+        'body': {
+            'model': args.model,
+            'messages': [{'role': API_ROLES.get(m.type, 'user'), 'content': m.content} for m in messages],
+        },
+    }
+
+
+def write_batch_file(resources, tasks, args):
+    skip = done_ids(args.batch_file, key='custom_id')
+    writer = ResultWriter(args.batch_file)
+    count = len(skip)
+    try:
+        for task in tasks:
+            if task['id'] in skip:
+                continue
+            if count >= MAX_BATCH_REQUESTS:
+                print(f"{args.batch_file} is full ({MAX_BATCH_REQUESTS} requests), run again with another file")
+                break
+            writer.write(batch_request(resources, task, args))
+            count += 1
+    finally:
+        writer.close()
+    print(f"{count} requests in {args.batch_file}")
+
+
+def submit_batch(path, args):
+    import openai
+    client = openai.OpenAI()
+    with open(path, 'rb') as f:
+        input_file = client.files.create(file=f, purpose='batch')
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint='/v1/chat/completions',
+        completion_window='24h',
+        metadata={'prompt_version': args.prompt_version, 'model': args.model},
+    )
+    print(f"submitted batch {batch.id}, fetch it later with --fetch-batch {batch.id}")
+
+
+def fetch_batch(batch_id, path):
+    import openai
+    client = openai.OpenAI()
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != 'completed':
+        print(f"batch {batch_id} is {batch.status}")
+        return False
+    with open(path, 'wb') as f:
+        f.write(client.files.content(batch.output_file_id).read())
+    return True
+
+
+def import_batch_results(resources, tasks, args):
+    # Batch API output lines become the same records as a live replay (at half price, no latency)
+    by_id = {task['id']: task for task in tasks}
+    skip = done_ids(args.output)
+    writer = ResultWriter(args.output)
+    count = 0
+    try:
+        with open(args.batch_results, encoding='utf-8') as f:
+            for line in f:
+                item = json.loads(line)
+                task = by_id.get(item['custom_id'])
+                if task is None or task['id'] in skip:
+                    continue
+                body = (item.get('response') or {}).get('body') or {}
+                if item.get('error') or not body.get('choices'):
+                    print(f"{item['custom_id']}: {item.get('error') or 'no choices'}")
+                    continue
+                response = body['choices'][0]['message']['content'] or ""
+                api_usage = body.get('usage') or {}
+                usage = {
+                    'input_tokens': api_usage.get('prompt_tokens', 0),
+                    'output_tokens': api_usage.get('completion_tokens', 0),
+                    'cached_input_tokens': (api_usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0),
+                }
+                writer.write(make_result(
+                    task, args.prompt_version, args.model, response,
+                    usage['input_tokens'], resources.token_ledger.count(response), usage,
+                    price_factor=0.5
+                ))
+                count += 1
+    finally:
+        writer.close()
+    print(f"imported {count} batch results")
+
+
+def summarize(path):
+    results = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                continue
+    if not results:
+        return
+    print(f"{len(results)} turns in {path}")
+    for key in ('input_tokens', 'output_tokens', 'latency_ms', 'response_chars', 'estimated_cost_usd'):
+        deltas = [r['delta'][key] for r in results if key in r['delta']]
+        values = [r[key] for r in results if r.get(key) is not None]
+        if values:
+            mean_delta = f"{sum(deltas) / len(deltas):+.1f}" if deltas else "n/a"
+            print(f"{key:>20}: mean {sum(values) / len(values):10.2f}  vs original {mean_delta}")
+
+
+def write_parquet(jsonl_path, parquet_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    with open(jsonl_path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    pq.write_table(pa.Table.from_pylist(records), parquet_path)
+    print(f"wrote {len(records)} rows to {parquet_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay stored Semar-Bot sessions against a prompt version/model")
+    parser.add_argument('--prompt-version', required=True, help="version from prompts/, or the label of --prompt-file")
+    parser.add_argument('--prompt-file', help="replay an unregistered prompt file instead")
+    parser.add_argument('--model', default="gpt-4o-mini")
+    parser.add_argument('--source-version', help="only replay sessions of this prompt_version")
+    parser.add_argument('--student', help="only replay sessions of this student_id")
+    parser.add_argument('--sessions', type=int, default=0, help="max number of sessions, 0 for all")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rpm', type=int, default=0, help="client-side requests per minute, 0 for no limit")
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--keep-turns', type=int, default=3)
+    parser.add_argument('--token-budget', type=int, default=3000)
+    parser.add_argument('--output', default="replay.jsonl")
+    parser.add_argument('--parquet', help="also write the results to this Parquet file")
+    parser.add_argument('--batch-file', help="write Batch API requests here instead of calling the model")
+    parser.add_argument('--submit', action='store_true', help="submit --batch-file to the Batch API")
+    parser.add_argument('--fetch-batch', help="download the output of this batch id to --batch-results")
+    parser.add_argument('--batch-results', help="import Batch API output into --output")
+    args = parser.parse_args()
+
+    load_dotenv()
+    collection = get_sessions_collection(os.getenv("MONGODB_URI"), "semar_bot_db")
+    if args.prompt_file:
+        template = load_template_file(args.prompt_file)
+    else:
+        template = get_prompt_registry(models=(args.model,)).get(args.prompt_version).template
+    resources = get_chat_resources(args.model, args.prompt_version, template)
+    sessions = load_sessions(collection, args.source_version, args.student, args.sessions)
+
+    if args.batch_file:
+        write_batch_file(resources, pending_tasks(sessions, set()), args)
+        if args.submit:
+            submit_batch(args.batch_file, args)
+        return
+
+    if args.batch_results:
+        if args.fetch_batch and not fetch_batch(args.fetch_batch, args.batch_results):
+            return
+        import_batch_results(resources, pending_tasks(sessions, set()), args)
+    else:
+        run_replay(resources, pending_tasks(sessions, done_ids(args.output)), args)
+
+    summarize(args.output)
+    if args.parquet:
+        write_parquet(args.output, args.parquet)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import re
+
+
+# Rules-based extraction of the PROJECT REQUIREMENTS from chat messages.
+# It is cheap enough to run on every message. What the assistant explicitly
+# marked as confirmed is kept apart from what the student stated (under
+# 'mentioned'); questions and alternatives ("ESP32 atau ESP8266?") are neither.
+
+REQUIREMENT_FIELDS = ('idea', 'board', 'sensor', 'network', 'protocol', 'constraints')
+
+REQUIREMENT_LABELS = {
+    'idea': "Idea",
+    'board': "Processing Board",
+    'sensor': "Sensor",
+    'network': "Network Connectivity",
+    'protocol': "Communication Protocol",
+    'constraints': "Environment Constraints",
+}
+
+BOARD_PATTERNS = [
+    (r"\besp\s*-?\s*32\b", "ESP32"),
+    (r"\besp\s*-?\s*8266\b|\bnode\s*mcu\b", "ESP8266"),
+    (r"\braspberry\s*pi\b|\brpi\b", "Raspberry Pi"),
+    (r"\barduino\s+uno\b", "Arduino Uno"),
+    (r"\barduino\s+nano\b", "Arduino Nano"),
+    (r"\barduino\s+mega\b", "Arduino Mega"),
+    (r"\barduino\b", "Arduino"),
+]
+
+SENSOR_PATTERNS = [
+    (r"\bdht\s*-?\s*11\b", "DHT11"),
+    (r"\bdht\s*-?\s*22\b", "DHT22"),
+    (r"\bds18b20\b", "DS18B20"),
+    (r"\blm\s*-?\s*35\b", "LM35"),
+    (r"\blm\s*-?\s*393\b", "LM393"),
+    (r"\bbmp\s*-?\s*280\b", "BMP280"),
+    (r"\bbme\s*-?\s*280\b", "BME280"),
+    (r"\bhc\s*-?\s*sr04\b", "HC-SR04"),
+    (r"\bmq\s*-?\s*(\d+)\b", "MQ-{0}"),
+    (r"\bpir\b", "PIR"),
+    (r"\bldr\b", "LDR"),
+    (r"\bsoil\s+moisture\b|\bkelembaban\s+tanah\b", "Soil Moisture"),
+    (r"\byf\s*-?\s*s201\b", "YF-S201"),
+]
+
+NETWORK_PATTERNS = [
+    (r"\bwi\s*-?\s*fi\b", "Wifi"),
+    (r"\bgsm\b|\bsim\s*800l?\b|\bsim\s*900\b", "GSM"),
+    (r"\blora(wan)?\b", "LoRa"),
+]
+
+PROTOCOL_PATTERNS = [
+    (r"\bmqtt\b", "MQTT"),
+    (r"\bweb\s*sockets?\b", "Websocket"),
+    (r"\bhttps?\b", "HTTP"),
+]
+
+IDEA_PATTERN = re.compile(
+    r"\b(ingin|mau|akan|want to|would like to|plan to|going to)\s+(membuat|bikin|buat|membangun|make|build|create)\b",
+    re.IGNORECASE,
+)
+CONSTRAINT_PATTERN = re.compile(
+    r"\b(maksimal|maksimum|minimal|minimum|maximum|setiap|every|jarak|distance|batas|limit)\b"
+    r"|\d+\s*(°|derajat|degrees?|detik|seconds?|menit|minutes?|cm|meter|%)",
+    re.IGNORECASE,
+)
+CONFIRMED_PATTERN = re.compile(r"✅|\(confirmed\)|terkonfirmasi", re.IGNORECASE)
+# Sentences that ask or weigh options instead of stating a choice
+QUESTION_PATTERN = re.compile(
+    r"\?\s*$|\b(atau|or|vs|versus|bedanya|perbedaan|difference|mana yang|which|apakah|bisakah)\b",
+    re.IGNORECASE,
+)
+URL_PATTERN = re.compile(r"\bhttps?://\S+|\bwww\.\S+", re.IGNORECASE)
+CHANGE_PATTERN = re.compile(r"\b(ganti|ubah|change|replace|switch)\b", re.IGNORECASE)
+
+MAX_CONSTRAINTS = 5
+MAX_IDEA_LENGTH = 200
+
+
+def new_requirements():
+    # Confirmed values per field, and the student's own statements under 'mentioned'
+    return dict({field: None for field in REQUIREMENT_FIELDS}, mentioned={field: None for field in REQUIREMENT_FIELDS})
+
+
+def requirement_value(requirements, field):
+    # Confirmed value of a field, else what the student stated
+    requirements = requirements or {}
+    return requirements.get(field) or (requirements.get('mentioned') or {}).get(field)
+
+
+def _mentions(patterns, text):
+    # Values in the order they appear in the text, a longer pattern listed first
+    # wins over a shorter one at the same position ("Arduino Uno" over "Arduino")
+    found = {}
+    for pattern, name in patterns:
+        for match in re.finditer(pattern, text, re.IGNORECASE):
+            found.setdefault(match.start(), name.format(*match.groups()))
+    return [value for _, value in sorted(found.items())]
+
+
+def hardware_mentions(text):
+    # Every board, sensor, network and protocol named in the text, sorted
+    found = set()
+    for patterns in (BOARD_PATTERNS, SENSOR_PATTERNS, NETWORK_PATTERNS, PROTOCOL_PATTERNS):
+        found.update(_mentions(patterns, text))
+    return sorted(found)
+
+
+def _last_mention(patterns, text):
+    found = _mentions(patterns, text)
+    return found[-1] if found else None
+
+
+def _sentences(text):
+    return [s.strip() for s in re.split(r"(?<=[.!?])\s+|\n+", text) if s.strip()]
+
+
+def _statements(text):
+    # Sentences of the text that are not questions or alternatives
+    return [sentence for sentence in _sentences(text) if not QUESTION_PATTERN.search(sentence)]
+
+
+def _update_hardware(values, text):
+    board = _last_mention(BOARD_PATTERNS, text)
+    if board:
+        values['board'] = board
+    sensors = list(dict.fromkeys(_mentions(SENSOR_PATTERNS, text)))
+    if sensors:
+        # A change like "ganti DHT11 ke DHT22" keeps the last sensor mentioned
+        values['sensor'] = sensors[-1:] if CHANGE_PATTERN.search(text) else sensors
+    network = _last_mention(NETWORK_PATTERNS, text)
+    if network:
+        values['network'] = network
+    protocol = _last_mention(PROTOCOL_PATTERNS, text)
+    if protocol:
+        values['protocol'] = protocol
+
+
+def update_requirements(requirements, message):
+    """Fold one chat message into the requirement dict and return the updated copy.
+
+    Lines the assistant marked as confirmed set the confirmed values, the
+    student's statements set requirements['mentioned']. Later mentions win,
+    so a user changing DHT11 to DHT22 ends on DHT22.
+    """
+    requirements = dict(requirements or new_requirements())
+    mentioned = dict(requirements.get('mentioned') or {field: None for field in REQUIREMENT_FIELDS})
+    requirements['mentioned'] = mentioned
+    # A pasted link says nothing about the protocol of the project
+    content = URL_PATTERN.sub(" ", message.get('content') or "")
+
+    if message.get('role') != 'user':
+        # Assistant suggestions are not confirmations, only confirmed lines count
+        text = "\n".join(line for line in content.splitlines() if CONFIRMED_PATTERN.search(line))
+        if text:
+            _update_hardware(requirements, text)
+        return requirements
+
+    statements = _statements(content)
+    if not statements:
+        return requirements
+    text = "\n".join(statements)
+    if mentioned['idea'] is None and requirements.get('idea') is None and IDEA_PATTERN.search(text):
+        mentioned['idea'] = content.strip()[:MAX_IDEA_LENGTH]
+    before = dict(mentioned)
+    _update_hardware(mentioned, text)
+    for field in ('board', 'sensor', 'network', 'protocol'):
+        if mentioned[field] != before[field] and requirements.get(field) not in (None, mentioned[field]):
+            # The student changed a confirmed choice, it has to be confirmed again
+            requirements[field] = None
+
+    constraints = list(mentioned['constraints'] or [])
+    for sentence in statements:
+        if CONSTRAINT_PATTERN.search(sentence) and sentence not in constraints:
+            constraints.append(sentence[:MAX_IDEA_LENGTH])
+    if constraints:
+        mentioned['constraints'] = constraints[-MAX_CONSTRAINTS:]
+    return requirements
+
+
+def format_requirements(requirements):
+    # Only values the assistant confirmed are labelled as confirmed
+    requirements = requirements or {}
+    mentioned = requirements.get('mentioned') or {}
+    lines = []
+    for field in REQUIREMENT_FIELDS:
+        value, status = requirements.get(field), "confirmed"
+        if not value:
+            value, status = mentioned.get(field), "stated by the student, not confirmed yet"
+        if isinstance(value, list):
+            value = "; ".join(value)
+        lines.append(f"- {REQUIREMENT_LABELS[field]}: {value} ({status})" if value
+                     else f"- {REQUIREMENT_LABELS[field]}: not discussed yet")
+    return "\n".join(lines)
+
+
+def extract_requirements(requirements, messages):
+    # Fold the messages of one turn (user query and AI answer) into the state
+    for message in messages:
+        requirements = update_requirements(requirements, message)
+    return requirements
+
+
+# Markers the prompt templates use for the stages of the setup flow. The setup
+# is finished once the FINAL RECORD itself is written (its "HARDWARE:" heading
+# followed by "- Finished at :"), messages may mention the record before that
+SETUP_PHASE_MARKERS = [
+    ('finished', re.compile(r"^\W*HARDWARE\W*?\n\W*Finished at\W*:", re.IGNORECASE | re.MULTILINE)),
+    ('confirmation', re.compile(r"PART 3\s*-\s*CONFIRMATION", re.IGNORECASE)),
+    ('connectivity_setup', re.compile(r"PART 2\s*-\s*CONNECTIVITY", re.IGNORECASE)),
+    ('hardware_setup', re.compile(r"PART 1\s*-\s*HARDWARE", re.IGNORECASE)),
+]
+
+
+def detect_setup_phase(chat_history, lookback=4):
+    # Stage of the setup flow from the latest assistant messages, 'requirements'
+    # until the assistant starts the PROJECT SETUP parts
+    assistant_messages = [m for m in chat_history if m.get('role') == 'assistant'][-lookback:]
+    for message in reversed(assistant_messages):
+        for phase, pattern in SETUP_PHASE_MARKERS:
+            if pattern.search(message.get('content') or ""):
+                return phase
+    return 'requirements'
@@ -0,0 +1,293 @@
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import openai
+
+
+logger = logging.getLogger(__name__)
+
+# Errors worth another attempt: throttling, timeouts, dropped connections, 5xx
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.InternalServerError,
+    TimeoutError,
+)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(text):
+    # OpenAI reset headers look like "20ms", "1.5s" or "6m0s"
+    parts = _DURATION_PART.findall(text or "")
+    if not parts:
+        return None
+    return sum(float(value) * _DURATION_UNITS[unit] for value, unit in parts)
+
+
+def retry_after(exc):
+    # Seconds the API asks us to wait, from the 429 response headers (None if absent)
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    if headers.get('retry-after-ms'):
+        return float(headers['retry-after-ms']) / 1000
+    if headers.get('retry-after'):
+        try:
+            return float(headers['retry-after'])
+        except ValueError:
+            pass
+    resets = [
+        parse_duration(headers.get(name))
+        for name in ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens')
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+def backoff_delay(attempt, exc=None, base=0.5, cap=20.0):
+    # Full jitter exponential backoff; the rate-limit headers set the floor
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    hinted = retry_after(exc) if exc is not None else None
+    if hinted is not None:
+        # A little jitter on top so throttled sessions don't come back together
+        delay = min(cap, hinted) + random.uniform(0, base)
+    return delay
+
+
+class TokenBucket:
+    """Client-side rate limiter: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        # Blocks until the tokens are available, returns the time waited (None on timeout)
+        tokens = min(tokens, self.capacity)
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return time.monotonic() - start
+                wait_time = (tokens - self._tokens) / self.rate
+            if timeout is not None and time.monotonic() - start + wait_time > timeout:
+                return None
+            time.sleep(wait_time)
+
+
+class LatencyTracker:
+    """Latencies of the last `window` successful calls, for the hedging threshold."""
+
+    def __init__(self, window=200):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, p, min_samples=20):
+        with self._lock:
+            if len(self._latencies) < min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class ResilientCaller:
+    """Timeouts, retries, rate limiting and hedging around LLM calls.
+
+    One caller is shared by every session of the process, so its token bucket
+    spreads a class-wide burst instead of sending it to the API at once.
+    `call` runs a blocking function (chain.invoke) with a per-attempt timeout
+    and, when `hedge` is on, a second identical request once the first has
+    taken longer than the recent p95. `stream` waits at most `timeout` for the
+    first chunk (retrying like `call`) and at most `gap_timeout` between later
+    chunks, after which it raises TimeoutError.
+
+    Both run the request on one of `max_workers` threads. A request that timed
+    out cannot be interrupted, it keeps its thread until the client's own
+    request timeout ends it; pass llm_kwargs() to the client so that is at
+    most `timeout`. Attempts waiting for a free thread count against their
+    timeout.
+    """
+
+    def __init__(self, timeout=60.0, retries=3, backoff_base=0.5, backoff_cap=20.0,
+                 requests_per_minute=None, burst=None, hedge=False, hedge_percentile=95,
+                 max_workers=32, gap_timeout=30.0):
+        self.timeout = timeout
+        self.gap_timeout = gap_timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.limiter = None
+        if requests_per_minute:
+            self.limiter = TokenBucket(requests_per_minute / 60, burst or max(1, requests_per_minute // 10))
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.latencies = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="semar-llm")
+        self._stats_lock = threading.Lock()
+        self.stats = {'calls': 0, 'retries': 0, 'timeouts': 0, 'hedges': 0, 'hedge_wins': 0, 'throttled_s': 0.0}
+
+    def llm_kwargs(self):
+        # ChatOpenAI settings for calls made through this caller: it retries
+        # itself, the client only bounds each request
+        return {'request_timeout': self.timeout, 'max_retries': 0}
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self.stats[name] += value
+
+    def _throttle(self):
+        if self.limiter is not None:
+            waited = self.limiter.acquire(timeout=self.timeout)
+            if waited is None:
+                raise TimeoutError("Client-side rate limit wait exceeded the timeout")
+            self._count('throttled_s', waited)
+
+    def _attempt(self, fn, args, kwargs):
+        start = time.perf_counter()
+        futures = {self._executor.submit(fn, *args, **kwargs): False}
+        hedge_after = self.latencies.percentile(self.hedge_percentile) if self.hedge else None
+        deadline = start + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                self._count('timeouts')
+                raise TimeoutError(f"LLM call took longer than {self.timeout}s")
+            wait_for = remaining
+            if hedge_after is not None and len(futures) == 1:
+                wait_for = min(remaining, max(hedge_after - (time.perf_counter() - start), 0))
+            done, _ = wait(futures, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None or len(futures) == 1:
+                    hedged = futures.pop(future)
+                    # The other request (if any) finishes in the background, its result is dropped
+                    result = future.result()
+                    if hedged:
+                        self._count('hedge_wins')
+                    self.latencies.add(time.perf_counter() - start)
+                    return result
+                # One of two requests failed, keep waiting for the other
+                futures.pop(future)
+            if not done and hedge_after is not None and len(futures) == 1:
+                if self.limiter is None or self.limiter.try_acquire():
+                    # Slower than the recent p95: send the same request again, first answer wins
+                    self._count('hedges')
+                    futures[self._executor.submit(fn, *args, **kwargs)] = True
+                # No hedge without a rate limit token, the loop then waits for the
+                # first request instead of polling
+                hedge_after = None
+
+    def call(self, fn, *args, **kwargs):
+        self._count('calls')
+        for attempt in range(self.retries + 1):
+            self._throttle()
+            try:
+                return self._attempt(fn, args, kwargs)
+            except RETRYABLE_ERRORS as exc:
+                if attempt == self.retries:
+                    raise
+                delay = backoff_delay(attempt, exc, self.backoff_base, self.backoff_cap)
+                logger.warning("LLM call failed (%s), retry %d in %.1fs", type(exc).__name__, attempt + 1, delay)
+                self._count('retries')
+                time.sleep(delay)
+
+    def _pump(self, make_stream, chunks, stop):
+        # Runs on the executor: moves the chunks of a new stream to the queue
+        stream = None
+        try:
+            stream = make_stream()
+            for chunk in stream:
+                if stop.is_set():
+                    break
+                chunks.put(('chunk', chunk))
+            chunks.put(('end', None))
+        except BaseException as exc:
+            chunks.put(('error', exc))
+        finally:
+            if stop.is_set() and hasattr(stream, 'close'):
+                stream.close()
+
+    def _next_chunk(self, chunks, timeout, stop):
+        try:
+            kind, value = chunks.get(timeout=timeout)
+        except queue.Empty:
+            # The request goes on in the background, the pump stops at its next chunk
+            stop.set()
+            self._count('timeouts')
+            raise TimeoutError(f"No chunk from the LLM stream within {timeout}s")
+        if kind == 'error':
+            raise value
+        return None if kind == 'end' else value
+
+    def stream(self, make_stream):
+        # make_stream() returns a new iterator (chain.stream is lazy, the request
+        # and its errors happen on the first next()); it is read on the executor
+        # so the deadlines hold even when the client has no timeout
+        self._count('calls')
+        for attempt in range(self.retries + 1):
+            self._throttle()
+            start = time.perf_counter()
+            chunks = queue.Queue()
+            stop = threading.Event()
+            self._executor.submit(self._pump, make_stream, chunks, stop)
+            try:
+                first = self._next_chunk(chunks, self.timeout, stop)
+                break
+            except RETRYABLE_ERRORS as exc:
+                if attempt == self.retries:
+                    raise
+                delay = backoff_delay(attempt, exc, self.backoff_base, self.backoff_cap)
+                logger.warning("LLM stream failed (%s), retry %d in %.1fs", type(exc).__name__, attempt + 1, delay)
+                self._count('retries')
+                time.sleep(delay)
+        if first is None:
+            return
+        self.latencies.add(time.perf_counter() - start)
+        try:
+            chunk = first
+            while chunk is not None:
+                yield chunk
+                chunk = self._next_chunk(chunks, self.gap_timeout, stop)
+        finally:
+            # Also when the consumer stops reading early
+            stop.set()
+
+
+_lock = threading.Lock()
+_callers = {}
+
+
+def get_resilient_caller(name="openai", **options):
+    # One caller (and rate limiter) per process, the options are used on first call
+    with _lock:
+        if name not in _callers:
+            _callers[name] = ResilientCaller(**options)
+        return _callers[name]
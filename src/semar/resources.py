@@ -0,0 +1,77 @@
+import threading
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_openai import ChatOpenAI
+
+from semar.tokens import TokenLedger
+
+
+# Process-wide resources, shared by every Streamlit session and rerun.
+# Streamlit re-executes the script on each interaction, but imported modules
+# stay loaded, so these are built once per process.
+_lock = threading.Lock()
+_token_ledgers = {}
+_chat_resources = {}
+
+
+class ChatResources:
+    """Prompt, LLM client and chain for one (model, prompt_version) pair and client settings.
+
+    Keeping the ChatOpenAI instance alive keeps its HTTP client and connection
+    pool alive, so later turns reuse open (TLS) connections.
+
+    `template` is either a single human-message string (the v1.4-v1.6 layout,
+    history rendered into the text) or a list of messages for
+    ChatPromptTemplate.from_messages (system instructions, history placeholder,
+    query last).
+    """
+
+    def __init__(self, model, prompt_version, template, llm=None, **llm_kwargs):
+        self.model = model
+        self.prompt_version = prompt_version
+        self.template = template
+        self.message_layout = not isinstance(template, str)
+        if self.message_layout:
+            self.prompt = ChatPromptTemplate.from_messages(template)
+            # Static text used for token counting: the system instructions
+            self.prompt_text = next(
+                item[1] for item in template if isinstance(item, tuple) and item[0] == "system"
+            )
+        else:
+            self.prompt = ChatPromptTemplate.from_template(template)
+            self.prompt_text = template
+        if llm is None:
+            # Usage (including cached prompt tokens) is also reported when streaming
+            llm_kwargs.setdefault('stream_usage', True)
+            llm = ChatOpenAI(model_name=model, **llm_kwargs)
+        self.llm = llm
+        self.chain = self.prompt | self.llm | StrOutputParser()
+        # Returns the AIMessage itself, so the API usage fields are kept
+        self.message_chain = self.prompt | self.llm
+        self.token_ledger = get_token_ledger(model)
+
+
+def get_token_ledger(model):
+    with _lock:
+        if model not in _token_ledgers:
+            _token_ledgers[model] = TokenLedger(model)
+        return _token_ledgers[model]
+
+
+def get_chat_resources(model, prompt_version, template, llm=None, **llm_kwargs):
+    # The template (and llm, any chat model, e.g. a local fake) is only used
+    # the first time a (model, prompt version, client settings) combination is
+    # requested; sessions asking for other timeouts or retries get their own client
+    key = (model, prompt_version, tuple(sorted(llm_kwargs.items())))
+    if key not in _chat_resources:
+        resources = ChatResources(model, prompt_version, template, llm, **llm_kwargs)
+        with _lock:
+            _chat_resources.setdefault(key, resources)
+    return _chat_resources[key]
+
+
+def clear_resources():
+    with _lock:
+        _token_ledgers.clear()
+        _chat_resources.clear()
@@ -0,0 +1,93 @@
+import logging
+import re
+
+import openai
+
+
+logger = logging.getLogger(__name__)
+
+# Model per setup phase: the requirement questions and confirmations are short
+# and templated, the PART 2 connectivity setup writes full sketches
+PHASE_MODELS = {
+    'requirements': 'gpt-4o-mini',
+    'hardware_setup': 'gpt-4o-mini',
+    'connectivity_setup': 'gpt-4o',
+    'confirmation': 'gpt-4o-mini',
+    'finished': 'gpt-4o-mini',
+}
+
+# Explicit requests for code get the code model once the setup has started;
+# words like "program", "kode" or "library" alone are common while gathering
+# requirements ("program studi", "program monitoring suhu")
+CODE_QUERY_PATTERN = re.compile(
+    r"\b(full code|complete code|source code|sketch|kode lengkap|kode sumber|contoh kode"
+    r"|(buatkan|tuliskan|berikan|minta) (saya )?kode|write (me )?(the )?code)\b",
+    re.IGNORECASE,
+)
+
+# Fallback of each model: another model, so it has its own provider rate limit
+# (gpt-4o-mini turns fall back to the larger, dearer gpt-4o)
+FALLBACK_MODELS = {
+    'gpt-4o': 'gpt-4o-mini',
+    'gpt-4o-mini': 'gpt-4o',
+}
+
+# Errors after which the turn is retried once with the fallback model
+# (TimeoutError is raised by the ResilientCaller when its own deadline passes)
+FALLBACK_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, TimeoutError)
+
+
+class ModelRouter:
+    """Picks the model of each turn from the setup phase and the query.
+
+    `timeout` and `max_retries` are passed to ChatOpenAI, a low retry count
+    moves a rate-limited turn to the fallback model instead of waiting.
+    `fallback_models` maps each model to its fallback; a model without one
+    (or with itself) has no fallback.
+    """
+
+    def __init__(self, phase_models=None, code_model='gpt-4o', default_model='gpt-4o-mini',
+                 fallback_models=None, timeout=30, max_retries=1):
+        self.phase_models = dict(PHASE_MODELS if phase_models is None else phase_models)
+        self.code_model = code_model
+        self.default_model = default_model
+        self.fallback_models = dict(FALLBACK_MODELS if fallback_models is None else fallback_models)
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+    def llm_kwargs(self):
+        return {'request_timeout': self.timeout, 'max_retries': self.max_retries}
+
+    def route(self, setup_phase, query):
+        # The choice is stored with the turn's token usage
+        if self.code_model and setup_phase != 'requirements' and CODE_QUERY_PATTERN.search(query):
+            model, reason = self.code_model, 'code_query'
+        else:
+            model, reason = self.phase_models.get(setup_phase, self.default_model), 'phase'
+        return {
+            'model': model,
+            'requested_model': model,
+            'setup_phase': setup_phase,
+            'reason': reason,
+            'fallback_used': False,
+        }
+
+    def generate(self, choice, generate, **kwargs):
+        """Run `generate(model, **kwargs)` with the chosen model.
+
+        On a timeout or rate limit it runs once more with the fallback model and
+        updates `choice`. A stream that fails after its first chunk raises
+        StreamInterrupted instead, which is not retried: part of the answer
+        has been rendered already.
+        """
+        try:
+            return generate(choice['model'], **kwargs)
+        except FALLBACK_ERRORS as exc:
+            fallback = self.fallback_models.get(choice['model'])
+            if not fallback or fallback == choice['model']:
+                raise
+            logger.warning("%s failed (%s), retrying with %s", choice['model'], type(exc).__name__, fallback)
+            choice['model'] = fallback
+            choice['fallback_used'] = True
+            choice['fallback_error'] = type(exc).__name__
+            return generate(choice['model'], **kwargs)
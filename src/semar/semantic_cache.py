@@ -0,0 +1,308 @@
+import hashlib
+import random
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import numpy as np
+from bson.objectid import ObjectId
+
+from semar.cache import normalize_text
+from semar.requirements import hardware_mentions, requirement_value
+
+
+# Semantic cache: answers paraphrased questions ("cara sambung DHT22 ke ESP32" /
+# "cara menyambung DHT22 ke ESP32") from earlier answers given in the same
+# requirement context, when the embeddings of the queries are similar enough.
+#
+# Only the query is embedded. What an embedding cannot tell apart is matched
+# exactly instead: the requirement context, the hardware named in the query
+# (DHT11 vs DHT22) and its negations ("perlu" vs "tidak perlu") are part of the
+# scope, and short replies ("ya", "sudah") are never cached, their meaning is
+# in the conversation.
+
+NEGATION_PATTERN = re.compile(
+    r"\b(tidak|tak|nggak|ngga|gak|enggak|belum|bukan|jangan|no|not|never|cannot|dont|(?:don|doesn|isn|can|won|didn) t)\b"
+)
+MIN_QUERY_WORDS = 3
+
+# Thresholds calibrated on same-language paraphrases vs different questions
+# about the same hardware; the hashing embedder does not match translations
+# ("how do I wire DHT22 to ESP32" scores 0.37 against the Indonesian query)
+EMBEDDER_THRESHOLDS = {
+    'hashing': 0.8,
+    'openai': 0.9,
+}
+
+
+class HashingEmbedder:
+    """Deterministic local embedding (hashed word and character n-grams), no network."""
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def _features(self, text):
+        text = normalize_text(text)
+        words = text.split()
+        features = list(words)
+        for word in words:
+            padded = f"#{word}#"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            digest = hashlib.md5(feature.encode()).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class OpenAIEmbedder:
+    """Embeddings from the OpenAI API, for multilingual paraphrase matching."""
+
+    def __init__(self, model="text-embedding-3-small"):
+        from langchain_openai import OpenAIEmbeddings
+        self._embeddings = OpenAIEmbeddings(model=model)
+
+    def embed(self, text):
+        vector = np.asarray(self._embeddings.embed_query(text), dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+
+class BruteForceIndex:
+    """Exact cosine search over normalized vectors with NumPy."""
+
+    def __init__(self, dim):
+        self.dim = dim
+        self._ids = []
+        self._vectors = []
+        self._matrix = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, id, vector):
+        self._ids.append(id)
+        self._vectors.append(np.asarray(vector, dtype=np.float32))
+        self._matrix = None
+
+    def remove(self, ids):
+        ids = set(ids)
+        kept = [(i, v) for i, v in zip(self._ids, self._vectors) if i not in ids]
+        self._ids = [i for i, _ in kept]
+        self._vectors = [v for _, v in kept]
+        self._matrix = None
+
+    def search(self, vector, k=1):
+        if not self._ids:
+            return []
+        if self._matrix is None:
+            self._matrix = np.vstack(self._vectors)
+        scores = self._matrix @ np.asarray(vector, dtype=np.float32)
+        top = np.argsort(-scores)[:k]
+        return [(self._ids[i], float(scores[i])) for i in top]
+
+
+class FaissIndex:
+    """Approximate (HNSW) inner-product search, when faiss is installed."""
+
+    def __init__(self, dim, neighbors=32):
+        import faiss
+        self.dim = dim
+        self._index = faiss.IndexIDMap2(faiss.IndexHNSWFlat(dim, neighbors, faiss.METRIC_INNER_PRODUCT))
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, id, vector):
+        self._index.add_with_ids(np.asarray([vector], dtype=np.float32), np.asarray([id], dtype=np.int64))
+        self._count += 1
+
+    def remove(self, ids):
+        # HNSW does not support removal, removed ids are filtered out by the cache
+        pass
+
+    def search(self, vector, k=1):
+        if not self._count:
+            return []
+        scores, ids = self._index.search(np.asarray([vector], dtype=np.float32), k)
+        return [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i != -1]
+
+
+INDEX_BACKENDS = {
+    'numpy': BruteForceIndex,
+    'faiss': FaissIndex,
+}
+
+
+def requirement_context(requirement_state):
+    # Only the hardware choices change what a correct answer looks like
+    parts = []
+    for field in ('board', 'sensor', 'network', 'protocol'):
+        value = requirement_value(requirement_state, field)
+        if isinstance(value, list):
+            value = " ".join(value)
+        parts.append(f"{field}: {value or '-'}")
+    return " | ".join(parts)
+
+
+def query_signature(query):
+    # Parts of the query that must match exactly: hardware and negations
+    text = normalize_text(query)
+    negations = sorted(set(match.group(0) for match in NEGATION_PATTERN.finditer(text)))
+    return tuple(hardware_mentions(query)), tuple(negations)
+
+
+class SemanticCache:
+    """Embedding-similarity cache of AI answers.
+
+    One index per scope: (prompt_version, model, requirement context, query
+    signature); only queries in the same scope are compared.
+
+    Hits, misses and audits are logged through `log_writer` (a BackgroundWriter
+    on the log collection). A share of hits (`audit_rate`) is flagged for audit:
+    the caller still asks the model and reports the fresh answer with record_audit.
+    """
+
+    def __init__(self, embedder, index_backend='numpy', threshold=0.8, max_entries=5000,
+                 audit_rate=0.05, log_writer=None):
+        self.embedder = embedder
+        self.index_backend = index_backend
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.audit_rate = audit_rate
+        self.log_writer = log_writer
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.audits = 0
+        self.false_hits = 0
+
+    def _scope(self, prompt_version, model, query, requirement_state):
+        return prompt_version, model, requirement_context(requirement_state), query_signature(query)
+
+    def cacheable(self, query):
+        return len(normalize_text(query).split()) >= MIN_QUERY_WORDS
+
+    def _log(self, event):
+        if self.log_writer is not None:
+            event['created_at'] = datetime.now(timezone.utc)
+            self.log_writer.submit({'_id': ObjectId()}, {'$set': event}, upsert=True)
+
+    def lookup(self, prompt_version, model, query, requirement_state=None):
+        # Returns None on a miss, otherwise the entry with its score and audit flag
+        if not self.cacheable(query):
+            return None
+        vector = self.embedder.embed(query)
+        scope = self._scope(prompt_version, model, query, requirement_state)
+        with self._lock:
+            index = self._indexes.get(scope)
+            results = [(i, s) for i, s in index.search(vector, k=3) if i in self._entries] if index else []
+            best = results[0] if results else None
+            hit = best is not None and best[1] >= self.threshold
+            if hit:
+                entry = self._entries[best[0]]
+                self._entries.move_to_end(best[0])
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        event = {
+            'type': "hit" if hit else "miss",
+            'prompt_version': prompt_version,
+            'model': model,
+            'query': query,
+            'score': best[1] if best else None,
+        }
+        if not hit:
+            self._log(event)
+            return None
+        audit = random.random() < self.audit_rate
+        event.update(matched_query=entry['query'], audit=audit)
+        self._log(event)
+        return dict(entry, score=best[1], audit=audit)
+
+    def store(self, prompt_version, model, query, requirement_state, response, token_count):
+        if not self.cacheable(query):
+            return
+        vector = self.embedder.embed(query)
+        scope = self._scope(prompt_version, model, query, requirement_state)
+        with self._lock:
+            if scope not in self._indexes:
+                self._indexes[scope] = INDEX_BACKENDS[self.index_backend](len(vector))
+            entry_id = self._next_id
+            self._next_id += 1
+            self._indexes[scope].add(entry_id, vector)
+            self._entries[entry_id] = {
+                'scope': scope, 'query': query, 'response': response, 'token_count': token_count,
+            }
+            # Least recently used entries are evicted once the cache is full
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                old_id, old_entry = self._entries.popitem(last=False)
+                evicted.append((old_entry['scope'], old_id))
+            for old_scope, old_id in evicted:
+                self._indexes[old_scope].remove([old_id])
+                if not len(self._indexes[old_scope]):
+                    del self._indexes[old_scope]
+
+    def record_audit(self, prompt_version, model, query, cached_entry, fresh_response):
+        # Compares the served cache entry with a fresh model answer, returns True on a false hit
+        similarity = float(np.dot(self.embedder.embed(cached_entry['response']), self.embedder.embed(fresh_response)))
+        false_hit = similarity < self.threshold
+        with self._lock:
+            self.audits += 1
+            self.false_hits += int(false_hit)
+        self._log({
+            'type': "false_hit" if false_hit else "audit_ok",
+            'prompt_version': prompt_version,
+            'model': model,
+            'query': query,
+            'matched_query': cached_entry['query'],
+            'score': cached_entry['score'],
+            'answer_similarity': similarity,
+        })
+        return false_hit
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'audits': self.audits,
+                'false_hits': self.false_hits,
+                'entries': len(self._entries),
+            }
+
+
+_lock = threading.Lock()
+_caches = {}
+
+EMBEDDERS = {
+    'hashing': HashingEmbedder,
+    'openai': OpenAIEmbedder,
+}
+
+
+def get_semantic_cache(embedder='hashing', index_backend='numpy', threshold=None, max_entries=5000,
+                       audit_rate=0.05, log_writer=None):
+    # One semantic cache per process, shared by every Streamlit session; the
+    # threshold defaults to the one calibrated for the embedder
+    with _lock:
+        if 'semantic' not in _caches:
+            _caches['semantic'] = SemanticCache(
+                EMBEDDERS[embedder](), index_backend,
+                threshold if threshold is not None else EMBEDDER_THRESHOLDS[embedder],
+                max_entries, audit_rate, log_writer
+            )
+        return _caches['semantic']
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pytz import timezone
+
+
+logger = logging.getLogger(__name__)
+
+# created_at and last_activity are stored as local time text in this format, so
+# they sort as text
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Sessions with at most this many stored messages have no answered turn yet
+NEAR_EMPTY_MESSAGES = 2
+
+
+def find_open_session(collection, student_id, prompt_version):
+    # Most recent session of the student for this prompt version that is not
+    # finished, through the (student_id, prompt_version, created_at) index.
+    # Only the message count is read, not the history itself.
+    pipeline = [
+        {'$match': {
+            'student_id': student_id,
+            'prompt_version': prompt_version,
+            'status': {'$ne': 'finished'},
+        }},
+        {'$sort': {'created_at': -1}},
+        {'$limit': 1},
+        {'$project': {
+            'created_at': 1,
+            'model': 1,
+            'message_count': {'$size': {'$ifNull': ['$chat_history', []]}},
+        }},
+    ]
+    documents = list(collection.aggregate(pipeline))
+    return documents[0] if documents else None
+
+
+def touch_session(collection, session_id, now):
+    # Marks a reused session as active so the sweeper keeps it; False when it
+    # was deleted meanwhile
+    return collection.update_one({'_id': session_id}, {'$set': {'last_activity': now}}).matched_count == 1
+
+
+def sweep_empty_sessions(collection, grace_minutes=60, tz='Asia/Tokyo', in_use=None):
+    """Delete duplicate near-empty sessions idle for more than `grace_minutes`.
+
+    A near-empty session (no answered turn) is deleted when the same student
+    has another session for that prompt version; when all of them are near
+    empty the newest one is kept. A session is idle since its last_activity
+    (set on reuse and on every turn), or since created_at for sessions that
+    have none. `in_use()` returns the ids (as text) of sessions a browser
+    state still points to, e.g. a student idling before the first question;
+    those are never deleted. Returns the number of deleted sessions.
+    """
+    cutoff = (datetime.now(tz=timezone(tz)) - timedelta(minutes=grace_minutes)).strftime(TIME_FORMAT)
+    pipeline = [
+        # last_activity is never before created_at, so this narrows by index first
+        {'$match': {'created_at': {'$lt': cutoff}}},
+        {'$project': {
+            'student_id': 1,
+            'prompt_version': 1,
+            'created_at': 1,
+            'last_activity': {'$ifNull': ['$last_activity', '$created_at']},
+            'message_count': {'$size': {'$ifNull': ['$chat_history', []]}},
+        }},
+        {'$match': {'last_activity': {'$lt': cutoff}}},
+        {'$sort': {'created_at': -1}},
+        {'$group': {
+            '_id': {'student_id': '$student_id', 'prompt_version': '$prompt_version'},
+            'sessions': {'$push': {'_id': '$_id', 'message_count': '$message_count'}},
+        }},
+        {'$match': {'sessions.1': {'$exists': True}}},
+    ]
+    duplicates = []
+    groups = list(collection.aggregate(pipeline))
+    kept = set(in_use()) if in_use is not None and groups else set()
+    for group in groups:
+        empty = [s['_id'] for s in group['sessions'] if s['message_count'] <= NEAR_EMPTY_MESSAGES]
+        if len(empty) == len(group['sessions']):
+            # Sessions are sorted newest first, keep that one
+            empty = empty[1:]
+        duplicates.extend(session_id for session_id in empty if str(session_id) not in kept)
+    if not duplicates:
+        return 0
+    return collection.delete_many({'_id': {'$in': duplicates}}).deleted_count
+
+
+_lock = threading.Lock()
+_sweepers = {}
+
+
+def start_session_sweeper(collection, interval=3600, grace_minutes=60, in_use=None):
+    # One daemon thread per collection and process, sweeping every `interval` seconds
+    key = (collection.database.name, collection.name)
+    with _lock:
+        if key in _sweepers:
+            return _sweepers[key]
+
+        def run():
+            while True:
+                try:
+                    deleted = sweep_empty_sessions(collection, grace_minutes, in_use=in_use)
+                    if deleted:
+                        logger.info("Deleted %d near-empty sessions from %s", deleted, collection.name)
+                except Exception:
+                    logger.exception("Session sweep failed")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name=f"semar-sweeper-{collection.name}", daemon=True)
+        thread.start()
+        _sweepers[key] = thread
+        return thread
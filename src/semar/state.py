@@ -0,0 +1,200 @@
+import copy
+import threading
+import weakref
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+# Per-browser state of the Streamlit app, kept outside st.session_state so a
+# student can be served by any replica and a restart loses nothing.
+#
+# Only the small fields below are written to the store. The chat history,
+# requirement state and other derived fields stay in the in-process LRU only;
+# on a miss, Step 3 of the app rebuilds them from the sessions collection.
+PERSISTED_KEYS = (
+    'student_info',
+    'prompt_version',
+    'experiment',
+    'open_session',
+    'session_id',
+    'render_count',
+    # Changes with every turn, so other replicas see their cached history is stale
+    'persisted_message_count',
+)
+
+_lock = threading.Lock()
+_stores = {}
+
+
+class StateConflict(Exception):
+    """The state was saved by another replica since this one loaded it."""
+
+
+class StateStore:
+    """LRU of state dicts with write-through to a backend.
+
+    get() returns the cached dict of a key (loading it from the backend on a
+    miss) and the script mutates it in place; save() writes the persisted
+    fields that changed since the last save. At most `max_states` dicts are
+    kept in memory, whatever the number of students. Runs that change a
+    state (e.g. a turn) hold lock(key), so two tabs with the same key do not
+    change the same dict at once. Across replicas, a save on top of a version
+    saved elsewhere meanwhile is dropped and the newer state is loaded
+    instead; its chat history is then rebuilt from the sessions collection.
+    """
+
+    def __init__(self, max_states=500):
+        self.max_states = max_states
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # key -> lock of its state, dropped when no run holds it
+        self._key_locks = weakref.WeakValueDictionary()
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'writes': 0, 'conflicts': 0, 'evictions': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = threading.Lock()
+                self._key_locks[key] = lock
+            return lock
+
+    def session_ids(self):
+        # Sessions the states point to, the sweeper keeps them
+        with self._lock:
+            return {entry['state']['session_id'] for entry in self._entries.values() if 'session_id' in entry['state']}
+
+    def _load(self, key):
+        # (persisted fields, version) from the backend, or None
+        return None
+
+    def _version(self, key):
+        # Version in the backend, None when it cannot be checked cheaply
+        return None
+
+    def _write(self, key, changed, removed, version):
+        # Stores the changes on top of `version`, returns the new version;
+        # StateConflict when the backend holds another version
+        return version + 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            version = self._version(key)
+            if version is None or version == entry['version']:
+                self.stats['hits'] += 1
+                return entry['state']
+            # Another replica saved a newer state of this browser since
+            self.stats['stale'] += 1
+        self.stats['misses'] += 1
+        return self._fetch(key)['state']
+
+    def _fetch(self, key):
+        # Loads the state from the backend into the LRU
+        loaded = self._load(key)
+        fields, version = loaded if loaded is not None else ({}, 0)
+        entry = {'state': copy.deepcopy(fields), 'saved': fields, 'version': version}
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_states:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+        return entry
+
+    def save(self, key, state):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry['state'] is not state:
+            # Replaced by a newer state since get(), this run's changes are dropped
+            return False
+        if entry is None:
+            # Evicted since get()
+            entry = {'state': state, 'saved': {}, 'version': self._version(key) or 0}
+        fields = {name: state[name] for name in PERSISTED_KEYS if name in state}
+        changed = {name: value for name, value in fields.items() if entry['saved'].get(name, object()) != value}
+        removed = [name for name in entry['saved'] if name not in fields]
+        if not changed and not removed:
+            return False
+        try:
+            entry['version'] = self._write(key, copy.deepcopy(changed), removed, entry['version'])
+        except StateConflict:
+            # Another replica saved this browser's state meanwhile: its state
+            # wins, the next run gets it (and reloads the chat history)
+            self.stats['conflicts'] += 1
+            self._fetch(key)
+            return False
+        entry['saved'] = copy.deepcopy(fields)
+        self.stats['writes'] += 1
+        return True
+
+
+class MemoryStateStore(StateStore):
+    """In-process only (a single replica); evicted states are lost."""
+
+
+class MongoStateStore(StateStore):
+    """Write-through to a MongoDB collection, one document per browser.
+
+    Each get() of a cached state reads the document's version by _id, so a
+    state saved meanwhile by another replica is reloaded. States not saved
+    for `ttl_days` are removed by MongoDB.
+    """
+
+    def __init__(self, collection, max_states=500, ttl_days=7):
+        super().__init__(max_states)
+        self.collection = collection
+        collection.create_index([('updated_at', ASCENDING)], expireAfterSeconds=ttl_days * 86400)
+
+    def _load(self, key):
+        document = self.collection.find_one({'_id': key})
+        if document is None:
+            return None
+        fields = {name: document[name] for name in PERSISTED_KEYS if name in document}
+        return fields, document.get('version', 0)
+
+    def session_ids(self):
+        # Of every stored state, not only the cached ones (expired states are gone)
+        return set(self.collection.distinct('session_id'))
+
+    def _version(self, key):
+        document = self.collection.find_one({'_id': key}, {'version': 1})
+        return document.get('version', 0) if document else 0
+
+    def _write(self, key, changed, removed, version):
+        update = {'$set': dict(changed, updated_at=datetime.now(timezone.utc)), '$inc': {'version': 1}}
+        if removed:
+            update['$unset'] = {name: "" for name in removed}
+        try:
+            # Only on top of the version this replica loaded; a new state (version
+            # 0) is inserted, a key taken meanwhile fails the insert
+            document = self.collection.find_one_and_update(
+                {'_id': key, 'version': version} if version else {'_id': key, 'version': {'$exists': False}},
+                update, projection={'version': 1}, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            raise StateConflict(key)
+        return document['version']
+
+
+def get_state_store(backend="mongo", collection=None, max_states=500):
+    # One store per process and backend collection, shared by every session
+    key = (backend, collection.full_name if collection is not None else None)
+    with _lock:
+        if key not in _stores:
+            if backend == "mongo":
+                _stores[key] = MongoStateStore(collection, max_states)
+            elif backend == "memory":
+                _stores[key] = MemoryStateStore(max_states)
+            else:
+                raise ValueError(f"Unknown state store backend: {backend}")
+        return _stores[key]
@@ -0,0 +1,29 @@
+import time
+
+
+def coalesce_text(deltas, interval=0.05, max_chars=200, clock=time.monotonic):
+    """Accumulated text of a stream of deltas, yielded at most every `interval`
+    seconds or once `max_chars` new characters are waiting.
+
+    The deltas are buffered in a list and joined only when a snapshot is
+    yielded, instead of concatenating the whole answer for every chunk. The
+    last snapshot always holds the full text.
+    """
+    text = ""
+    buffer = []
+    pending = 0
+    last = clock()
+    for delta in deltas:
+        if not delta:
+            continue
+        buffer.append(delta)
+        pending += len(delta)
+        now = clock()
+        if pending >= max_chars or now - last >= interval:
+            text += "".join(buffer)
+            buffer.clear()
+            pending = 0
+            last = now
+            yield text
+    if buffer or not text:
+        yield text + "".join(buffer)
@@ -0,0 +1,24 @@
+import time
+from contextlib import contextmanager
+
+
+class PhaseTimer:
+    """Wall-clock time spent in each named phase of a turn."""
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def as_ms(self):
+        return {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()}
+
+    def record(self, name, seconds):
+        # For durations measured elsewhere (time to first token, a background write)
+        self.phases[name] = seconds
@@ -0,0 +1,67 @@
+import tiktoken
+
+
+# Labels used when the prompt is flattened to text for token counting
+ROLE_LABELS = {'user': "User", 'assistant': "Assistant"}
+
+
+class TokenLedger:
+    """Incremental token counter for one model.
+
+    The static template is encoded once per prompt version and every chat
+    message is encoded once (its count is kept in message['token_count']),
+    so counting the input of a turn only sums cached integers.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.encoding = tiktoken.encoding_for_model(model)
+        self._template_tokens = {}
+        # Each message is joined as "\n<Role>: <content>", the prefix is counted once
+        self._prefix_tokens = {
+            role: len(self.encoding.encode(f"\n{label}: "))
+            for role, label in ROLE_LABELS.items()
+        }
+
+    def count(self, text):
+        return len(self.encoding.encode(text))
+
+    def template_tokens(self, prompt_version, template):
+        if prompt_version not in self._template_tokens:
+            self._template_tokens[prompt_version] = self.count(template)
+        return self._template_tokens[prompt_version]
+
+    def message_tokens(self, message):
+        # Messages loaded from old sessions (or the greeting) have no count yet
+        if 'token_count' not in message:
+            message['token_count'] = self.count(message['content'])
+        return message['token_count']
+
+    def prefix_tokens(self, role):
+        return self._prefix_tokens.get(role, self._prefix_tokens['assistant'])
+
+    def input_tokens(self, prompt_version, template, chat_history, query_tokens):
+        # Same layout as the prompt text: template, every history message, then the query
+        total = self.template_tokens(prompt_version, template)
+        for message in chat_history:
+            total += self.prefix_tokens(message['role']) + self.message_tokens(message)
+        total += self.prefix_tokens('user') + query_tokens
+        return total
+
+
+def usage_from_message(message):
+    # Token usage reported by the API for one AIMessage (or the last streamed
+    # chunk), including prompt tokens served from the provider's prompt cache.
+    # Returns an empty dict when the API did not report usage.
+    usage = getattr(message, 'usage_metadata', None) or {}
+    token_usage = (getattr(message, 'response_metadata', None) or {}).get('token_usage') or {}
+    if not usage and not token_usage:
+        return {}
+    cached = (usage.get('input_token_details') or {}).get('cache_read')
+    if cached is None:
+        cached = (token_usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0)
+    return {
+        'input_tokens': usage.get('input_tokens', token_usage.get('prompt_tokens', 0)),
+        'output_tokens': usage.get('output_tokens', token_usage.get('completion_tokens', 0)),
+        'cached_input_tokens': cached or 0,
+    }
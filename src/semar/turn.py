@@ -0,0 +1,141 @@
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from semar.history import HistoryCompactor
+from semar.tokens import usage_from_message
+
+
+# The model call of one chat turn, without any Streamlit code, so the same
+# logic runs in the app, the benchmarks and headless clients.
+
+
+def format_chat_history(chat_history):
+    # Convert chat history dicts to the messages expected by the chain
+    formatted_chat_history = []
+    for msg in chat_history:
+        if msg['role'] == 'user':
+            formatted_chat_history.append(HumanMessage(content=msg['content']))
+        elif msg['role'] == 'system':
+            formatted_chat_history.append(SystemMessage(content=msg['content']))
+        else:
+            formatted_chat_history.append(AIMessage(content=msg['content']))
+    return formatted_chat_history
+
+
+class StreamInterrupted(Exception):
+    """The answer stream failed after part of it was written to the container.
+
+    Not retried or sent to a fallback model: a second answer would be written
+    after the partial one.
+    """
+
+    def __init__(self, partial, error):
+        super().__init__(f"Answer stream interrupted after {len(partial)} characters ({type(error).__name__}: {error})")
+        self.partial = partial
+        self.error = error
+
+
+def stream_text(chunks, usage_chunks, timer=None):
+    # Text of the streamed AIMessageChunks, the chunk carrying the usage is kept aside
+    start = time.perf_counter()
+    parts = []
+    chunks = iter(chunks)
+    while True:
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        except Exception as exc:
+            if not parts:
+                raise
+            raise StreamInterrupted("".join(parts), exc) from exc
+        if chunk.usage_metadata or chunk.response_metadata.get('token_usage'):
+            usage_chunks.append(chunk)
+        if chunk.content:
+            if not parts and timer is not None:
+                timer.record('ttft', time.perf_counter() - start)
+            parts.append(chunk.content)
+            yield chunk.content
+
+
+def build_chain_inputs(resources, query, chat_history, current_time, history_summary=None,
+                       requirement_state=None, keep_turns=3, token_budget=3000, history_offset=0):
+    # Prompt inputs of one turn and the history actually sent (for token counting)
+
+    # In the message layout the query is sent last, after the time, not inside the history
+    if resources.message_layout and chat_history and chat_history[-1]['role'] == 'user':
+        chat_history = chat_history[:-1]
+
+    # Only the recent window is sent verbatim, older turns are replaced by the
+    # requirement state when one is given, or folded into the running summary
+    if requirement_state is not None or history_summary is not None:
+        compactor = HistoryCompactor(resources.token_ledger, keep_turns, token_budget)
+        if requirement_state is not None:
+            summary_message, chat_history = compactor.compact_with_state(chat_history, requirement_state)
+        else:
+            summary_message, chat_history = compactor.compact(chat_history, history_summary, history_offset)
+        if summary_message is not None:
+            chat_history = [summary_message] + chat_history
+
+    chain_inputs = {
+        "chat_history": format_chat_history(chat_history),
+        "query": query,
+        "current_time": current_time  # Pass the current time to the prompt
+    }
+    return chain_inputs, chat_history
+
+
+def generate_response(resources, query, chat_history, current_time, query_token_count=None,
+                      stream_container=None, history_summary=None, requirement_state=None,
+                      keep_turns=3, token_budget=3000, timer=None, caller=None, history_offset=0):
+    """Ask the model for the answer to `query`.
+
+    `stream_container` is anything with a write_stream(generator) method that
+    returns the full text (st, or a chat message container in the app).
+    Returns the response, the input and output token counts and the usage
+    reported by the API. `history_offset` is the position of the first
+    message of `chat_history` in the stored one. When a PhaseTimer is given, the time to first token
+    is recorded in it (the whole call when not streaming). A ResilientCaller
+    adds timeouts, retries, rate limiting and hedging to the model call.
+    """
+    chain = resources.message_chain
+    chain_inputs, chat_history = build_chain_inputs(
+        resources, query, chat_history, current_time, history_summary, requirement_state, keep_turns, token_budget,
+        history_offset
+    )
+
+    # Generate the response
+    if stream_container is not None:
+        # Render partial output into the container as chunks arrive,
+        # write_stream returns the full text once the stream ends
+        usage_chunks = []
+        if caller is not None:
+            chunks = caller.stream(lambda: chain.stream(chain_inputs))
+        else:
+            chunks = chain.stream(chain_inputs)
+        response = stream_container.write_stream(stream_text(chunks, usage_chunks, timer))
+        usage = usage_from_message(usage_chunks[-1]) if usage_chunks else {}
+    else:
+        start = time.perf_counter()
+        message = caller.call(chain.invoke, chain_inputs) if caller is not None else chain.invoke(chain_inputs)
+        if timer is not None:
+            timer.record('ttft', time.perf_counter() - start)
+        response = message.content
+        usage = usage_from_message(message)
+
+    # Token Counting
+    # Template and messages are encoded once, the ledger only sums cached counts
+    token_ledger = resources.token_ledger
+    if query_token_count is None:
+        query_token_count = token_ledger.count(query)
+
+    # Count tokens in the input (prompt + chat history + query)
+    input_token_count = token_ledger.input_tokens(
+        resources.prompt_version, resources.prompt_text, chat_history, query_token_count
+    )
+
+    # Count tokens in the assistant's response
+    output_token_count = token_ledger.count(response)
+
+    return response, input_token_count, output_token_count, usage
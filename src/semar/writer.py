@@ -0,0 +1,211 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from bson import json_util
+from pymongo.errors import ServerSelectionTimeoutError
+
+
+logger = logging.getLogger(__name__)
+
+# Updates that still fail after the retries are spooled here (one file per
+# collection) and replayed at startup
+SPOOL_DIR = os.getenv("SEMAR_WRITE_SPOOL_DIR", ".")
+
+# Errors after which the update was certainly not applied (no server was
+# reached), so it is sent again. After other errors, e.g. a connection lost
+# mid-write, it may have been applied: it is spooled instead of retried (the
+# driver's retryable writes already retried it once safely).
+NOT_APPLIED_ERRORS = (ServerSelectionTimeoutError,)
+
+_lock = threading.Lock()
+_writers = {}
+
+
+class PendingWrite:
+    """Handle of a submitted write, done once it is applied (or spooled).
+
+    matched_count is that of the applied update, None until then (and for a
+    spooled write).
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.elapsed_ms = None
+        self.matched_count = None
+
+    def finish(self, elapsed_ms=None, matched_count=None):
+        self.elapsed_ms = elapsed_ms
+        self.matched_count = matched_count
+        self.done.set()
+
+
+class BackgroundWriter:
+    """Applies MongoDB updates on a background thread, in submit order.
+
+    The queue is bounded: when it is full submit() blocks instead of dropping
+    the write. Pending writes are drained at interpreter exit, and writes that
+    keep failing are spooled to disk so they are never lost. Once a write for
+    a document (the _id of the filter) is spooled, the later writes for it are
+    spooled behind it, so the replay applies them in submit order. The writer
+    thread replays the spool whenever the queue is idle and at least every
+    `replay_interval` seconds, so those writes are held back only while
+    MongoDB keeps failing.
+    """
+
+    def __init__(self, collection, max_queue=1000, retries=3, spool_path=None, replay_interval=5.0):
+        self.collection = collection
+        self.retries = retries
+        self.replay_interval = replay_interval
+        self._last_replay = time.monotonic()
+        self.spool_path = spool_path or os.path.join(
+            SPOOL_DIR, f"pending_writes.{collection.database.name}.{collection.name}.jsonl"
+        )
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stats_lock = threading.Lock()
+        self.stats = {'written': 0, 'spooled': 0, 'replayed': 0, 'retries': 0, 'total_write_ms': 0.0, 'max_write_ms': 0.0}
+        # Documents with a spooled write, their later writes wait in the spool too
+        self._spooled = set()
+        self._closed = False
+        # Called with (collection name, write ms) after every write, e.g. by a metrics exporter
+        self.listeners = []
+        self._thread = threading.Thread(target=self._run, name="semar-mongo-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, filter, update, upsert=False):
+        pending = PendingWrite()
+        if self._closed:
+            # Shutting down, write synchronously rather than lose it
+            self._apply(filter, update, upsert, pending)
+            return pending
+        self._queue.put((filter, update, upsert, pending))
+        return pending
+
+    # Same call shape as Collection.update_one, so the writer can stand in for it
+    update_one = submit
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        # Wait until every submitted write has been applied (or spooled)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout=30):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.replay_interval)
+            except queue.Empty:
+                self._retry_spool()
+                continue
+            try:
+                if item is None:
+                    return
+                self._apply(*item)
+            finally:
+                self._queue.task_done()
+            if time.monotonic() - self._last_replay >= self.replay_interval:
+                self._retry_spool()
+
+    def _retry_spool(self):
+        # On the writer thread: applies the spooled writes in order, those
+        # still failing are spooled again (with the later writes of their document)
+        self._last_replay = time.monotonic()
+        entries = self._take_spool()
+        for entry in entries:
+            self._apply(entry['filter'], entry['update'], entry.get('upsert', False))
+        if entries:
+            with self._stats_lock:
+                self.stats['replayed'] += len(entries)
+
+    def _key(self, filter):
+        return json_util.dumps(filter.get('_id', filter))
+
+    def _apply(self, filter, update, upsert=False, pending=None):
+        with self._stats_lock:
+            behind_spool = self._key(filter) in self._spooled
+        for attempt in range(0 if behind_spool else self.retries + 1):
+            start = time.perf_counter()
+            try:
+                result = self.collection.update_one(filter, update, upsert=upsert)
+            except NOT_APPLIED_ERRORS:
+                logger.exception("MongoDB write failed (attempt %d)", attempt + 1)
+                with self._stats_lock:
+                    self.stats['retries'] += 1
+                time.sleep(min(2 ** attempt * 0.2, 5))
+                continue
+            except Exception:
+                logger.exception("MongoDB write failed and may have been applied, spooling it")
+                break
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._stats_lock:
+                self.stats['written'] += 1
+                self.stats['total_write_ms'] += elapsed
+                self.stats['max_write_ms'] = max(self.stats['max_write_ms'], elapsed)
+            if pending is not None:
+                pending.finish(elapsed, result.matched_count)
+            for listener in self.listeners:
+                try:
+                    listener(self.collection.name, elapsed)
+                except Exception:
+                    logger.exception("Write listener failed")
+            return
+        self._spool(filter, update, upsert)
+        if pending is not None:
+            pending.finish()
+
+    def _spool(self, filter, update, upsert):
+        with _lock, open(self.spool_path, "a") as f:
+            f.write(json_util.dumps({'filter': filter, 'update': update, 'upsert': upsert}) + "\n")
+        with self._stats_lock:
+            self.stats['spooled'] += 1
+            self._spooled.add(self._key(filter))
+
+    def _take_spool(self):
+        # Spooled writes, in order, removed from the spool
+        with _lock:
+            if not os.path.exists(self.spool_path):
+                return []
+            with open(self.spool_path) as f:
+                entries = [json_util.loads(line) for line in f if line.strip()]
+            os.remove(self.spool_path)
+            with self._stats_lock:
+                self._spooled.clear()
+        return entries
+
+    def replay_spool(self):
+        # Re-submit writes spooled by an earlier run, returns how many
+        entries = self._take_spool()
+        for entry in entries:
+            self.submit(entry['filter'], entry['update'], entry.get('upsert', False))
+        return len(entries)
+
+
+def get_background_writer(collection, max_queue=1000):
+    # One writer per collection and process, shared by every Streamlit session
+    key = (collection.database.name, collection.name)
+    with _lock:
+        if key not in _writers:
+            _writers[key] = BackgroundWriter(collection, max_queue)
+            replay = True
+        else:
+            replay = False
+    if replay:
+        _writers[key].replay_spool()
+    return _writers[key]
@@ -0,0 +1,6 @@
+import os
+import sys
+
+
+# The tests import semar and benchmarks from src/, like the benchmarks do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
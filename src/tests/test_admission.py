@@ -0,0 +1,161 @@
+# Run from src/:  python -m pytest tests
+import threading
+import time
+
+import pytest
+
+from semar.admission import AdmissionController, AdmissionRejected
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert condition()
+
+
+class Turn:
+    """A turn on its own thread: waits for a slot, then "calls the model" until done() is called."""
+
+    def __init__(self, controller, student, name, started, on_wait=None):
+        self.controller = controller
+        self.student = student
+        self.name = name
+        self._done = threading.Event()
+        self.error = None
+
+        def run():
+            try:
+                controller.acquire(student, on_wait)
+            except BaseException as exc:
+                self.error = exc
+                return
+            started.append(name)
+            self._done.wait()
+            controller.release(student)
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+
+    def done(self):
+        self._done.set()
+
+
+def queue_turns(controller, turns, started):
+    # Queued one after the other, so their order in the queue is known
+    queued = []
+    for student, name in turns:
+        depth = controller.snapshot()['queue_depth']
+        queued.append(Turn(controller, student, name, started))
+        wait_for(lambda: controller.snapshot()['queue_depth'] == depth + 1)
+    return queued
+
+
+def test_queued_turns_are_served_round_robin_per_student():
+    controller = AdmissionController(max_concurrent=1, poll_interval=0.01)
+    started = []
+    holder = Turn(controller, "X", "x", started)
+    wait_for(lambda: started == ["x"])
+    turns = queue_turns(controller, [("A", "a1"), ("A", "a2"), ("A", "a3"), ("B", "b1"), ("C", "c1")], started)
+    by_name = {turn.name: turn for turn in turns}
+
+    holder.done()
+    for count in range(2, 7):
+        wait_for(lambda: len(started) == count)
+        by_name[started[-1]].done()
+    # The chatty student gets one slot per round, not three in a row
+    assert started == ["x", "a1", "b1", "c1", "a2", "a3"]
+    wait_for(lambda: controller.snapshot()['active'] == 0)
+
+
+def test_a_student_at_its_limit_leaves_free_slots_to_others():
+    controller = AdmissionController(max_concurrent=3, max_per_student=2, poll_interval=0.01)
+    controller.acquire("A")
+    controller.acquire("A")
+    started = []
+    [third] = queue_turns(controller, [("A", "a3")], started)
+    assert controller.snapshot()['active'] == 2
+    # Served at once, past the queued turn of A
+    assert controller.acquire("B") < 0.5
+    assert started == []
+
+    controller.release("A")
+    wait_for(lambda: started == ["a3"])
+    third.done()
+    third.thread.join(1)
+    controller.release("A")
+    controller.release("B")
+    assert controller.snapshot()['active'] == 0
+
+
+def test_full_queue_and_timeout_are_rejected():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, timeout=0.1, poll_interval=0.01)
+    controller.acquire("A")
+    started = []
+    [waiting] = queue_turns(controller, [("B", "b1")], started)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("C")
+    assert rejected.value.reason == "queue full"
+
+    waiting.thread.join(1)
+    assert isinstance(waiting.error, AdmissionRejected)
+    assert waiting.error.reason == "timeout"
+    snapshot = controller.snapshot()
+    assert (snapshot['queue_depth'], snapshot['rejected'], snapshot['timeouts']) == (0, 1, 1)
+    controller.release("A")
+
+
+def test_queue_position_is_reported_while_waiting():
+    controller = AdmissionController(max_concurrent=1, poll_interval=0.01)
+    controller.acquire("X")
+    started = []
+    [first] = queue_turns(controller, [("A", "a1")], started)
+    positions = []
+    second = Turn(controller, "B", "b1", started, on_wait=positions.append)
+    wait_for(lambda: positions == [2])
+
+    controller.release("X")
+    wait_for(lambda: positions == [2, 1])
+    first.done()
+    wait_for(lambda: started == ["a1", "b1"])
+    second.done()
+    second.thread.join(1)
+    assert controller.snapshot()['active'] == 0
+
+
+def test_interrupted_wait_leaves_the_queue():
+    controller = AdmissionController(max_concurrent=1, poll_interval=0.01)
+    controller.acquire("X")
+
+    def rerun(position):
+        # A Streamlit rerun raised from the position callback
+        raise RuntimeError("rerun")
+
+    with pytest.raises(RuntimeError):
+        controller.acquire("A", on_wait=rerun)
+    assert controller.snapshot()['queue_depth'] == 0
+    controller.release("X")
+    assert controller.snapshot()['active'] == 0
+
+
+def test_slot_granted_during_an_interrupted_wait_is_given_back():
+    controller = AdmissionController(max_concurrent=1, poll_interval=0.01)
+    controller.acquire("X")
+    waiting, go = threading.Event(), threading.Event()
+
+    def rerun(position):
+        waiting.set()
+        go.wait()
+        raise RuntimeError("rerun")
+
+    started = []
+    turn = Turn(controller, "A", "a1", started, on_wait=rerun)
+    waiting.wait(1)
+    # The slot goes to the waiting turn while its callback is still running
+    controller.release("X")
+    wait_for(lambda: controller.snapshot()['active'] == 1)
+    go.set()
+    turn.thread.join(1)
+    assert isinstance(turn.error, RuntimeError)
+    assert controller.snapshot()['active'] == 0
+    assert controller.acquire("B") == 0.0
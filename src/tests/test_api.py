@@ -0,0 +1,125 @@
+# Run from src/:  python -m pytest tests
+import json
+from typing import Any
+
+import mongomock
+import pytest
+import tiktoken
+from bson.objectid import ObjectId
+from fastapi.testclient import TestClient
+
+from benchmarks.fake_llm import FakeChatModel
+from semar.api import ChatService, SessionConflict, create_app
+from semar.prompts import PromptRegistry
+from semar.resources import clear_resources
+
+
+QUERY = "Saya ingin membuat pemanas air berbasis IoT dengan ESP32 dan DHT22"
+
+
+class WordEncoding:
+    # Offline stand-in for the tiktoken encoding, one token per word
+    def encode(self, text, **kwargs):
+        return text.split()
+
+
+class RacingChatModel(FakeChatModel):
+    # Runs `before_answer` (once) when its answer starts, e.g. a turn of the
+    # same session on another replica
+    before_answer: Any = None
+
+    def _race(self):
+        before_answer, self.before_answer = self.before_answer, None
+        if before_answer is not None:
+            before_answer()
+
+    def _generate(self, *args, **kwargs):
+        self._race()
+        return super()._generate(*args, **kwargs)
+
+    def _stream(self, *args, **kwargs):
+        self._race()
+        return super()._stream(*args, **kwargs)
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    monkeypatch.setattr(tiktoken, 'encoding_for_model', lambda model: WordEncoding())
+    clear_resources()
+    yield RacingChatModel(time_scale=0.001, output_tokens_mean=20)
+    clear_resources()
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().db.sessions
+
+
+def service(collection, llm):
+    return ChatService(collection, PromptRegistry(), llm=llm)
+
+
+def start(chat_service):
+    return ObjectId(chat_service.start_session("1234", "Ani", prompt_version="v1.6.1")['session_id'])
+
+
+def sse_events(response):
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_turn_is_stored(collection, llm):
+    chat_service = service(collection, llm)
+    session_id = start(chat_service)
+    result = chat_service.run_turn(session_id, QUERY)
+    stored = collection.find_one({'_id': session_id})
+    greeting, user_message, answer = stored['chat_history']
+    assert user_message['content'] == QUERY
+    assert answer['content'] == result['message']['content']
+    assert result['message_index'] == 2
+    assert stored['token_usage'][0]['message_id'] == user_message['message_id']
+    assert stored['total_output_tokens'] == result['output_tokens']
+
+
+def test_turn_stored_meanwhile_by_another_replica_wins(collection, llm):
+    replica_a, replica_b = service(collection, llm), service(collection, llm)
+    session_id = start(replica_a)
+    llm.before_answer = lambda: replica_b.run_turn(session_id, "Sensor apa yang cocok?")
+    with pytest.raises(SessionConflict):
+        replica_a.run_turn(session_id, QUERY)
+    stored = collection.find_one({'_id': session_id})
+    assert [message['content'] for message in stored['chat_history'][1:2]] == ["Sensor apa yang cocok?"]
+    assert len(stored['chat_history']) == 3
+    assert len(stored['token_usage']) == 1
+
+
+def test_conflict_is_sent_as_a_409_event(collection, llm):
+    replica_a, replica_b = service(collection, llm), service(collection, llm)
+    session_id = start(replica_a)
+    llm.before_answer = lambda: replica_b.run_turn(session_id, "Sensor apa yang cocok?")
+    with TestClient(create_app(replica_a, turn_threads=2)) as client:
+        response = client.post(f"/sessions/{session_id}/turns", json={'query': QUERY})
+    event, data = sse_events(response)[-1]
+    assert event == 'error'
+    assert data['status'] == 409
+
+
+@pytest.mark.parametrize("params, status", [
+    ({'start': 1, 'limit': 1}, 200),
+    ({'limit': 0}, 422),
+    ({'limit': -5}, 422),
+    ({'limit': 201}, 422),
+    ({'start': -1, 'limit': 2}, 200),
+])
+def test_messages_limit_is_bounded(collection, llm, params, status):
+    chat_service = service(collection, llm)
+    session_id = start(chat_service)
+    chat_service.run_turn(session_id, QUERY)
+    with TestClient(create_app(chat_service, turn_threads=2)) as client:
+        response = client.get(f"/sessions/{session_id}/messages", params=params)
+    assert response.status_code == status
+    if status == 200:
+        assert response.json()['messages'][-1]['content'] == QUERY
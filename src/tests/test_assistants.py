@@ -0,0 +1,86 @@
+# Run from src/:  python -m pytest tests
+import openai
+import pytest
+
+from benchmarks.fake_assistants import REPLY, FakeAssistantsServer
+from semar.assistants import RunError, run_turn, wait_for_run
+
+
+@pytest.fixture(scope="module")
+def server():
+    with FakeAssistantsServer(run_duration=0.3) as server:
+        yield server
+
+
+@pytest.fixture
+def client(server):
+    server.configure(run_duration=0.3, final_status="completed", cut_stream=False)
+    return openai.OpenAI(base_url=server.base_url, api_key="sk-test", max_retries=0)
+
+
+@pytest.fixture
+def thread_and_assistant(client):
+    assistant = client.beta.assistants.create(name="Math Tutor", model="gpt-4o")
+    return client.beta.threads.create().id, assistant.id
+
+
+def text(messages):
+    return [block.text.value for message in messages for block in message.content]
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_completed_run_returns_its_answer(client, thread_and_assistant, stream):
+    thread_id, assistant_id = thread_and_assistant
+    messages = run_turn(client, thread_id, assistant_id, "What is the derivative of x^2?", timeout=10, stream=stream)
+    assert text(messages) == [REPLY]
+    # Only this run's answer, not the earlier ones in the thread
+    messages = run_turn(client, thread_id, assistant_id, "And of x^3?", timeout=10, stream=stream)
+    assert text(messages) == [REPLY]
+
+
+@pytest.mark.parametrize("stream", [True, False])
+@pytest.mark.parametrize("status", ["failed", "cancelled", "expired", "requires_action"])
+def test_unsuccessful_run_raises(server, client, thread_and_assistant, status, stream):
+    server.configure(final_status=status)
+    thread_id, assistant_id = thread_and_assistant
+    with pytest.raises(RunError) as info:
+        run_turn(client, thread_id, assistant_id, "What is the derivative of x^2?", timeout=10, stream=stream)
+    assert info.value.status == status
+    if status == "failed":
+        assert "fake failure" in str(info.value)
+    if status == "requires_action":
+        assert "tool outputs" in str(info.value)
+
+
+def test_stream_cut_mid_run_falls_back_to_polling(server, client, thread_and_assistant):
+    server.configure(cut_stream=True)
+    thread_id, assistant_id = thread_and_assistant
+    before = server.stats
+    messages = run_turn(client, thread_id, assistant_id, "What is the derivative of x^2?", timeout=10)
+    assert text(messages) == [REPLY]
+    assert server.stats.get('runs.retrieve', 0) > before.get('runs.retrieve', 0)
+    # The run was not started a second time
+    assert server.stats['runs.create'] == before.get('runs.create', 0) + 1
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_overlong_run_is_cancelled_at_the_timeout(server, client, thread_and_assistant, stream):
+    server.configure(run_duration=30)
+    thread_id, assistant_id = thread_and_assistant
+    cancels = server.stats.get('runs.cancel', 0)
+    with pytest.raises(RunError) as info:
+        run_turn(client, thread_id, assistant_id, "What is the derivative of x^2?", timeout=1, stream=stream)
+    assert info.value.status == "timeout"
+    assert server.stats['runs.cancel'] == cancels + 1
+    run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=info.value.run_id)
+    assert run.status == "cancelled"
+
+
+def test_wait_for_run_backs_off(server, client, thread_and_assistant):
+    server.configure(run_duration=1.0)
+    thread_id, assistant_id = thread_and_assistant
+    run = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id)
+    before = server.stats.get('runs.retrieve', 0)
+    assert wait_for_run(client, thread_id, run.id, timeout=10, initial_delay=0.1, max_delay=0.5).status == "completed"
+    # Growing delays: far fewer polls than at a fixed 0.1 s
+    assert server.stats['runs.retrieve'] - before < 8
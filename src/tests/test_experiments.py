@@ -0,0 +1,17 @@
+# Run from src/:  python -m pytest tests
+import mongomock
+
+from semar.experiments import arm_summary_pipeline
+
+
+def test_cached_turns_do_not_count_towards_turns_to_finish():
+    collection = mongomock.MongoClient().db.sessions
+    collection.insert_one({
+        'experiment': {'name': "prompt", 'arm': "v1.6.1"},
+        'status': 'finished',
+        'total_input_tokens': 30, 'total_output_tokens': 10,
+        'token_usage': [{'cache_hit': False}, {'cache_hit': True}, {}],
+    })
+    [arm] = collection.aggregate(arm_summary_pipeline("prompt"))
+    assert arm['finished'] == 1
+    assert arm['turns_to_finish'] == 2
@@ -0,0 +1,37 @@
+# Run from src/:  python -m pytest tests
+from semar.history import HistoryCompactor, new_history_summary
+
+
+class WordLedger:
+    def count(self, text):
+        return len(text.split())
+
+    def message_tokens(self, message):
+        return self.count(message['content'])
+
+
+def conversation(turns):
+    history = []
+    for n in range(turns):
+        history.append({'role': 'user', 'content': f"Saya pakai ESP32 untuk proyek {n}"})
+        history.append({'role': 'assistant', 'content': f"Board: ESP32 ✅ langkah {n}"})
+    return history
+
+
+def test_folded_count_is_a_position_in_the_stored_history():
+    compactor = HistoryCompactor(WordLedger(), keep_turns=2, token_budget=1000)
+    stored = conversation(6)
+    summary = new_history_summary()
+    # A resumed session with only the last 8 messages loaded
+    _, window = compactor.compact(stored[4:], summary, offset=4)
+    assert summary['folded_count'] == 8
+    assert window == stored[8:]
+    assert summary['requirements']['board'] == "ESP32"
+
+    # Loading earlier messages shifts the local indexes, nothing is folded twice
+    folded = summary['requirements']
+    summary_message, window = compactor.compact(stored, summary, offset=0)
+    assert summary['folded_count'] == 8
+    assert summary['requirements'] is folded
+    assert window == stored[8:]
+    assert summary_message['role'] == 'system'
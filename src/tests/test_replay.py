@@ -0,0 +1,39 @@
+# Run from src/:  python -m pytest tests
+from semar.replay import session_turns
+
+
+def message(role, content, message_id=None):
+    return {'role': role, 'content': content, **({'message_id': message_id} if message_id else {})}
+
+
+def test_turns_join_token_usage_on_the_user_message_id():
+    # The first question got no answer (e.g. a timeout), so it has no token usage
+    session = {
+        '_id': "s1",
+        'chat_history': [
+            message('assistant', "Halo"),
+            message('user', "pertanyaan pertama", "u1"),
+            message('user', "pertanyaan kedua", "u2"),
+            message('assistant', "jawaban kedua", "a2"),
+        ],
+        'token_usage': [{'message_id': "u2", 'input_tokens': 120, 'output_tokens': 30}],
+    }
+    first, second = session_turns(session)
+    assert first['original']['input_tokens'] is None
+    assert second['query'] == "pertanyaan kedua"
+    assert second['original']['input_tokens'] == 120
+    assert second['original']['response_chars'] == len("jawaban kedua")
+
+
+def test_entries_without_message_id_are_taken_in_order():
+    session = {
+        '_id': "s2",
+        'chat_history': [
+            message('user', "lama"),
+            message('assistant', "jawaban lama"),
+            message('user', "baru", "u2"),
+            message('assistant', "jawaban baru", "a2"),
+        ],
+        'token_usage': [{'input_tokens': 10}, {'message_id': "u2", 'input_tokens': 20}],
+    }
+    assert [turn['original']['input_tokens'] for turn in session_turns(session)] == [10, 20]
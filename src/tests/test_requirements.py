@@ -0,0 +1,76 @@
+# Run from src/:  python -m pytest tests
+from semar.requirements import (
+    detect_setup_phase, extract_requirements, format_requirements, new_requirements, update_requirements
+)
+
+
+def user(content):
+    return {'role': 'user', 'content': content}
+
+
+def assistant(content):
+    return {'role': 'assistant', 'content': content}
+
+
+def test_statements_are_mentions_not_confirmations():
+    requirements = update_requirements(None, user("Saya ingin membuat monitoring suhu kolam dengan ESP32 dan DHT22."))
+    assert requirements['board'] is None
+    assert requirements['mentioned']['board'] == "ESP32"
+    assert requirements['mentioned']['sensor'] == ["DHT22"]
+    assert requirements['mentioned']['idea'].startswith("Saya ingin membuat")
+    assert "ESP32 (stated by the student, not confirmed yet)" in format_requirements(requirements)
+
+
+def test_confirmed_lines_set_confirmed_values():
+    requirements = extract_requirements(new_requirements(), [
+        user("Saya pakai ESP32."),
+        assistant("Baik!\nBoard: ESP32 ✅\nSaran: gunakan MQTT untuk mengirim data."),
+    ])
+    assert requirements['board'] == "ESP32"
+    # A suggestion is not a confirmation
+    assert requirements['protocol'] is None
+    assert "Processing Board: ESP32 (confirmed)" in format_requirements(requirements)
+
+
+def test_questions_and_alternatives_are_skipped():
+    requirements = extract_requirements(new_requirements(), [
+        user("Saya pakai ESP32."),
+        user("Apa bedanya Arduino dengan Raspberry Pi? Mana yang lebih baik?"),
+        user("Lebih baik pakai MQTT atau HTTP?"),
+    ])
+    assert requirements['mentioned']['board'] == "ESP32"
+    assert requirements['mentioned']['protocol'] is None
+
+
+def test_urls_do_not_set_the_protocol():
+    requirements = update_requirements(None, user("Saya ikut tutorial ini https://randomnerdtutorials.com/esp32-dht22/"))
+    assert requirements['mentioned']['protocol'] is None
+
+
+def test_changed_choice_needs_confirming_again():
+    requirements = extract_requirements(new_requirements(), [
+        assistant("Sensor: DHT11 ✅"),
+        user("Saya ganti DHT11 ke DHT22."),
+    ])
+    assert requirements['sensor'] is None
+    assert requirements['mentioned']['sensor'] == ["DHT22"]
+
+
+def test_states_stored_before_mentions_are_read():
+    # requirement_state documents stored without 'mentioned'
+    stored = {'idea': None, 'board': "ESP32", 'sensor': None, 'network': None, 'protocol': None, 'constraints': None}
+    requirements = update_requirements(stored, user("Datanya dikirim lewat WiFi."))
+    assert requirements['board'] == "ESP32"
+    assert requirements['mentioned']['network'] == "Wifi"
+
+
+def test_only_the_final_record_finishes_the_setup():
+    chat_history = [assistant(
+        "PART 3 - CONFIRMATION PROJECT FINISH: apakah proyek sudah berjalan? "
+        "Setelah Anda konfirmasi, saya akan membuat FINAL RECORD."
+    )]
+    assert detect_setup_phase(chat_history) == 'confirmation'
+    chat_history += [user("Sudah jalan."), assistant(
+        "FINAL RECORD\n**HARDWARE:**\n- **Finished at** : 2024-09-01 10:00:00\n- Board : ESP32"
+    )]
+    assert detect_setup_phase(chat_history) == 'finished'
@@ -0,0 +1,63 @@
+# Run from src/:  python -m pytest tests
+import time
+
+import pytest
+
+from semar.resilience import ResilientCaller
+
+
+def chunks(*delays):
+    # A lazy stream yielding 1, 2, ... after the given delays
+    def make_stream():
+        for n, delay in enumerate(delays, 1):
+            time.sleep(delay)
+            yield n
+    return make_stream
+
+
+def test_stream_passes_chunks_through():
+    caller = ResilientCaller(timeout=1, retries=0)
+    assert list(caller.stream(chunks(0, 0, 0))) == [1, 2, 3]
+    assert list(caller.stream(chunks())) == []
+
+
+def test_first_chunk_deadline_is_retried_then_raised():
+    caller = ResilientCaller(timeout=0.2, retries=1, backoff_base=0.01)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        list(caller.stream(chunks(2)))
+    assert time.monotonic() - start < 1.5
+    assert caller.stats['retries'] == 1
+    assert caller.stats['timeouts'] == 2
+
+
+def test_gap_between_chunks_is_bounded():
+    caller = ResilientCaller(timeout=1, retries=3, gap_timeout=0.2)
+    received = []
+    with pytest.raises(TimeoutError):
+        for chunk in caller.stream(chunks(0, 0, 2)):
+            received.append(chunk)
+    # Not retried once chunks were passed on
+    assert received == [1, 2]
+    assert caller.stats['retries'] == 0
+
+
+def test_errors_from_the_stream_are_raised():
+    def make_stream():
+        raise ValueError("bad request")
+        yield
+
+    with pytest.raises(ValueError):
+        list(ResilientCaller(timeout=1, retries=3).stream(make_stream))
+
+
+def test_hedge_without_a_rate_limit_token_waits_instead_of_spinning():
+    caller = ResilientCaller(timeout=2, retries=0, hedge=True, requests_per_minute=60, burst=1)
+    for _ in range(20):
+        caller.latencies.add(0.01)
+    assert caller.limiter.try_acquire()
+    start = time.process_time()
+    # _throttle waits for a token, then none is left for the hedge
+    assert caller.call(time.sleep, 1.5) is None
+    assert caller.stats['hedges'] == 0
+    assert time.process_time() - start < 0.3
@@ -0,0 +1,78 @@
+# Run from src/:  python -m pytest tests
+import httpx
+import openai
+import pytest
+from langchain_core.messages import AIMessageChunk
+
+from semar.router import ModelRouter
+from semar.turn import StreamInterrupted, stream_text
+
+
+def timeout_error():
+    return openai.APITimeoutError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+
+class ListContainer:
+    def __init__(self):
+        self.written = []
+
+    def write_stream(self, deltas):
+        for delta in deltas:
+            self.written.append(delta)
+        return "".join(self.written)
+
+
+def streaming_generate(container, fail_after, failing="gpt-4o"):
+    # generate(model) as in the app: streams into the container, the failing
+    # model fails after `fail_after` chunks
+    def generate(model):
+        def chunks():
+            for n, text in enumerate([f"{model}:a", "b", "c"]):
+                if model == failing and n == fail_after:
+                    raise timeout_error()
+                yield AIMessageChunk(content=text)
+        return container.write_stream(stream_text(chunks(), [])), 0, 0, {}
+    return generate
+
+
+@pytest.mark.parametrize("phase, query, model", [
+    ('requirements', "Saya ingin membuat program monitoring suhu kolam", "gpt-4o-mini"),
+    ('requirements', "Saya mahasiswa program studi teknik elektro", "gpt-4o-mini"),
+    ('requirements', "Berikan full code untuk ESP32", "gpt-4o-mini"),
+    ('hardware_setup', "library apa yang dipakai untuk DHT22?", "gpt-4o-mini"),
+    ('hardware_setup', "Tolong berikan full code untuk ESP32", "gpt-4o"),
+    ('hardware_setup', "Buatkan kode untuk membaca DHT22", "gpt-4o"),
+    ('connectivity_setup', "Sudah tersambung", "gpt-4o"),
+])
+def test_route(phase, query, model):
+    assert ModelRouter().route(phase, query)['model'] == model
+
+
+def test_failure_before_the_first_chunk_falls_back():
+    router = ModelRouter()
+    container = ListContainer()
+    choice = router.route('connectivity_setup', "Sudah tersambung")
+    response = router.generate(choice, streaming_generate(container, fail_after=0))[0]
+    assert choice['fallback_used'] is True
+    assert response == "gpt-4o-mini:abc"
+
+
+def test_mini_turns_fall_back_to_another_model():
+    router = ModelRouter()
+    choice = router.route('requirements', "Saya mau membuat pemanas air")
+    response = router.generate(choice, streaming_generate(ListContainer(), fail_after=0, failing="gpt-4o-mini"))[0]
+    assert choice['requested_model'] == "gpt-4o-mini"
+    assert choice['fallback_used'] is True
+    assert response == "gpt-4o:abc"
+
+
+def test_failure_after_the_first_chunk_is_not_answered_twice():
+    router = ModelRouter()
+    container = ListContainer()
+    choice = router.route('connectivity_setup', "Sudah tersambung")
+    with pytest.raises(StreamInterrupted) as info:
+        router.generate(choice, streaming_generate(container, fail_after=2))
+    assert info.value.partial == "gpt-4o:ab"
+    assert isinstance(info.value.error, openai.APITimeoutError)
+    assert container.written == ["gpt-4o:a", "b"]
+    assert choice['fallback_used'] is False
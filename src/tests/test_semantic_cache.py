@@ -0,0 +1,99 @@
+# Run from src/:  python -m pytest tests
+import pytest
+
+from semar.semantic_cache import HashingEmbedder, SemanticCache
+
+
+class ListWriter:
+    """Stands in for the BackgroundWriter of the log collection."""
+
+    def __init__(self):
+        self.events = []
+
+    def submit(self, filter, update, upsert=False):
+        self.events.append(update['$set'])
+
+
+STATE = {'board': "ESP32", 'sensor': ["DHT22"], 'network': "Wifi", 'protocol': None}
+
+
+@pytest.fixture
+def cache():
+    return SemanticCache(HashingEmbedder(), threshold=0.8, audit_rate=0.0, log_writer=ListWriter())
+
+
+def test_paraphrase_hits(cache):
+    cache.store("v1.6.1", "gpt-4o-mini", "bagaimana cara menghubungkan DHT22 ke ESP32?", STATE, "Sambungkan VCC ke 3V3.", 7)
+    hit = cache.lookup("v1.6.1", "gpt-4o-mini", "bagaimana cara menghubungkan sensor DHT22 ke ESP32", STATE)
+    assert hit is not None
+    assert hit['response'] == "Sambungkan VCC ke 3V3."
+    assert hit['token_count'] == 7
+    assert hit['score'] >= 0.8
+    assert cache.stats()['hits'] == 1
+
+
+def test_different_question_misses(cache):
+    cache.store("v1.6.1", "gpt-4o-mini", "cara sambung DHT22 ke ESP32", STATE, "answer", 1)
+    assert cache.lookup("v1.6.1", "gpt-4o-mini", "cara kalibrasi DHT22 di ESP32", STATE) is None
+
+
+def test_negation_misses(cache):
+    cache.store("v1.6.1", "gpt-4o-mini", "apakah saya perlu resistor pull-up untuk DHT22", STATE, "Ya, 10k.", 3)
+    assert cache.lookup("v1.6.1", "gpt-4o-mini", "apakah saya tidak perlu resistor pull-up untuk DHT22", STATE) is None
+    cache.store("v1.6.1", "gpt-4o-mini", "programnya sudah berhasil diupload", STATE, "Bagus!", 1)
+    assert cache.lookup("v1.6.1", "gpt-4o-mini", "programnya belum berhasil diupload", STATE) is None
+
+
+def test_other_hardware_misses(cache):
+    cache.store("v1.6.1", "gpt-4o-mini", "cara sambung DHT22 ke ESP32", STATE, "answer", 1)
+    assert cache.lookup("v1.6.1", "gpt-4o-mini", "cara sambung DHT11 ke ESP32", STATE) is None
+
+
+def test_short_replies_are_never_cached(cache):
+    cache.store("v1.6.1", "gpt-4o-mini", "ya", STATE, "Baik, lanjut ke PART 2.", 5)
+    assert cache.stats()['entries'] == 0
+    assert cache.lookup("v1.6.1", "gpt-4o-mini", "ya", STATE) is None
+    assert cache.lookup("v1.6.1", "gpt-4o-mini", "tidak", STATE) is None
+
+
+def test_scopes_are_isolated(cache):
+    query = "bagaimana cara menghubungkan DHT22 ke ESP32"
+    cache.store("v1.6.1", "gpt-4o-mini", query, STATE, "answer", 1)
+    assert cache.lookup("v1.6.1", "gpt-4o-mini", query, STATE) is not None
+    assert cache.lookup("v1.5", "gpt-4o-mini", query, STATE) is None
+    assert cache.lookup("v1.6.1", "gpt-4o", query, STATE) is None
+    # Same question from a student with other hardware confirmed
+    assert cache.lookup("v1.6.1", "gpt-4o-mini", query, dict(STATE, board="ESP8266")) is None
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = SemanticCache(HashingEmbedder(), threshold=0.8, max_entries=2, audit_rate=0.0)
+    cache.store("v1.6.1", "gpt-4o-mini", "cara sambung DHT22 ke ESP32", STATE, "first", 1)
+    cache.store("v1.6.1", "gpt-4o-mini", "berapa tegangan untuk DHT22 di ESP32", STATE, "second", 1)
+    # Used again, so the second entry is now the least recently used one
+    assert cache.lookup("v1.6.1", "gpt-4o-mini", "cara sambung DHT22 ke ESP32", STATE)['response'] == "first"
+    cache.store("v1.6.1", "gpt-4o-mini", "library apa untuk membaca DHT22 di ESP32", STATE, "third", 1)
+    assert cache.stats()['entries'] == 2
+    assert cache.lookup("v1.6.1", "gpt-4o-mini", "berapa tegangan untuk DHT22 di ESP32", STATE) is None
+    assert cache.lookup("v1.6.1", "gpt-4o-mini", "cara sambung DHT22 ke ESP32", STATE)['response'] == "first"
+    assert cache.lookup("v1.6.1", "gpt-4o-mini", "library apa untuk membaca DHT22 di ESP32", STATE)['response'] == "third"
+
+
+def test_lookups_and_audits_are_logged():
+    writer = ListWriter()
+    cache = SemanticCache(HashingEmbedder(), threshold=0.8, audit_rate=1.0, log_writer=writer)
+    assert cache.lookup("v1.6.1", "gpt-4o-mini", "cara sambung DHT22 ke ESP32", STATE) is None
+    cache.store("v1.6.1", "gpt-4o-mini", "cara sambung DHT22 ke ESP32", STATE, "Sambungkan DATA ke GPIO4.", 5)
+    hit = cache.lookup("v1.6.1", "gpt-4o-mini", "gimana cara sambung DHT22 ke ESP32", STATE)
+    assert hit['audit'] is True
+
+    assert cache.record_audit("v1.6.1", "gpt-4o-mini", "gimana cara sambung DHT22 ke ESP32", hit,
+                              "Sambungkan DATA ke GPIO4.") is False
+    assert cache.record_audit("v1.6.1", "gpt-4o-mini", "gimana cara sambung DHT22 ke ESP32", hit,
+                              "Gunakan MQTT dengan broker HiveMQ untuk mengirim data.") is True
+
+    assert [event['type'] for event in writer.events] == ["miss", "hit", "audit_ok", "false_hit"]
+    assert writer.events[1]['matched_query'] == "cara sambung DHT22 ke ESP32"
+    assert all('created_at' in event for event in writer.events)
+    assert cache.stats()['audits'] == 2
+    assert cache.stats()['false_hits'] == 1
@@ -0,0 +1,24 @@
+# Run from src/:  python -m pytest tests
+from datetime import datetime, timedelta
+
+import mongomock
+from pytz import timezone
+
+from semar.sessions import TIME_FORMAT, sweep_empty_sessions
+
+
+def minutes_ago(minutes):
+    return (datetime.now(tz=timezone('Asia/Tokyo')) - timedelta(minutes=minutes)).strftime(TIME_FORMAT)
+
+
+def test_sessions_a_browser_state_points_to_are_kept():
+    collection = mongomock.MongoClient().db.sessions
+    collection.insert_one({'student_id': "1", 'prompt_version': "v1.6.1", 'created_at': minutes_ago(200),
+                           'chat_history': [{'role': 'assistant'}, {'role': 'user'}, {'role': 'assistant'}]})
+    # "Mulai sesi baru", then no question for 90 minutes
+    idle = collection.insert_one({'student_id': "1", 'prompt_version': "v1.6.1", 'created_at': minutes_ago(90),
+                                  'chat_history': []}).inserted_id
+
+    assert sweep_empty_sessions(collection, in_use=lambda: {str(idle)}) == 0
+    assert sweep_empty_sessions(collection, in_use=lambda: set()) == 1
+    assert collection.find_one({'_id': idle}) is None
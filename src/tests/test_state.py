@@ -0,0 +1,27 @@
+# Run from src/:  python -m pytest tests
+import mongomock
+
+from semar.state import MemoryStateStore, MongoStateStore
+
+
+def test_runs_of_one_key_share_a_lock():
+    store = MemoryStateStore()
+    lock = store.lock("a")
+    assert store.lock("a") is lock
+    assert store.lock("b") is not lock
+    with lock:
+        assert not store.lock("a").acquire(blocking=False)
+
+
+def test_a_save_on_top_of_another_replicas_save_is_dropped():
+    collection = mongomock.MongoClient().db.session_state
+    first, second = MongoStateStore(collection), MongoStateStore(collection)
+    state = first.get("a")
+    other = second.get("a")
+    state['session_id'] = "s1"
+    assert first.save("a", state)
+    other['session_id'] = "s2"
+    assert not second.save("a", other)
+    assert second.stats['conflicts'] == 1
+    assert second.get("a")['session_id'] == "s1"
+    assert collection.find_one({'_id': "a"})['session_id'] == "s1"
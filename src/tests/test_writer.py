@@ -0,0 +1,80 @@
+# Run from src/:  python -m pytest tests
+import time
+
+import mongomock
+from pymongo.errors import AutoReconnect
+
+from semar.persistence import build_messages_update, save_turn, write_filter
+from semar.writer import BackgroundWriter
+
+
+class Failover:
+    """A collection whose first update is applied but its reply is lost, and
+    that fails every update after it until `up` is set."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.database = collection.database
+        self.name = collection.name
+        self.calls = 0
+        self.up = False
+
+    def update_one(self, filter, update, upsert=False):
+        self.calls += 1
+        if self.up:
+            return self.collection.update_one(filter, update, upsert=upsert)
+        if self.calls == 1:
+            self.collection.update_one(filter, update, upsert=upsert)
+        raise AutoReconnect("connection closed")
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_ambiguous_failure_spools_later_writes_until_the_replay(tmp_path):
+    collection = mongomock.MongoClient().db.sessions
+    session_id = collection.insert_one({'chat_history': [], 'total_input_tokens': 0, 'total_output_tokens': 0,
+                                        'token_usage': []}).inserted_id
+    failover = Failover(collection)
+    writer = BackgroundWriter(failover, retries=3, spool_path=str(tmp_path / "spool.jsonl"), replay_interval=0.1)
+
+    chat_history = [{'role': 'user', 'content': "Halo"}]
+    writer.submit(write_filter(session_id, chat_history, 0), build_messages_update(chat_history, 0))
+    chat_history.append({'role': 'assistant', 'content': "Halo juga"})
+    save_turn(writer, session_id, chat_history, 1, 10, 5, {'total_tokens': 15})
+    writer.flush()
+    # Not retried, the turn waits behind the spooled message
+    assert writer.stats['retries'] == 0
+    assert writer.stats['written'] == 0
+
+    # The writer thread replays the spool once MongoDB is back, in submit order and only once
+    failover.up = True
+    assert wait_for(lambda: writer.stats['written'] == 2)
+    stored = collection.find_one({'_id': session_id})
+    assert [message['content'] for message in stored['chat_history']] == ["Halo", "Halo juga"]
+    assert stored['total_input_tokens'] == 10
+    assert len(stored['token_usage']) == 1
+    writer.close()
+
+
+def test_turn_write_only_matches_the_history_it_was_loaded_with():
+    collection = mongomock.MongoClient().db.sessions
+    greeting = {'role': 'assistant', 'content': "Halo!", 'message_id': "g"}
+    session_id = collection.insert_one({'chat_history': [greeting]}).inserted_id
+    mine = [dict(greeting), {'role': 'user', 'content': "Saya pakai ESP32.", 'message_id': "m"}]
+    theirs = [dict(greeting), {'role': 'user', 'content': "Saya pakai Arduino."}]
+
+    stored = write_filter(session_id, theirs, 1, stored_count=1)
+    assert collection.update_one(stored, build_messages_update(theirs, 1)).matched_count == 1
+    # This tab's user message was lost, its answer would land after theirs: the
+    # count matches, the last message does not
+    mine.append({'role': 'assistant', 'content': "Baik."})
+    stored = write_filter(session_id, mine, 2, stored_count=2)
+    assert collection.update_one(stored, build_messages_update(mine, 2)).matched_count == 0
+    theirs.append({'role': 'assistant', 'content': "Oke."})
+    stored = write_filter(session_id, theirs, 2, stored_count=2)
+    assert collection.update_one(stored, build_messages_update(theirs, 2)).matched_count == 1